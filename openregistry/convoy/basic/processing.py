@@ -6,7 +6,15 @@ from openprocurement_client.exceptions import (
     ResourceNotFound,
 )
 
-from openregistry.convoy.utils import retry_on_error, get_client_from_resource_type, LOGGER
+from openregistry.convoy.utils import (
+    LOGGER,
+    LotLockLost,
+    LotLockTimeout,
+    get_client_from_resource_type,
+    retry_on_error,
+)
+from openregistry.convoy.metrics import stage
+from openregistry.convoy.views import AssetView, LotView
 from openregistry.convoy.basic.constants import (
     AUCTION_SWITCH_STATUS_MESSAGE_ID,
     LOT_SWITCH_STATUS_MESSAGE_ID
@@ -42,36 +50,53 @@ class ProcessingBasic(object):
         self.handled_lot_types += self.config.get('aliases', [])
 
     def process_auction(self, auction):
-        if auction['status'] == 'pending.verification':
-            self.prepare_auction(auction)
-        else:
-            self.report_results(auction)
-
+        """
+        :return: True if auction or its lot was changed, False if there was
+                 nothing to do
+        :rtype: bool
+        """
+        try:
+            with self.lots_locker.lock(auction.get('merchandisingObject')):
+                if auction['status'] == 'pending.verification':
+                    return self.prepare_auction(auction)
+                return self.report_results(auction)
+        except LotLockTimeout:
+            LOGGER.warning('Postpone auction %s, its lot is processed by other '
+                           'node', auction['id'])
+            raise
+        except LotLockLost:
+            LOGGER.warning('Postpone auction %s, lock of its lot was lost '
+                           'to other node', auction['id'])
+            raise
+
+    @stage('prepare_auction', 'basic')
     def prepare_auction(self, auction_doc):
-        LOGGER.info('Prepare auction {}'.format(auction_doc.id))
+        LOGGER.info('Prepare auction %s', auction_doc.id)
         lot = self._receive_lot(auction_doc)
         if lot:
             auction_formed = self._form_auction(lot, auction_doc)
             if auction_formed:
                 self._activate_auction(lot, auction_doc)
+        return True
 
+    @stage('report_results', 'basic')
     def report_results(self, auction_doc):
-        LOGGER.info('Report auction results {}'.format(auction_doc.id))
+        LOGGER.info('Report auction results %s', auction_doc.id)
 
         lot_id = auction_doc.merchandisingObject
 
         # Get lot
         try:
-            lot = self.lots_client.get_lot(lot_id).data
+            lot = self._fetch_lot(lot_id)
         except ResourceNotFound:
-            LOGGER.warning('Lot {} not found when report auction {} results'.format(lot_id, auction_doc.id))
-            return
+            LOGGER.warning('Lot %s not found when report auction %s results', lot_id, auction_doc.id)
+            return False
 
         if lot.status != 'active.auction':
-            LOGGER.info('Auction {} results already reported to lot {}'.format(auction_doc.id, lot_id))
-            return
+            LOGGER.info('Auction %s results already reported to lot %s', auction_doc.id, lot_id)
+            return False
 
-        LOGGER.info('Received lot {} from CDB'.format(lot_id))
+        LOGGER.info('Received lot %s from CDB', lot_id)
 
         if auction_doc.status == 'complete':
             next_lot_status = 'pending.sold'
@@ -79,21 +104,25 @@ class ProcessingBasic(object):
             next_lot_status = 'active.salable'
 
         # Report results
+        self.lots_locker.ensure(lot_id)
         try:
             self.switch_lot_status(lot['id'], next_lot_status)
         except Exception as e:
-            LOGGER.error('Failed update lot info {}. {}'.format(lot_id, e.message))
+            LOGGER.error('Failed update lot info %s. %s', lot_id, e.message)
+            return False
+        return True
 
+    @stage('receive_lot', 'basic')
     def _receive_lot(self, auction_doc):
         lot_id = auction_doc.merchandisingObject
 
         # Get lot
         try:
-            lot = self.lots_client.get_lot(lot_id).data
+            lot = self._fetch_lot(lot_id)
         except ResourceNotFound:
             self.invalidate_auction(auction_doc.id)
             return
-        LOGGER.info('Received lot {} from CDB'.format(lot_id))
+        LOGGER.info('Received lot %s from CDB', lot_id)
         is_lot_unusable = bool(
             (lot.status == u'active.awaiting' and auction_doc.id != lot.auctions[-1]) or
             lot.status not in [u'active.salable', u'active.awaiting', u'active.auction']
@@ -102,8 +131,7 @@ class ProcessingBasic(object):
             # lot['status'] = 'active.salable'
             # self.lots_client.patch_resource_item(lot)
             LOGGER.warning(
-                'Lot status \'{}\' not equal \'active.salable\''.format(
-                    lot.status),
+                'Lot status \'%s\' not equal \'active.salable\'', lot.status,
                 extra={'MESSAGE_ID': 'invalid_lot_status'})
             self.invalidate_auction(auction_doc.id)
             return
@@ -120,12 +148,14 @@ class ProcessingBasic(object):
         auctions_list = lot.get('auctions', [])
         auctions_list.append(auction_doc.id)
         lot_patch_data = {'data': {'status': 'active.awaiting', 'auctions': auctions_list}}
+        self.lots_locker.ensure(lot.id)
         self._patch_resource_item(
             self.lots_client, lot.id, lot_patch_data,
-            'Lock lot {}'.format(lot.id), {'MESSAGE_ID': 'lock_lot'}
+            'Lock lot %s', {'MESSAGE_ID': 'lock_lot'}, (lot.id,)
         )
         return lot
 
+    @stage('form_auction', 'basic')
     def _form_auction(self, lot, auction_doc):
         # Convert assets to items
         items, documents = self._create_items_from_assets(lot.assets)
@@ -136,13 +166,14 @@ class ProcessingBasic(object):
             return False
 
         api_auction_doc = self.auctions_client.get_resource_item(auction_doc['id']).data
-        LOGGER.info('Received auction {} from CDB'.format(auction_doc['id']))
+        LOGGER.info('Received auction %s from CDB', auction_doc['id'])
 
         # Add items to CDB
+        self.lots_locker.ensure(lot.id)
         patch_data = {'data': {'items': items, 'dgfID': lot.lotIdentifier}}
-        message = 'Auction: {} was formed from lot: {}'.format(auction_doc['id'], lot.id)
         self._patch_resource_item(
-            self.auctions_client, api_auction_doc.id, patch_data, message
+            self.auctions_client, api_auction_doc.id, patch_data,
+            'Auction: %s was formed from lot: %s', args=(auction_doc['id'], lot.id)
         )
 
         # Add documents to CDB
@@ -151,15 +182,16 @@ class ProcessingBasic(object):
                 api_auction_doc.id, {'data': document}, DOCUMENTS
             )
             LOGGER.info(
-                'Added document with hash {} to auction id: {} item id:'
-                ' {} in CDB'.format(document['hash'],
-                                    auction_doc['id'],
-                                    document['relatedItem'])
+                'Added document with hash %s to auction id: %s item id:'
+                ' %s in CDB', document['hash'], auction_doc['id'],
+                document['relatedItem']
             )
         return True
 
+    @stage('activate_auction', 'basic')
     def _activate_auction(self, lot, auction_doc):
         # Switch lot
+        self.lots_locker.ensure(lot['id'])
         self.switch_lot_status(lot['id'], 'active.auction')
 
         # Switch auction
@@ -174,13 +206,13 @@ class ProcessingBasic(object):
     def switch_lot_status(self, lot_id, status):
         self._switch_resource_status('lot', lot_id, status)
 
+    @stage('create_items', 'basic')
     def _create_items_from_assets(self, assets_ids):
         items = []
         documents = []
         for index, asset_id in enumerate(assets_ids):
-            asset = self.assets_client.get_asset(asset_id).data
-            LOGGER.info('Received asset {} with status {}'.format(
-                asset.id, asset.status))
+            asset = self._fetch_asset(asset_id)
+            LOGGER.info('Received asset %s with status %s', asset.id, asset.status)
 
             # Convert asset to item
             item = {k: asset[k] for k in self.keys if k in asset}
@@ -199,6 +231,19 @@ class ProcessingBasic(object):
 
         return items, documents
 
+    def _fetch_lot(self, lot_id):
+        lot = self.lots_client.get_lot(lot_id).data
+        if self.config.get('views'):
+            return LotView(lot, loader=lambda: self.lots_client.get_lot(lot_id).data)
+        return lot
+
+    def _fetch_asset(self, asset_id):
+        asset = self.assets_client.get_asset(asset_id).data
+        if self.config.get('views'):
+            return AssetView(asset, loader=lambda: self.assets_client.get_asset(asset_id).data)
+        return asset
+
+    @stage('get_documents', 'basic')
     def _get_documents(self, item):
         if not hasattr(self.auctions_client, 'ds_client'):
             return []
@@ -209,8 +254,8 @@ class ProcessingBasic(object):
             }
             try:
                 registered_doc = self.auctions_client.ds_client.register_document_upload(doc['hash'])
-                LOGGER.info('Registered document upload for item {} with hash'
-                            ' {}'.format(item.id, doc['hash']))
+                LOGGER.info('Registered document upload for item %s with hash'
+                            ' %s', item.id, doc['hash'])
             except:
                 LOGGER.error('While registering document upload '
                              'something went wrong :(')
@@ -238,15 +283,17 @@ class ProcessingBasic(object):
             log_extra['MESSAGE_ID'] = AUCTION_SWITCH_STATUS_MESSAGE_ID
             log_extra['STATUS'] = status
 
-        message = 'Switch {} {} status to {} '.format(resource_type, resource_id, status)
         client = get_client_from_resource_type(self, resource_type)
         patch_data = {'data': {'status': status}}
 
-        resource = self._patch_resource_item(client, resource_id, patch_data, message, log_extra)
+        resource = self._patch_resource_item(
+            client, resource_id, patch_data, 'Switch %s %s status to %s ', log_extra,
+            (resource_type, resource_id, status)
+        )
         return resource
 
     @retry(stop_max_attempt_number=5, retry_on_exception=retry_on_error, wait_fixed=2000)
-    def _patch_resource_item(self, client, resource_id, patch_data, message, extra=None):
+    def _patch_resource_item(self, client, resource_id, patch_data, message, extra=None, args=()):
         resource = client.patch_resource_item(resource_id, patch_data)
-        LOGGER.info(message, extra=extra)
+        LOGGER.info(message, *args, extra=extra)
         return resource
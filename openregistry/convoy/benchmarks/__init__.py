@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+from copy import deepcopy
+from time import time
+
+from lazydb import Db as LazyDB
+from yaml import safe_load as load
+
+from openregistry.convoy.constants import DEFAULTS
+from openregistry.convoy.utils import prepare_couchdb
+
+
+def load_config(path):
+    """Read convoy configuration the same way openregistry_convoy does"""
+    config = deepcopy(DEFAULTS)
+    if path and os.path.isfile(path):
+        with open(path) as config_file_obj:
+            config.update(load(config_file_obj.read()))
+    return config
+
+
+def get_db(config):
+    if config['db'].get('login', '') and config['db'].get('password', ''):
+        db_url = "http://{login}:{password}@{host}:{port}".format(**config['db'])
+    else:
+        db_url = "http://{host}:{port}".format(**config['db'])
+    return prepare_couchdb(db_url, config['db']['name'])
+
+
+def destroy_lazydb(name):
+    """Remove temporary lazydb, some dbm backends keep it in several files"""
+    try:
+        LazyDB.destroy(name)
+    except OSError:
+        for suffix in ('.bak', '.dat', '.dir', '.db'):
+            if os.path.isfile(name + suffix):
+                os.remove(name + suffix)
+
+
+def auction_types_from_config(config):
+    """Procurement method types by lot type, as Convoy registers them"""
+    auction_types = {}
+    for lot_type in ('loki', 'basic'):
+        lot_config = config['lots'].get(lot_type)
+        if not lot_config:
+            continue
+        auction_types[lot_type] = []
+        for _, auction_aliases in lot_config.get('auctions', {}).items():
+            auction_types[lot_type] += auction_aliases
+    return auction_types
+
+
+def measure(func, repeat=3):
+    """
+    Call `func` `repeat` times.
+
+    :return: durations of calls in seconds and result of last call
+    :rtype: tuple
+    """
+    timings = []
+    result = None
+    for _ in xrange(repeat):
+        started = time()
+        result = func()
+        timings.append(time() - started)
+    return timings, result
+
+
+def percentile(values, q):
+    """Value below which `q` percent of `values` fall, nearest rank method"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100.0 * len(values))) - 1))]
+
+
+def report(name, timings, units=0, unit_name='items'):
+    """Print best and median duration of benchmark and return them"""
+    timings = sorted(timings)
+    result = {
+        'name': name,
+        'best': timings[0],
+        'median': timings[len(timings) // 2],
+    }
+    line = '{name:<40} best {best:10.4f}s  median {median:10.4f}s'.format(**result)
+    if units:
+        result['rate'] = units / result['median'] if result['median'] else 0
+        line += '  {:12.1f} {}/s'.format(result['rate'], unit_name)
+    sys.stdout.write(line + '\n')
+    return result
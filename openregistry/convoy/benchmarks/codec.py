@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Compare decode throughput of installed JSON codecs on auction documents:
+
+    python -m openregistry.convoy.benchmarks.codec [--file changes.jsonl ...]
+
+Files with one JSON document per line, like changes recorded with
+`openregistry_convoy_record`, are supported. Without files auctions of
+realistic size, the same as in views benchmark, are decoded.
+"""
+import argparse
+import json
+
+from openregistry.convoy.benchmarks import measure, report
+from openregistry.convoy.benchmarks.documents import synthetic_auction
+from openregistry.convoy.codec import available_codecs, get_codec
+
+
+def read_documents(paths):
+    documents = []
+    for path in paths:
+        with open(path) as document_file:
+            content = document_file.read()
+        lines = [line for line in content.splitlines() if line.strip()]
+        if len(lines) > 1 and all(line.lstrip().startswith('{') and line.rstrip().endswith('}')
+                                  for line in lines):
+            documents.extend(lines)
+        else:
+            documents.append(content)
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- Convoy JSON codecs benchmark ---')
+    parser.add_argument('--file', dest='files', action='append',
+                        help='Recorded auctions or changes, defaults to synthetic auctions')
+    parser.add_argument('--auctions', type=int, default=10,
+                        help='Number of synthetic auctions')
+    parser.add_argument('--number', type=int, default=1000,
+                        help='Decodes of every document per round')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of rounds')
+    params = parser.parse_args()
+
+    if params.files:
+        documents = read_documents(params.files)
+    else:
+        documents = [json.dumps(synthetic_auction()) for _ in xrange(params.auctions)]
+    total = len(documents) * params.number
+
+    def decode_all(loads):
+        for _ in xrange(params.number):
+            for document in documents:
+                loads(document)
+
+    results = []
+    for name in available_codecs():
+        loads = get_codec(name).loads
+        timings, _ = measure(lambda: decode_all(loads), params.repeat)
+        results.append(report('decode {}'.format(name), timings, total, 'docs'))
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic documents of realistic size and shape for benchmarks, generated
+in memory, so benchmarks do not depend on test files, which are not
+installed with the package.
+"""
+from uuid import uuid4
+
+DATE = '2018-06-21T18:14:18.434950+03:00'
+DS_HOST = 'http://docs-sandbox.openprocurement.org'
+
+
+def address():
+    return {
+        'postalCode': '02232',
+        'countryName': u'Україна',
+        'streetAddress': u'проспект Володимира Маяковського, 93В',
+        'region': u'місто Київ',
+        'locality': u'Київ',
+    }
+
+
+def organization():
+    return {
+        'name': u'Державне управління справами',
+        'identifier': {'scheme': 'UA-EDR', 'id': '00037256', 'uri': 'http://www.dus.gov.ua/'},
+        'contactPoint': {'name': u'Державне управління справами', 'telephone': '0440000000'},
+        'address': address(),
+    }
+
+
+def signed_url(path, file_id):
+    return '{}/{}/{}?KeyID=d06070b8&Signature={}'.format(DS_HOST, path, file_id, uuid4().hex * 2)
+
+
+def document(related_item):
+    return {
+        'id': uuid4().hex,
+        'hash': 'md5:{}'.format(uuid4().hex),
+        'title': 'Notice.pdf',
+        'description': 'document description',
+        'format': 'application/pdf',
+        'url': signed_url('get', uuid4().hex),
+        'documentOf': 'asset',
+        'documentType': 'technicalSpecifications',
+        'relatedItem': related_item,
+        'datePublished': DATE,
+        'dateModified': DATE,
+    }
+
+
+def item():
+    return {
+        'id': uuid4().hex,
+        'description': u'Земля для військовослужбовців',
+        'classification': {'scheme': 'CPV', 'id': '19110000-0', 'description': u'Замша'},
+        'additionalClassifications': [{'scheme': 'CPVS', 'id': 'PA01-7', 'description': u'Оренда'}],
+        'address': address(),
+        'unit': {'code': 'H87', 'name': u'штуки'},
+        'quantity': 3,
+    }
+
+
+def synthetic_asset(items=1, documents=1):
+    """Asset with `items` items and `documents` documents"""
+    asset_id = uuid4().hex
+    return {
+        'id': asset_id,
+        'assetID': 'UA-2017-08-17-000035',
+        'assetType': 'basic',
+        'status': 'active',
+        'relatedLot': uuid4().hex,
+        'title': u'Виламуватися облудність стругнути.',
+        'description': u'i-1e63b160: Легкові автомобілі',
+        'description_en': 'i-cbf739d2: Cars',
+        'description_ru': u'i-5a58c5f6: Легковые автомобили',
+        'classification': {'scheme': 'CAV', 'id': '39513200-3', 'description': u'Легкові автомобілі'},
+        'additionalClassifications': [{'scheme': 'CPVS', 'id': 'PA01-7', 'description': u'Найм'}],
+        'address': address(),
+        'unit': {'code': 'H87', 'name': u'штуки'},
+        'quantity': 3,
+        'value': {'currency': 'UAH', 'amount': 1023538.07, 'valueAddedTaxIncluded': True},
+        'assetCustodian': organization(),
+        'owner': 'test.quintagrpoup.com',
+        'date': DATE,
+        'dateModified': DATE,
+        'items': [item() for _ in xrange(items)],
+        'documents': [document(asset_id) for _ in xrange(documents)],
+    }
+
+
+def synthetic_contract():
+    return {
+        'id': uuid4().hex,
+        'awardID': uuid4().hex,
+        'contractID': 'UA-EA-2018-06-18-000001-1',
+        'title': 'test title',
+        'description': 'test description',
+        'status': 'active',
+        'signingPeriod': {'startDate': DATE, 'endDate': DATE},
+        'dateSigned': DATE,
+        'date': DATE,
+        'documents': [],
+        'items': [item()],
+        'suppliers': [organization()],
+        'value': {'currency': 'UAH', 'amount': 479.0, 'valueAddedTaxIncluded': True},
+        'quantity': 5,
+    }
+
+
+def register_response():
+    """Response of Document Service to registration of upload"""
+    file_id = uuid4().hex
+    return {
+        'upload_url': signed_url('upload', file_id),
+        'data': {'url': signed_url('get', file_id), 'hash': 'md5:{}'.format(uuid4().hex)},
+    }
+
+
+def synthetic_auction():
+    """Auction document of realistic size"""
+    asset = synthetic_asset()
+    contract = synthetic_contract()
+    auction_id = uuid4().hex
+    return {
+        '_id': auction_id,
+        'id': auction_id,
+        'doc_type': 'Auction',
+        'status': 'complete',
+        'procurementMethodType': 'sellout.english',
+        'merchandisingObject': uuid4().hex,
+        'contractTerms': {'type': 'yoke'},
+        'contracts': [contract],
+        'title': asset['title'],
+        'description': asset['description'],
+        'items': asset['items'],
+        'documents': asset['documents'] * 5,
+        'bids': [{'id': uuid4().hex, 'tenderers': [contract['suppliers']],
+                  'value': contract['value']} for _ in range(10)],
+        'questions': [{'id': uuid4().hex, 'description': asset['description']} for _ in range(5)],
+        'awards': [{'id': uuid4().hex, 'suppliers': contract['suppliers'],
+                    'value': contract['value']} for _ in range(3)],
+    }
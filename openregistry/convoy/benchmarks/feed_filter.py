@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Compare changes feed filtering by javascript filter doc and by Mango
+selector on the same database:
+
+    python -m openregistry.convoy.benchmarks.feed_filter convoy.yaml
+"""
+import argparse
+
+from openregistry.convoy.benchmarks import (
+    auction_types_from_config,
+    get_db,
+    load_config,
+    measure,
+    report,
+)
+from openregistry.convoy.utils import (
+    convoy_feed_selector,
+    get_changes_page,
+    push_filter_doc,
+)
+
+
+def read_feed(db, limit, selector=None):
+    """Read whole filtered changes feed, return number of rows"""
+    since = 0
+    rows = 0
+    while True:
+        data = get_changes_page(db, since, limit, selector=selector)
+        rows += len(data['results'])
+        if len(data['results']) < limit:
+            return rows
+        since = data['last_seq']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- Convoy feed filter benchmark ---')
+    parser.add_argument('config', type=str, help='Path to configuration file')
+    parser.add_argument('--limit', type=int, default=100, help='Changes page size')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of feed reads per mode')
+    params = parser.parse_args()
+
+    config = load_config(params.config)
+    db = get_db(config)
+    auction_types = auction_types_from_config(config)
+    push_filter_doc(db, auction_types)
+    selector = convoy_feed_selector(auction_types)
+
+    results = []
+    for name, mode_selector in (('design_doc', None), ('selector', selector)):
+        timings, rows = measure(
+            lambda: read_feed(db, params.limit, mode_selector), params.repeat
+        )
+        results.append(report('feed filter {} ({} rows)'.format(name, rows),
+                              timings, rows, 'rows'))
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
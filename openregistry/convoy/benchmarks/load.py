@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Run convoy end to end against simulated CouchDB, APIs and Document Service
+until every generated auction is processed:
+
+    python -m openregistry.convoy.benchmarks.load convoy.yaml simulator.yaml
+"""
+from openregistry.convoy.convoy import Convoy  # patches stdlib with gevent first
+
+import argparse
+import sys
+from time import time
+from uuid import uuid4
+
+
+from openregistry.convoy.benchmarks import destroy_lazydb, load_config, percentile
+from openregistry.convoy.simulator import (
+    Simulator,
+    load_scenario,
+    match_selector,
+    serve,
+)
+
+
+def simulated_config(config, simulator, host, port):
+    """Point convoy configuration to simulator"""
+    url = 'http://{}:{}'.format(host, port)
+    config['db'].update({'host': host, 'port': str(port), 'login': '', 'password': ''})
+    for section in ('auctions', 'lots', 'assets', 'contracts'):
+        config.setdefault(section, {}).setdefault('api', {}).update({
+            'url': url, 'version': simulator.scenario.get('api_version', 0)
+        })
+    config['auctions'].setdefault('ds', {})['host_url'] = url + '/ds'
+    for lot_type in ('loki', 'basic'):
+        if simulator.auctions_types.get(lot_type):
+            lot_config = config['lots'].get(lot_type) or {'aliases': [lot_type]}
+            lot_config['auctions'] = {'simulated': simulator.auctions_types[lot_type]}
+            config['lots'][lot_type] = lot_config
+        else:
+            config['lots'].pop(lot_type, None)
+    config['auctions_mapping'] = {'name': 'load_auctions_mapping_{}'.format(uuid4().hex)}
+    config.pop('lots_locker', None)
+    config['timeout'] = 0.1
+    return config
+
+
+def run_load(config, simulator):
+    """
+    Process all auctions of simulator by convoy.
+
+    :return: number of processed auctions, elapsed seconds and durations
+             of `process_auction` calls
+    :rtype: tuple
+    """
+    expected = len([doc for doc in simulator.docs.values()
+                    if match_selector(doc, simulator.feed_selector)])
+    if not expected:
+        return 0, 0, []
+    convoy = Convoy(config)
+    durations = []
+    process_auction = convoy.process_auction
+
+    def timed_process_auction(auction):
+        started = time()
+        process_auction(auction)
+        durations.append(time() - started)
+        if len(durations) >= expected:
+            convoy.killer.kill_now = True
+    convoy.process_auction = timed_process_auction
+
+    started = time()
+    try:
+        convoy.run()
+    finally:
+        convoy.stop_transmitting = True
+        destroy_lazydb(config['auctions_mapping']['name'])
+    # run sleeps for a second before reading feed
+    return len(durations), time() - started - 1, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- Convoy load benchmark ---')
+    parser.add_argument('config', type=str, help='Path to configuration file')
+    parser.add_argument('scenario', type=str, nargs='?', help='Path to simulator scenario file')
+    params = parser.parse_args()
+
+    simulator = Simulator(load_scenario(params.scenario))
+    server = serve(simulator)
+    host, port = server.address[:2]
+    try:
+        config = simulated_config(load_config(params.config), simulator, host, port)
+        processed, elapsed, durations = run_load(config, simulator)
+    finally:
+        server.stop()
+
+    requests = simulator.stats['requests']
+    api_calls = sum(count for group, count in requests.items() if group != 'couchdb')
+    per_auction = float(processed) or 1
+    lines = [
+        'auctions processed        {}'.format(processed),
+        'auctions/s                {:.1f}'.format(processed / elapsed if elapsed > 0 else 0),
+        'API calls per auction     {:.2f}'.format(api_calls / per_auction),
+        'CouchDB calls per auction {:.2f}'.format(requests['couchdb'] / per_auction),
+        'auction latency p50/p99   {:.4f}s / {:.4f}s'.format(
+            percentile(durations, 50), percentile(durations, 99)),
+        'request latency p50/p99   {:.4f}s / {:.4f}s'.format(
+            percentile(simulator.stats['timings'], 50),
+            percentile(simulator.stats['timings'], 99)),
+        'requests by service       {}'.format(
+            ', '.join('{}={}'.format(group, count) for group, count in sorted(requests.items()))),
+        'injected errors           {}'.format(
+            ', '.join('{}={}'.format(status, count)
+                      for status, count in sorted(simulator.stats['errors'].items())) or 'none'),
+    ]
+    sys.stdout.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of convoy processing hot paths with stubbed clients.
+Results are compared with saved baseline, run fails if any benchmark
+became slower than baseline by more than threshold:
+
+    openregistry_convoy_benchmarks --save        # store baseline
+    openregistry_convoy_benchmarks --threshold 0.2
+"""
+from openregistry.convoy.convoy import Convoy  # patches stdlib with gevent first
+
+import argparse
+import json
+import os
+import sys
+from uuid import uuid4
+
+from gevent.queue import Queue
+from munch import munchify
+
+from openregistry.convoy.basic.processing import ProcessingBasic
+from openregistry.convoy.benchmarks import destroy_lazydb, measure, report
+from openregistry.convoy.benchmarks.documents import register_response, synthetic_asset, synthetic_auction
+from openregistry.convoy.constants import DOCUMENT_KEYS, KEYS
+from openregistry.convoy.loki.processing import ProcessingLoki
+from openregistry.convoy.profiling import Profiler
+from openregistry.convoy.utils import (
+    AuctionsMapping,
+    LotsLocker,
+    continuous_changes_feed,
+    make_contract,
+)
+
+BASELINE_FILE = 'convoy_benchmarks.json'
+
+
+class StubDSClient(object):
+
+    def __init__(self):
+        self.response = register_response()
+
+    def register_document_upload(self, hash_value):
+        return munchify(self.response)
+
+
+class StubClient(object):
+    """API client, which returns prepared resources without network calls"""
+
+    def __init__(self, resources=None):
+        self.resources = resources or {}
+        self.ds_client = StubDSClient()
+
+    def _get(self, resource_id):
+        return munchify({'data': self.resources[resource_id]})
+
+    get_lot = get_asset = get_auction = get_resource_item = _get
+
+    def patch_resource_item(self, resource_id, patch_data):
+        return munchify(patch_data)
+
+    def patch_resource_item_subitem(self, resource_item_id, patch_data, subitem_name, subitem_id=None):
+        return munchify(patch_data)
+
+    def create_resource_item_subitem(self, resource_item_id, subitem, subitem_name):
+        return munchify(subitem)
+
+    def extract_credentials(self, resource_item_id):
+        return munchify({'data': {'transfer_token': uuid4().hex}})
+
+    def create_contract(self, contract_data):
+        data = dict(contract_data['data'], id=uuid4().hex)
+        return munchify({'data': data})
+
+
+class DictMapping(object):
+
+    def __init__(self):
+        self.db = {}
+
+    def has(self, key):
+        return key in self.db
+
+    def put(self, key, value, **kwargs):
+        self.db[key] = value
+
+
+def processing_clients(lots=None, assets=None):
+    return {
+        'lots_client': StubClient(lots),
+        'assets_client': StubClient(assets),
+        'auctions_client': StubClient(),
+        'contracts_client': StubClient(),
+        'auctions_mapping': DictMapping(),
+        'lots_locker': LotsLocker({}),
+    }
+
+
+def bench_make_contract(number):
+    auction = munchify(synthetic_auction())
+    return lambda: [make_contract(auction) for _ in xrange(number)], number
+
+
+def bench_create_items_from_assets(number, assets=50):
+    assets = dict((asset['id'], asset) for asset in
+                  (synthetic_asset(items=10, documents=5) for _ in xrange(assets)))
+    processing = ProcessingBasic({}, processing_clients(assets=assets), KEYS,
+                                 DOCUMENT_KEYS, Queue())
+    assets_ids = list(assets)
+
+    def run():
+        for _ in xrange(number):
+            processing._create_items_from_assets(assets_ids)
+            processing.documents_transfer_queue.queue.clear()
+    return run, number * len(assets_ids)
+
+
+def bench_get_documents(number):
+    asset = munchify(synthetic_asset(items=0, documents=50))
+    processing = ProcessingBasic({}, processing_clients(), KEYS, DOCUMENT_KEYS, Queue())
+
+    def run():
+        for _ in xrange(number):
+            processing._get_documents(asset)
+            processing.documents_transfer_queue.queue.clear()
+    return run, number * len(asset.documents)
+
+
+def loki_lot(auction, auctions=100):
+    lot_auctions = [{'id': uuid4().hex, 'relatedProcessID': uuid4().hex, 'status': 'unsuccessful'}
+                    for _ in xrange(auctions - 1)]
+    lot_auctions.append({'id': uuid4().hex, 'relatedProcessID': auction['id'], 'status': 'active'})
+    return {
+        'id': auction['merchandisingObject'],
+        'status': 'active.auction',
+        'auctions': lot_auctions,
+        'contracts': [{'id': uuid4().hex, 'type': 'yoke'}],
+    }
+
+
+def bench_report_results(number):
+    auction = synthetic_auction()
+    lot = loki_lot(auction)
+    processing = ProcessingLoki({}, processing_clients(lots={lot['id']: lot}), KEYS,
+                                DOCUMENT_KEYS, Queue())
+    auction = munchify(auction)
+    return lambda: [processing.report_results(auction) for _ in xrange(number)], number
+
+
+def bench_check_lot_auction(number):
+    auction = synthetic_auction()
+    lot = munchify(loki_lot(auction))
+    processing = ProcessingLoki({}, processing_clients(), KEYS, DOCUMENT_KEYS, Queue())
+    auction = munchify(auction)
+    return lambda: [processing._check_lot_auction(lot, auction) for _ in xrange(number)], number
+
+
+def bench_auctions_mapping(number, config):
+    mapping = AuctionsMapping(config)
+    keys = [uuid4().hex for _ in xrange(number)]
+
+    def run():
+        for key in keys:
+            mapping.put(key, True)
+            mapping.has(key)
+            mapping.get(key)
+        for key in keys:
+            mapping.delete(key)
+    return run, number
+
+
+class StubKiller(object):
+    kill_now = False
+
+
+class StubFeedDB(object):
+    """Database, which serves prepared changes pages and stops feed at the end"""
+
+    def __init__(self, rows, killer):
+        self.rows = rows
+        self.killer = killer
+
+    def changes(self, since, limit, **kwargs):
+        results = self.rows[since:since + limit]
+        if not results:
+            self.killer.kill_now = True
+        return {'results': results, 'last_seq': since + len(results)}
+
+
+class StubProcessing(object):
+
+    def process_auction(self, auction):
+        auction.id
+
+
+def stub_convoy(auction_type, processing):
+    convoy = Convoy.__new__(Convoy)
+    convoy.auction_type_processing_configurator = {auction_type: processing}
+    convoy.auction_type_lot_type = {auction_type: 'stub'}
+    convoy.profiler = Profiler()
+    return convoy
+
+
+def bench_feed_dispatch(number):
+    doc = synthetic_auction()
+    rows = [{'seq': seq, 'id': doc['id'], 'doc': doc} for seq in xrange(1, number + 1)]
+    convoy = stub_convoy(doc['procurementMethodType'], StubProcessing())
+
+    def run():
+        killer = StubKiller()
+        for auction in continuous_changes_feed(StubFeedDB(rows, killer), killer, timeout=0):
+            convoy.process_auction(auction)
+    return run, number
+
+
+class MappingProcessing(object):
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def process_auction(self, auction):
+        if not self.mapping.has(auction.id):
+            self.mapping.put(str(auction.id), True)
+
+
+def bench_feed_mapping(number, config):
+    doc = synthetic_auction()
+    rows = [{'seq': seq, 'id': doc['id'], 'doc': dict(doc, id=uuid4().hex)}
+            for seq in xrange(1, number + 1)]
+    mapping = AuctionsMapping(config)
+    convoy = stub_convoy(doc['procurementMethodType'], MappingProcessing(mapping))
+
+    def run():
+        killer = StubKiller()
+        for auction in continuous_changes_feed(StubFeedDB(rows, killer), killer, timeout=0):
+            convoy.process_auction(auction)
+        mapping.flush()
+        for row in rows:
+            mapping.delete(row['doc']['id'])
+    return run, number
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: names of benchmarks, which median is slower than baseline by
+             more than `threshold` share
+    :rtype: list
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        change = result['median'] / base - 1 if base else 0
+        sys.stdout.write('{:<40} {:+.1%} against baseline\n'.format(result['name'], change))
+        if change > threshold:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- Convoy benchmarks suite ---')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE,
+                        help='File baseline results are stored in')
+    parser.add_argument('--save', action='store_const', const=True, default=False,
+                        help='Store results as new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown against baseline, 0.2 is 20%%')
+    parser.add_argument('--number', type=int, default=200, help='Operations per round')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of rounds')
+    parser.add_argument('--redis', type=str,
+                        help='host:port of redis to benchmark redis auctions mapping')
+    params = parser.parse_args()
+
+    benchmarks = [
+        ('make_contract', bench_make_contract(params.number * 10), 'contracts'),
+        ('basic _create_items_from_assets', bench_create_items_from_assets(params.number // 10 or 1), 'assets'),
+        ('basic _get_documents', bench_get_documents(params.number), 'documents'),
+        ('loki report_results', bench_report_results(params.number), 'auctions'),
+        ('loki _check_lot_auction', bench_check_lot_auction(params.number * 10), 'lots'),
+        ('feed to dispatch', bench_feed_dispatch(params.number * 50), 'auctions'),
+    ]
+    lazydb_name = 'benchmark_auctions_mapping_{}'.format(uuid4().hex)
+    lazydb_names = [lazydb_name]
+    benchmarks.append(('lazydb auctions mapping',
+                       bench_auctions_mapping(params.number, {'name': lazydb_name}), 'keys'))
+    for name, mapping_config in (('feed with lazydb mapping', {'threadpool': 0}),
+                                 ('feed with offloaded lazydb mapping', {'threadpool': 1}),
+                                 ('feed with batched lazydb mapping', {'threadpool': 1, 'batch_size': 100})):
+        lazydb_names.append('benchmark_feed_mapping_{}'.format(uuid4().hex))
+        mapping_config['name'] = lazydb_names[-1]
+        benchmarks.append((name, bench_feed_mapping(params.number, mapping_config), 'auctions'))
+    if params.redis:
+        host, _, port = params.redis.partition(':')
+        benchmarks.append(('redis auctions mapping',
+                           bench_auctions_mapping(params.number, {'host': host, 'port': port or 6379}),
+                           'keys'))
+
+    results = []
+    try:
+        for name, (func, units), unit_name in benchmarks:
+            timings, _ = measure(func, params.repeat)
+            results.append(report(name, timings, units, unit_name))
+    finally:
+        for name in lazydb_names:
+            destroy_lazydb(name)
+
+    medians = dict((result['name'], result['median']) for result in results)
+    if params.save:
+        with open(params.baseline, 'w') as baseline_file:
+            json.dump(medians, baseline_file, indent=2, sort_keys=True)
+        sys.stdout.write('Baseline saved to {}\n'.format(params.baseline))
+        return 0
+    if not os.path.isfile(params.baseline):
+        sys.stdout.write('No baseline {}, run with --save to create it\n'.format(params.baseline))
+        return 0
+    with open(params.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, params.threshold)
+    if regressions:
+        sys.stdout.write('Regressed beyond {:.0%}: {}\n'.format(params.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Compare memory per object and field access speed of feed auctions wrapped
+into Munch and into AuctionView:
+
+    python -m openregistry.convoy.benchmarks.views
+"""
+import argparse
+import sys
+from copy import deepcopy
+
+from munch import Munch
+
+from openregistry.convoy.benchmarks import measure, report
+from openregistry.convoy.benchmarks.documents import synthetic_auction
+from openregistry.convoy.views import AuctionView
+
+
+def retained_size(obj, seen=None):
+    """Size of object and all containers and values reachable from it"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += retained_size(key, seen) + retained_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += retained_size(value, seen)
+    elif hasattr(type(obj), '__slots__'):
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if slot in ('_loader', '_raw'):
+                    continue
+                try:
+                    size += retained_size(object.__getattribute__(obj, slot), seen)
+                except AttributeError:
+                    pass
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- Convoy auction views benchmark ---')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='Field reads per round')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of rounds')
+    params = parser.parse_args()
+
+    results = []
+    for name, factory in (('Munch', Munch), ('AuctionView', AuctionView)):
+        doc = synthetic_auction()
+        item = factory(deepcopy(doc))
+        size = retained_size(item)
+        sys.stdout.write('{:<40} {:>10} bytes retained per auction\n'.format(name, size))
+
+        def read_fields():
+            for _ in xrange(params.number):
+                item.id
+                item.status
+                item.procurementMethodType
+                item.merchandisingObject
+                'contractTerms' in item
+
+        timings, _ = measure(read_fields, params.repeat)
+        result = report('{} field access'.format(name), timings, params.number, 'auctions')
+        result['size'] = size
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import json
+from functools import partial
+from importlib import import_module
+
+import couchdb.json
+
+from openregistry.convoy.utils import LOGGER
+
+# Supported implementations, fastest first
+CODECS = ('ujson', 'rapidjson', 'simplejson', 'json')
+# Implementations `auto` codec picks from, they decode float amounts of
+# contracts exactly as stdlib json does
+AUTO_CODECS = ('simplejson', 'json')
+# Options, which make decoding of floats exact
+LOADS_OPTIONS = {'ujson': {'precise_float': True}}
+
+
+class Codec(object):
+    """JSON implementation used for changes feed and database documents"""
+
+    def __init__(self, name, module):
+        self.name = name
+        options = LOADS_OPTIONS.get(name)
+        self.loads = partial(module.loads, **options) if options else module.loads
+        self.dumps = module.dumps
+
+
+def available_codecs(candidates=CODECS):
+    """Names of installed JSON implementations of `candidates`, in the same order"""
+    names = []
+    for name in candidates:
+        try:
+            import_module(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(name='auto'):
+    """
+    Get JSON codec by module name.
+
+    Faster implementations, like ujson, are used only when they are named
+    explicitly.
+
+    :param name: name of JSON module, or `auto` to pick installed one, which
+                 decodes documents the same way stdlib json does
+    :type name: str
+    :return: requested codec, or stdlib json one if it is not installed
+    :rtype: Codec
+    """
+    if name == 'auto':
+        name = available_codecs(AUTO_CODECS)[0]
+    try:
+        module = import_module(name)
+    except ImportError:
+        LOGGER.warning('JSON codec {} is not installed, fall back to json'.format(name))
+        return Codec('json', json)
+    return Codec(name, module)
+
+
+def install_codec(codec):
+    """
+    Make couchdb decode and encode documents with codec, through its
+    `couchdb.json.use` hook. Streamed changes and replayed feed are decoded
+    with codec by convoy itself.
+
+    API responses are left to openprocurement_client, which decodes them
+    with simplejson and has no way to pass other decoder.
+
+    :param codec: codec to use
+    :type codec: Codec
+    """
+    couchdb.json.use(decode=codec.loads, encode=codec.dumps)
+    LOGGER.info('Use {} codec for JSON payloads of database'.format(codec.name))
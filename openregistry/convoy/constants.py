@@ -72,6 +72,16 @@ DEFAULTS = {
 }
 
 DOCUMENT_KEYS = ['hash', 'description', 'title', 'url', 'format', 'documentType']
+# Auction fields read by processors, fetched instead of full feed documents
+FEED_DOC_FIELDS = [
+    '_id', 'id', 'doc_type', 'status', 'procurementMethodType',
+    'merchandisingObject', 'contractTerms', 'contracts', 'mode', 'dateModified',
+    'tenderPeriod', 'auctionPeriod'
+]
 KEYS = ['classification', 'additionalClassifications', 'address', 'unit', 'quantity', 'location', 'id']
+# Lot and asset fields read by processors, kept by views
+LOT_VIEW_FIELDS = ['id', 'status', 'lotIdentifier', 'assets', 'auctions', 'contracts']
+ASSET_VIEW_FIELDS = KEYS[:-1] + ['id', 'status', 'title', 'items', 'documents']
 
 GET_AUCTION_MESSAGE_ID = 'get_auction'
+LOT_LOCKED = 'lot locked'  # outcome of batch auction, whose lot stayed locked by other node
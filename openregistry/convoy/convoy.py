@@ -8,26 +8,60 @@ import logging.config
 import os
 
 import argparse
+import sys
+from functools import partial
+from time import time
+from gevent.pool import Group, Pool
 from gevent.queue import Queue, Empty
-from gevent import spawn, sleep
+from gevent import spawn, spawn_later, sleep
+from munch import Munch
 from yaml import load
 
 from openprocurement_client.exceptions import ResourceNotFound
 
+from openregistry.convoy.codec import get_codec, install_codec
+from openregistry.convoy.introspection import register_cache, serve_introspection
+from openregistry.convoy.limiter import limit_clients, processing_limiter
+from openregistry.convoy.logqueue import install_log_queue
+from openregistry.convoy.metrics import (
+    STAGE_METRICS,
+    FeedLagMonitor,
+    HubBlockMonitor,
+    instrument_clients,
+    statsd_enabled,
+)
+from openregistry.convoy.prefetch import prefetch_clients
+from openregistry.convoy.profiling import MODES as PROFILING_MODES, Profiler
+from openregistry.convoy.replay import replay_changes_feed
+from openregistry.convoy.scheduler import FairScheduler, Pipeline, PriorityScheduler
+from openregistry.convoy.tracing import TRACER
 from openregistry.convoy.utils import (
+    BACKFILL_CHECKPOINT_KEY,
+    BACKFILL_CHUNK_DONE,
     LOGGER,
+    LOT_LOCK_ERRORS,
+    changes_range,
     continuous_changes_feed,
+    convoy_feed_selector,
+    fetch_docs_by_ids,
     init_clients,
+    pending_work,
     push_filter_doc,
+    parse_seq,
+    split_seq_range,
+    push_views_doc,
 )
 from openregistry.convoy.constants import (
     DEFAULTS,
     DOCUMENT_KEYS,
+    FEED_DOC_FIELDS,
     GET_AUCTION_MESSAGE_ID,
     KEYS,
+    LOT_LOCKED,
 )
 from openregistry.convoy.loki.processing import ProcessingLoki
 from openregistry.convoy.basic.processing import ProcessingBasic
+from openregistry.convoy.views import AuctionView
 
 
 class GracefulKiller(object):
@@ -50,16 +84,45 @@ class Convoy(object):
     def __init__(self, convoy_conf):
         LOGGER.info('Init Convoy...')
         self.auction_type_processing_configurator = {}
+        self.auction_type_lot_type = {}
         self.auction_types_for_filter = {}
         self.convoy_conf = convoy_conf
         self.killer = GracefulKiller()
+        self.profiler = Profiler(**self.convoy_conf.get('profile', {}))
+        signal.signal(signal.SIGUSR2, self.profiler.toggle)
 
         self.stop_transmitting = False
 
         self.transmitter_timeout = self.convoy_conf.get('transmitter_timeout',
                                                         10)
 
+        self.codec = get_codec(self.convoy_conf.get('codec', 'auto'))
+        install_codec(self.codec)
+
         created_clients = init_clients(convoy_conf)
+        STAGE_METRICS.publish = self.convoy_conf.get('metrics', {}).get('enabled', statsd_enabled())
+        tracing = self.convoy_conf.get('tracing', {})
+        if tracing.get('path'):
+            TRACER.configure(tracing['path'], tracing.get('sample_rate', 1.0))
+            LOGGER.info('Write traces of auctions to {}'.format(tracing['path']))
+        STAGE_METRICS.enabled = (STAGE_METRICS.publish or TRACER.enabled or
+                                 bool(self.convoy_conf.get('introspection')))
+        if STAGE_METRICS.enabled:
+            created_clients = instrument_clients(created_clients)
+        self.processing_limiter = None
+        if 'concurrency_limit' in self.convoy_conf:
+            created_clients = limit_clients(created_clients, self.convoy_conf['concurrency_limit'] or {})
+            self.processing_limiter = processing_limiter(self.convoy_conf['concurrency_limit'] or {})
+        self.prefetcher = None
+        if 'prefetch' in self.convoy_conf:
+            created_clients, self.prefetcher = prefetch_clients(created_clients, self.convoy_conf['prefetch'] or {})
+            register_cache('prefetch', self.prefetcher.stats)
+        self.hub_monitor = None
+        block_threshold = self.convoy_conf.get('metrics', {}).get('block_threshold')
+        if block_threshold:
+            self.hub_monitor = HubBlockMonitor(block_threshold)
+            if self.hub_monitor.start():
+                spawn(self.hub_monitor.run, self.killer)
 
         for key, item in created_clients.items():
             setattr(self, key, item)
@@ -67,6 +130,19 @@ class Convoy(object):
         self.timeout = self.convoy_conf.get('timeout', 10)
         self.keys = KEYS
         self.document_keys = DOCUMENT_KEYS
+        self.feed_config = self.convoy_conf.get('feed', {})
+        self.feed_selector = None
+        self.feed_fields = FEED_DOC_FIELDS if self.feed_config.get('projection') else None
+        self.feed_state = {'last_seq': 0}
+        self.running = False
+        self.introspection = None
+        self.postponed = Group()
+        self.feed_item_factory = self._auction_view if self.feed_config.get('views') else Munch
+        self.feed_stream = self.feed_config.get('stream', False)
+        if self.feed_stream and (self.feed_fields or self.feed_config.get('coalesce_window')):
+            LOGGER.warning('Changes feed streaming is disabled, it can not be '
+                           'used with projection or coalescing')
+            self.feed_stream = False
 
         if convoy_conf['lots'].get('loki'):
 
@@ -82,12 +158,21 @@ class Convoy(object):
             )
             self._register_aliases(process_basic, 'basic')
 
-        push_filter_doc(self.db, self.auction_types_for_filter)
+        if self.feed_config.get('filter') == 'selector':
+            self.feed_selector = convoy_feed_selector(self.auction_types_for_filter)
+            LOGGER.info('Use Mango selector for changes feed filtering')
+        else:
+            push_filter_doc(self.db, self.auction_types_for_filter)
+        # projected documents are read after changes, filter them again
+        self.doc_selector = (convoy_feed_selector(self.auction_types_for_filter)
+                             if self.feed_fields else None)
+        push_views_doc(self.db, self.auction_types_for_filter, self.feed_fields)
 
     def _register_aliases(self, processing, lot_type):
         self.auction_types_for_filter[lot_type] = []
         for auction_type in processing.allowed_auctions_types:
             self.auction_type_processing_configurator[auction_type] = processing
+            self.auction_type_lot_type[auction_type] = lot_type
             self.auction_types_for_filter[lot_type].append(auction_type)
 
     def file_bridge(self):
@@ -95,15 +180,17 @@ class Convoy(object):
             try:
                 transfer_item = self.documents_transfer_queue.get(timeout=2)
                 try:
-                    file_, _ = self.auctions_client.get_file(
-                        transfer_item['get_url'])
-                    LOGGER.debug('Received document file from asset DS')
-                    # TODO: Fill headers valid data if needed
-                    headers = {}
-                    self.auctions_client.ds_client.document_upload_not_register(
-                        file_, headers
-                    )
-                    LOGGER.debug('Uploaded document file to auction DS')
+                    with TRACER.trace('transfer_document', url=transfer_item['get_url']), \
+                            STAGE_METRICS.timed('transfer_document', 'ds'):
+                        file_, _ = self.auctions_client.get_file(
+                            transfer_item['get_url'])
+                        LOGGER.debug('Received document file from asset DS')
+                        # TODO: Fill headers valid data if needed
+                        headers = {}
+                        self.auctions_client.ds_client.document_upload_not_register(
+                            file_, headers
+                        )
+                        LOGGER.debug('Uploaded document file to auction DS')
                 except Exception:
                     LOGGER.error('While receiving or uploading document '
                                  'something went wrong :(')
@@ -114,8 +201,14 @@ class Convoy(object):
                 sleep(self.transmitter_timeout)
 
     def process_auction(self, auction):
+        """
+        Process auction with processor of its procurementMethodType. Time
+        since its last modification is reported as end-to-end latency only
+        if processor acted on it, not for auctions there was nothing to do
+        with, e.g. replayed from the start of feed.
+        """
         LOGGER.info(
-            'Received auction {} in status {}'.format(auction['id'], auction['status']),
+            'Received auction %s in status %s', auction['id'], auction['status'],
             extra={
                 'MESSAGE_ID': GET_AUCTION_MESSAGE_ID,
                 'STATUS': auction['status']
@@ -125,31 +218,302 @@ class Convoy(object):
         if auction['procurementMethodType'] not in self.auction_type_processing_configurator:
             LOGGER.warning(
                 'Such procurementMethodType %s is not supported by this'
-                ' convoy configuration' % auction['procurementMethodType']
+                ' convoy configuration', auction['procurementMethodType']
             )
             return
 
         processing = self.auction_type_processing_configurator.get(
             auction['procurementMethodType']
         )
-        processing.process_auction(auction)
+        with TRACER.trace('process_auction', auction_id=auction['id'], status=auction['status'],
+                          procurementMethodType=auction['procurementMethodType']):
+            acted = processing.process_auction(auction)
+        if acted:
+            STAGE_METRICS.report_e2e(auction, self.auction_type_lot_type[auction['procurementMethodType']])
+        self.profiler.auction_processed()
+
+    def _process_feed_auction(self, auction):
+        try:
+            self.process_auction(auction)
+        except LOT_LOCK_ERRORS:
+            self.postpone(auction)
+        self.feed_state['heartbeat'] = time()
+
+    def postpone(self, auction):
+        """
+        Process auction, whose lot is locked by other node or whose lock was
+        lost to other node, again after `lots_locker.postpone` seconds. Auctions in terminal statuses do not
+        appear in feed again, so they can not be just skipped.
+        """
+        delay = self.convoy_conf.get('lots_locker', {}).get('postpone', 30)
+        self.postponed.add(spawn_later(delay, self._process_feed_auction, auction))
 
     def process_single_auction(self, auction_id):
         try:
             auction = self.auctions_client.get_auction(auction_id)
         except ResourceNotFound:
-            LOGGER.warning('Auction object {} not found'.format(auction_id))
+            LOGGER.warning('Auction object %s not found', auction_id)
         else:
-            self.process_auction(auction['data'])
+            try:
+                self.process_auction(auction['data'])
+            except LOT_LOCK_ERRORS:
+                LOGGER.error('Lot of auction %s is locked by other node, '
+                             'try again later', auction_id)
+
+    def process_auctions_batch(self, auction_ids, concurrency=None):
+        """
+        Process many auctions in one run.
+
+        Documents are fetched from database in one request, auctions missing
+        there are requested from API. At most `concurrency` auctions are
+        processed at the same time.
+
+        :param auction_ids: ids of auctions to process
+        :type auction_ids: list
+        :param concurrency: number of auctions processed at the same time
+        :type concurrency: int
+        :return: outcome of processing by auction id
+        :rtype: dict
+        """
+        concurrency = concurrency or self.convoy_conf.get('batch_concurrency', 10)
+        outcomes = {}
+        try:
+            docs = fetch_docs_by_ids(self.db, auction_ids)
+        except Exception as e:
+            LOGGER.warning('Failed to fetch auctions from database: {}, '
+                           'falling back to API'.format(e))
+            docs = {}
+
+        def process(auction_id):
+            try:
+                if auction_id in docs:
+                    auction = self.feed_item_factory(docs[auction_id])
+                else:
+                    auction = self.auctions_client.get_auction(auction_id)['data']
+                self.process_auction(auction)
+            except ResourceNotFound:
+                outcomes[auction_id] = 'not found'
+            except LOT_LOCK_ERRORS:
+                outcomes[auction_id] = LOT_LOCKED
+            except Exception as e:
+                outcomes[auction_id] = 'failed: {!r}'.format(e)
+            else:
+                outcomes[auction_id] = 'processed'
+
+        pending = list(auction_ids)
+        for _ in xrange(self.convoy_conf.get('batch_lock_retries', 1) + 1):
+            pool = Pool(concurrency)
+            for auction_id in pending:
+                if self.killer.kill_now:
+                    break
+                pool.spawn(process, auction_id)
+            pool.join()
+            # lots of these auctions were locked by other node, try once they are released
+            pending = [auction_id for auction_id in pending if outcomes.get(auction_id) == LOT_LOCKED]
+            if not pending or self.killer.kill_now:
+                break
+            LOGGER.info('Retry {} auctions with locked lots'.format(len(pending)))
+
+        for auction_id in auction_ids:
+            outcomes.setdefault(auction_id, 'skipped')
+            LOGGER.info('Auction %s: %s', auction_id, outcomes[auction_id])
+        failed = len([o for o in outcomes.values() if o != 'processed'])
+        LOGGER.info('Batch finished: {} auctions, {} not processed'.format(
+            len(outcomes), failed), extra={'MESSAGE_ID': 'batch_finished'})
+        return outcomes
+
+    def backfill(self, since, until):
+        """
+        Process auctions from changes with sequences in (since, until].
+
+        Range is split into chunks, which are read in parallel. Progress of
+        every chunk is saved in auctions mapping after each page, so
+        interrupted backfill of the same range resumes where it stopped.
+
+        :param since: sequence to start after
+        :type since: int or str
+        :param until: last sequence to process, opaque sequences of
+                      CouchDB 2.x are read in one chunk
+        :type until: int or str
+        :return: backfill statistics
+        :rtype: dict
+        """
+        backfill_config = self.convoy_conf.get('backfill', {})
+        chunks = split_seq_range(since, until, backfill_config.get('chunks', 8))
+        stats = {'processed': 0, 'errors': 0, 'chunks': len(chunks)}
+        started = time()
+
+        def process_chunk(start, end):
+            checkpoint = BACKFILL_CHECKPOINT_KEY.format(since=since, until=until,
+                                                        start=start)
+            if self.killer.kill_now:
+                return
+            if self.auctions_mapping.has(checkpoint):
+                saved = self.auctions_mapping.get(checkpoint)
+                if saved == BACKFILL_CHUNK_DONE:
+                    return
+                start = saved
+                LOGGER.info('Resume backfill chunk from sequence {}'.format(start))
+            pages = changes_range(self.db, start, end, selector=self.feed_selector,
+                                  fields=self.feed_fields, doc_selector=self.doc_selector)
+            for rows, last_seq in pages:
+                for row in rows:
+                    try:
+                        self._process_feed_auction(self.feed_item_factory(row['doc']))
+                    except Exception as e:
+                        stats['errors'] += 1
+                        LOGGER.error('Failed to process auction %s at sequence %s: '
+                                     '%r', row['id'], row['seq'], e)
+                    else:
+                        stats['processed'] += 1
+                self.auctions_mapping.put(checkpoint, str(last_seq))
+                if self.killer.kill_now:
+                    return
+            self.auctions_mapping.put(checkpoint, BACKFILL_CHUNK_DONE)
+
+        LOGGER.info('Backfill sequences {} - {} in {} chunks'.format(
+            since, until, len(chunks)))
+        pool = Pool(backfill_config.get('concurrency', 4))
+        for start, end in chunks:
+            pool.spawn(process_chunk, start, end)
+        pool.join()
+        self.postponed.join()
+
+        stats['elapsed'] = time() - started
+        stats['throughput'] = stats['processed'] / stats['elapsed'] if stats['elapsed'] else 0
+        LOGGER.info(
+            'Backfill finished: {processed} auctions processed, {errors} errors '
+            'in {elapsed:.1f}s, {throughput:.1f} auctions/s'.format(**stats),
+            extra={'MESSAGE_ID': 'backfill_finished'}
+        )
+        return stats
+
+    def catch_up(self):
+        """
+        Process auctions waiting for convoy according to `pending_work` view,
+        skipping ones already in auctions mapping.
+
+        :return: database sequence at the moment catch up was started, live
+                 feed should be tailed from it
+        """
+        since = self.db.info()['update_seq']
+        LOGGER.info('Catching up outstanding auctions before sequence {}'.format(since))
+        processed = skipped = 0
+        for doc in pending_work(self.db, self.auction_types_for_filter,
+                                fields=self.feed_fields):
+            if self.auctions_mapping.has(str(doc['id'])):
+                skipped += 1
+                continue
+            self._process_feed_auction(self.feed_item_factory(doc))
+            processed += 1
+            if self.killer.kill_now:
+                break
+        LOGGER.info('Catch up finished: {} auctions processed, {} already '
+                    'processed skipped'.format(processed, skipped),
+                    extra={'MESSAGE_ID': 'catch_up_finished'})
+        return since
+
+    def changes_feed(self, since=0):
+        if self.feed_config.get('replay'):
+            return replay_changes_feed(
+                self.feed_config['replay'], self.killer,
+                loads=self.codec.loads,
+                item_factory=self.feed_item_factory,
+                feed_state=self.feed_state
+            )
+        return continuous_changes_feed(
+            self.db, self.killer, self.timeout,
+            since=since,
+            selector=self.feed_selector,
+            fields=self.feed_fields,
+            doc_selector=self.doc_selector,
+            coalesce_window=self.feed_config.get('coalesce_window', 0),
+            feed_state=self.feed_state,
+            stream=self.feed_stream,
+            loads=self.codec.loads,
+            item_factory=self.feed_item_factory
+        )
+
+    def _auction_view(self, doc):
+        return AuctionView(doc, loader=partial(self.db.get, doc.get('_id', doc.get('id'))))
+
+    def fair_scheduler(self, scheduling):
+        """
+        Scheduler with pipeline per registered lot type, configured by
+        `pipelines` of `scheduling` section.
+        """
+        pipelines = []
+        for lot_type in self.auction_types_for_filter:
+            conf = scheduling['pipelines'].get(lot_type) or {}
+            pipelines.append(Pipeline(lot_type, conf.get('concurrency', 1),
+                                      conf.get('weight', 1), conf.get('types')))
+        return FairScheduler(
+            self._process_feed_auction, pipelines,
+            lambda auction: self.auction_type_lot_type.get(auction['procurementMethodType']),
+            scheduling.get('concurrency'), scheduling.get('max_pending', 1000),
+            self.processing_limiter)
 
     def run(self):
         self.transmitter = spawn(self.file_bridge)
+        if self.convoy_conf.get('introspection', {}).get('port') is not None:
+            self.introspection = serve_introspection(self, self.convoy_conf['introspection'])
+        if STAGE_METRICS.publish and not self.feed_config.get('replay'):
+            monitor = FeedLagMonitor(self.db, self.feed_state,
+                                     self.convoy_conf.get('metrics', {}).get('lag_interval', 30))
+            self.lag_monitor = spawn(monitor.run, self.killer)
         sleep(1)
+        since = 0
+        if self.feed_config.get('catch_up'):
+            since = self.catch_up()
         LOGGER.info('Getting auctions')
-        for auction in continuous_changes_feed(self.db, self.killer, self.timeout):
-            self.process_auction(auction)
-            if self.killer.kill_now:
-                break
+        self.feed_state['heartbeat'] = time()
+        self.running = True
+        scheduling = self.convoy_conf.get('scheduling', {})
+        auctions = self.changes_feed(since)
+        if self.prefetcher is not None:
+            auctions = self.prefetcher.watch(auctions)
+        try:
+            if scheduling.get('pipelines'):
+                scheduler = self.fair_scheduler(scheduling)
+                scheduler.run(auctions, self.killer)
+            elif scheduling.get('priority'):
+                scheduler = PriorityScheduler(self._process_feed_auction,
+                                              scheduling.get('concurrency', 1),
+                                              scheduling.get('max_pending', 1000),
+                                              self.processing_limiter)
+                scheduler.run(auctions, self.killer)
+            else:
+                if self.processing_limiter is not None:
+                    LOGGER.warning('Auctions are processed one by one without scheduling, '
+                                   'concurrency limit applies to API calls only')
+                for auction in auctions:
+                    self._process_feed_auction(auction)
+                    if self.killer.kill_now:
+                        break
+            if not self.killer.kill_now:  # feed ended, e.g. replayed one
+                self.postponed.join()
+        finally:
+            self.running = False
+            if self.introspection is not None:
+                self.introspection.stop()
+
+
+def read_auction_ids(ids_file):
+    """
+    Read auction ids from file, one per line, `-` stands for stdin.
+    Blank lines and lines starting with `#` are ignored, duplicates are dropped.
+    """
+    if ids_file == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(ids_file) as ids_file_obj:
+            lines = ids_file_obj.readlines()
+    auction_ids = []
+    for line in lines:
+        auction_id = line.strip()
+        if auction_id and not auction_id.startswith('#') and auction_id not in auction_ids:
+            auction_ids.append(auction_id)
+    return auction_ids
 
 
 def main():
@@ -160,20 +524,68 @@ def main():
                         help='Clients check only')
     parser.add_argument('--single', dest='auction_id', type=str,
                         help='Id of auction for single convoy run')
+    parser.add_argument('--ids-file', dest='ids_file', type=str,
+                        help='File with ids of auctions for single convoy run, '
+                             '"-" to read them from stdin')
+    parser.add_argument('--since', dest='since', type=parse_seq,
+                        help='Backfill auctions from changes after this sequence, '
+                             'number or CouchDB 2.x sequence string')
+    parser.add_argument('--until', dest='until', type=parse_seq,
+                        help='Last sequence of backfill, CouchDB 2.x sequence '
+                             'should be taken from changes feed')
+    parser.add_argument('--replay', dest='replay', type=str,
+                        help='Process auctions from recorded changes file '
+                             'instead of database feed')
+    parser.add_argument('--catch-up', dest='catch_up', action='store_const',
+                        const=True, default=False,
+                        help='Process outstanding auctions before tailing feed')
+    parser.add_argument('--profile', dest='profile', choices=PROFILING_MODES,
+                        help='Profile CPU usage from start, SIGUSR2 toggles '
+                             'profiling at any time')
+    parser.add_argument('--profile-seconds', dest='profile_seconds', type=float,
+                        help='Stop profiling after this number of seconds')
+    parser.add_argument('--profile-auctions', dest='profile_auctions', type=int,
+                        help='Stop profiling after this number of auctions')
+    parser.add_argument('--profile-output', dest='profile_output', type=str,
+                        help='Prefix of profile files')
     params = parser.parse_args()
+    if (params.since is None) != (params.until is None):
+        parser.error('--since and --until should be used together')
     config = {}
     if os.path.isfile(params.config):
         with open(params.config) as config_file_obj:
             config = load(config_file_obj.read())
         logging.config.dictConfig(config)
+        if config.get('log_queue'):
+            install_log_queue(**config['log_queue'])
+    if params.catch_up:
+        config.setdefault('feed', {})['catch_up'] = True
+    if params.replay:
+        config.setdefault('feed', {})['replay'] = params.replay
+    if params.profile:
+        profile_config = config.setdefault('profile', {})
+        profile_config['mode'] = params.profile
+        for key in ('seconds', 'auctions', 'output'):
+            if getattr(params, 'profile_' + key):
+                profile_config[key] = getattr(params, 'profile_' + key)
     DEFAULTS.update(config)
     convoy = Convoy(DEFAULTS)
     if params.check:
         exit()
-    if params.auction_id:
-        convoy.process_single_auction(params.auction_id)
-    else:
-        convoy.run()
+    if params.profile:
+        convoy.profiler.start()
+    try:
+        if params.since is not None:
+            convoy.backfill(params.since, params.until)
+        elif params.ids_file:
+            convoy.process_auctions_batch(read_auction_ids(params.ids_file))
+        elif params.auction_id:
+            convoy.process_single_auction(params.auction_id)
+        else:
+            convoy.run()
+    finally:
+        convoy.auctions_mapping.flush()
+        convoy.profiler.stop()
 
 
 ###############################################################################
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import json
+from time import time
+
+from gevent.pywsgi import WSGIServer
+
+from openregistry.convoy.limiter import LIMITERS
+from openregistry.convoy.metrics import STAGE_METRICS
+from openregistry.convoy.utils import LOGGER, RETRIES, seq_number
+
+CACHES = {}  # name: callable, which returns dict of cache counters
+PROBE_KEY = 'introspection_probe'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def register_cache(name, stats):
+    """
+    Expose counters of cache on introspection endpoint.
+
+    :param name: name of cache, used as `cache` label
+    :param stats: callable without arguments, which returns dict of numbers
+    """
+    CACHES[name] = stats
+
+
+def unregister_cache(name):
+    CACHES.pop(name, None)
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in sorted(labels.items())) + '}'
+
+
+class Introspection(object):
+    """
+    WSGI application with live state of convoy worker:
+
+        /status   JSON document with feed, queue, stages, retries, concurrency
+                  limits and caches
+        /metrics  same values in Prometheus text format
+        /healthz  liveness, fails if feed has not progressed for `stall_timeout`
+        /readyz   readiness, fails while convoy is not running or is stopping
+    """
+
+    def __init__(self, convoy, stall_timeout=300):
+        self.convoy = convoy
+        self.stall_timeout = stall_timeout
+        self.started = time()
+
+    def feed_lag(self, last_seq):
+        try:
+            update_seq = seq_number(self.convoy.db.info()['update_seq'])
+        except Exception as e:
+            LOGGER.warning('Failed to get database update_seq: {!r}'.format(e))
+            return None
+        return max(0, update_seq - seq_number(last_seq))
+
+    def mapping_latency(self):
+        """Seconds one lookup in auctions mapping takes"""
+        started = time()
+        try:
+            self.convoy.auctions_mapping.has(PROBE_KEY)
+        except Exception as e:
+            LOGGER.warning('Auctions mapping lookup failed: {!r}'.format(e))
+            return None
+        return time() - started
+
+    def heartbeat_age(self):
+        return time() - self.convoy.feed_state.get('heartbeat', self.started)
+
+    def live(self):
+        return self.heartbeat_age() < self.stall_timeout
+
+    def ready(self):
+        return (getattr(self.convoy, 'running', False) and
+                not self.convoy.killer.kill_now and self.live())
+
+    def hub_blocks(self):
+        monitor = getattr(self.convoy, 'hub_monitor', None)
+        if monitor is None:
+            return None
+        return {'count': monitor.blocks, 'seconds': monitor.blocked_time}
+
+    def concurrency_limits(self):
+        return dict((resource, {'limit': int(limiter.limit), 'in_flight': limiter.in_flight,
+                                'waiting': limiter.waiting, 'latency': limiter.latency})
+                    for resource, limiter in LIMITERS.items())
+
+    def caches(self):
+        caches = {}
+        for name, stats in CACHES.items():
+            try:
+                caches[name] = stats()
+            except Exception as e:
+                LOGGER.warning('Failed to get stats of {} cache: {!r}'.format(name, e))
+        return caches
+
+    def status(self):
+        last_seq = self.convoy.feed_state.get('last_seq', 0)
+        return {
+            'live': self.live(),
+            'ready': self.ready(),
+            'uptime': time() - self.started,
+            'feed': {
+                'last_seq': last_seq,
+                'lag': self.feed_lag(last_seq),
+                'heartbeat_age': self.heartbeat_age(),
+            },
+            'documents_transfer_queue': self.convoy.documents_transfer_queue.qsize(),
+            'in_flight': [
+                {'operation': operation, 'resource': resource, 'count': count}
+                for (operation, resource), count in sorted(STAGE_METRICS.in_flight.items()) if count
+            ],
+            'calls': dict(STAGE_METRICS.calls),
+            'retries': dict((str(status), count) for status, count in RETRIES.items()),
+            'concurrency_limits': self.concurrency_limits(),
+            'caches': self.caches(),
+            'mapping_latency': self.mapping_latency(),
+            'hub_blocks': self.hub_blocks(),
+        }
+
+    def prometheus(self, status):
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append('# TYPE convoy_{} {}'.format(name, kind))
+            for labels, value in samples:
+                if value is not None:
+                    lines.append('convoy_{}{} {}'.format(name, labels, float(value)))
+
+        metric('up', 'gauge', [('', int(status['live']))])
+        metric('ready', 'gauge', [('', int(status['ready']))])
+        metric('feed_seq', 'gauge', [('', seq_number(status['feed']['last_seq']))])
+        metric('feed_lag_changes', 'gauge', [('', status['feed']['lag'])])
+        metric('feed_heartbeat_age_seconds', 'gauge', [('', status['feed']['heartbeat_age'])])
+        metric('documents_transfer_queue', 'gauge', [('', status['documents_transfer_queue'])])
+        metric('stage_in_flight', 'gauge', [
+            (_labels(operation=item['operation'], resource=item['resource']), item['count'])
+            for item in status['in_flight']
+        ])
+        metric('stage_calls_total', 'counter', [
+            (_labels(**dict(zip(('operation', 'resource', 'outcome'), name.split('.', 2)))), count)
+            for name, count in sorted(status['calls'].items())
+        ])
+        metric('client_retries_total', 'counter', [
+            (_labels(status=code), count) for code, count in sorted(status['retries'].items())
+        ])
+        for key in ('limit', 'in_flight', 'waiting'):
+            metric('concurrency_{}'.format(key), 'gauge', [
+                (_labels(resource=resource), limits[key])
+                for resource, limits in sorted(status['concurrency_limits'].items())
+            ])
+        for name, stats in sorted(status['caches'].items()):
+            for key, value in sorted(stats.items()):
+                metric('cache_{}'.format(key), 'gauge', [(_labels(cache=name), value)])
+        metric('mapping_latency_seconds', 'gauge', [('', status['mapping_latency'])])
+        if status['hub_blocks'] is not None:
+            metric('hub_blocks_total', 'counter', [('', status['hub_blocks']['count'])])
+            metric('hub_blocked_seconds_total', 'counter', [('', status['hub_blocks']['seconds'])])
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/').rstrip('/') or '/'
+        if path in ('/healthz', '/readyz'):
+            ok = self.live() if path == '/healthz' else self.ready()
+            code, body, content_type = ('200 OK' if ok else '503 Service Unavailable',
+                                        'ok\n' if ok else 'fail\n', 'text/plain')
+        elif path in ('/', '/status'):
+            code, body, content_type = '200 OK', json.dumps(self.status()), 'application/json'
+        elif path == '/metrics':
+            code, body, content_type = '200 OK', self.prometheus(self.status()), PROMETHEUS_CONTENT_TYPE
+        else:
+            code, body, content_type = '404 Not Found', 'not found\n', 'text/plain'
+        start_response(code, [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def serve_introspection(convoy, config):
+    """
+    Start introspection server in background greenlet.
+
+    :param config: `introspection` section of configuration with `host`,
+                   `port` and `stall_timeout`
+    :type config: dict
+    """
+    app = Introspection(convoy, config.get('stall_timeout', 300))
+    server = WSGIServer((config.get('host', '127.0.0.1'), int(config['port'])), app, log=None)
+    server.start()
+    LOGGER.info('Introspection endpoint listens on {}:{}'.format(*server.address[:2]),
+                extra={'MESSAGE_ID': 'introspection_started'})
+    return server
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from contextlib import contextmanager
+from time import time
+
+from gevent.event import Event
+
+from openregistry.convoy.metrics import CLIENTS, METRICS_LOGGER
+from openregistry.convoy.utils import retryable
+
+CONCURRENCY_LIMIT = 'CONCURRENCY_LIMIT'  # gauge of statsdconfig.yaml
+LIMITERS = {}  # resource: AdaptiveLimiter, for introspection
+PROCESSING = 'processing'
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit of concurrent calls, which adapts to observed latency.
+
+    Latency of each successful call is compared with `baseline`, the lowest
+    latency seen recently, which creeps up to higher latency by `drift`
+    share per `limit` calls. While smoothed latency stays within
+    `tolerance` times baseline and the limit is used up, the limit grows by
+    one per `limit` calls. When latency rises above that, or call fails with error,
+    which is retried (409, 412, 429, 5xx), limit is multiplied by `backoff`,
+    at most once per smoothed latency. Calls over the limit wait in order.
+
+    Limit is reported as `CONCURRENCY_LIMIT` gauge whenever it changes.
+    """
+
+    def __init__(self, name, initial=8, minimum=1, maximum=64, tolerance=2.0, backoff=0.8,
+                 smoothing=0.2, drift=0.01):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.drift = drift
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.baseline = None
+        self.latency = None
+        self.decreases = 0
+        self._decreased_at = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self):
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        waiter = Event()
+        self._waiters.append(waiter)
+        try:
+            waiter.wait()
+        except BaseException:
+            if waiter.is_set():  # slot was given already
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.popleft().set()
+
+    def sample(self, latency):
+        """Adjust limit to latency of successful call"""
+        saturated = self.in_flight >= int(self.limit)
+        if self.baseline is None:
+            self.baseline = self.latency = latency
+        else:  # baseline follows lower latency at once, higher one by `drift` per `limit` calls
+            self.baseline = min(latency, self.baseline + (latency - self.baseline) * self.drift / self.limit)
+            self.latency += (latency - self.latency) * self.smoothing
+        if self.latency > self.baseline * self.tolerance:
+            self.decrease()
+        elif saturated:
+            self._set_limit(self.limit + 1.0 / self.limit)
+
+    def decrease(self):
+        now = time()
+        if now - self._decreased_at < (self.latency or 0):
+            return
+        self._decreased_at = now
+        self.decreases += 1
+        self._set_limit(self.limit * self.backoff)
+
+    def _set_limit(self, limit):
+        previous = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        if int(self.limit) == previous:
+            return
+        self._wake()
+        METRICS_LOGGER.info('Concurrency limit of %s changed to %d', self.name, int(self.limit),
+                            extra={'MESSAGE_ID': 'concurrency_limit.{}'.format(self.name),
+                                   CONCURRENCY_LIMIT: int(self.limit)})
+
+    @contextmanager
+    def measured(self):
+        """Adjust limit to latency of call, which holds acquired slot"""
+        started = time()
+        try:
+            yield
+        except Exception as e:
+            if retryable(e):
+                self.decrease()
+            raise
+        else:
+            self.sample(time() - started)
+
+    @contextmanager
+    def limited(self):
+        self.acquire()
+        try:
+            with self.measured():
+                yield
+        finally:
+            self.release()
+
+
+class LimitedClient(object):
+    """Proxy of API client, which runs public method calls under `AdaptiveLimiter`"""
+
+    def __init__(self, client, limiter, ds_limiter=None):
+        self._client = client
+        self._limiter = limiter
+        self._ds_limiter = ds_limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name == 'ds_client' and self._ds_limiter is not None:
+            attr = LimitedClient(attr, self._ds_limiter)
+        elif callable(attr) and not name.startswith('_'):
+            attr = self._limited(attr)
+        else:
+            return attr
+        setattr(self, name, attr)
+        return attr
+
+    def _limited(self, method):
+        def call(*args, **kwargs):
+            with self._limiter.limited():
+                return method(*args, **kwargs)
+        return call
+
+
+def limit_clients(clients, config):
+    """
+    Wrap API clients of `init_clients` result into `LimitedClient` with
+    limiter per resource, document service calls have their own limiter.
+
+    :param config: `concurrency_limit` section of configuration with
+                   `AdaptiveLimiter` arguments
+    :type config: dict
+    """
+    config = dict((key, value) for key, value in config.items() if key != PROCESSING)
+    limited = dict(clients)
+    ds_limiter = LIMITERS['ds'] = AdaptiveLimiter('ds', **config)
+    for key in CLIENTS:
+        if key in clients:
+            resource = key[:-len('_client')]
+            limiter = LIMITERS[resource] = AdaptiveLimiter(resource, **config)
+            limited[key] = LimitedClient(clients[key], limiter, ds_limiter)
+    return limited
+
+
+def processing_limiter(config):
+    """
+    Limiter of auctions processed at the same time, which schedulers take
+    auctions from feed under. Processing of auction takes longer and varies
+    more than single call, so `processing` subsection of `concurrency_limit`
+    overrides `AdaptiveLimiter` arguments for it.
+
+    :param config: `concurrency_limit` section of configuration
+    :type config: dict
+    :rtype: AdaptiveLimiter
+    """
+    options = dict((key, value) for key, value in config.items() if key != PROCESSING)
+    options.update(config.get(PROCESSING) or {})
+    limiter = LIMITERS[PROCESSING] = AdaptiveLimiter(PROCESSING, **options)
+    return limiter
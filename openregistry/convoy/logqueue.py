@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import defaultdict, deque
+from time import time
+
+from gevent.monkey import get_original
+from yaml import safe_load
+
+from openregistry.convoy.utils import LOGGER
+
+native_sleep = get_original('time', 'sleep')
+start_new_thread = get_original('thread', 'start_new_thread')
+native_socket = get_original('socket', 'socket')
+AF_INET = get_original('socket', 'AF_INET')
+SOCK_DGRAM = get_original('socket', 'SOCK_DGRAM')
+
+
+class LogQueue(object):
+    """
+    Bounded buffer of log records handled by native background thread, so
+    handler I/O and message formatting do not block gevent hub.
+
+    Records, which do not fit into buffer of `size`, are dropped and
+    counted, number of dropped records is logged with `log_records_dropped`
+    MESSAGE_ID once buffer has space again.
+    """
+
+    def __init__(self, size=10000, interval=0.05):
+        self.size = size
+        self.interval = interval
+        self.records = deque()
+        self.targets = []
+        self.dropped = 0
+        self._reported_drops = 0
+        self._stopped = False
+        self._running = False
+
+    def put(self, record, handlers):
+        if len(self.records) >= self.size:
+            self.dropped += 1
+            return False
+        self.records.append((record, handlers))
+        return True
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._stopped = False
+            start_new_thread(self._work, ())
+
+    def stop(self, timeout=5):
+        """Handle buffered records and stop background thread"""
+        self._stopped = True
+        waited = 0
+        while self._running and waited < timeout:
+            native_sleep(self.interval)
+            waited += self.interval
+        if self._running:  # thread is stuck, handle the rest here
+            self.drain()
+
+    def drain(self):
+        """
+        Handle buffered records.
+
+        :return: number of handled records
+        :rtype: int
+        """
+        handled = 0
+        while self.records:
+            record, handlers = self.records.popleft()
+            self._handle(record, handlers)
+            handled += 1
+        if self.dropped > self._reported_drops:
+            dropped, self._reported_drops = self.dropped - self._reported_drops, self.dropped
+            record = logging.makeLogRecord({
+                'name': LOGGER.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Dropped %d log records, log queue is full', 'args': (dropped,),
+                'MESSAGE_ID': 'log_records_dropped'
+            })
+            self._handle(record, self.targets)
+        return handled
+
+    def _handle(self, record, handlers):
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        for handler in self.targets:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+    def _work(self):
+        try:
+            while True:
+                if not self.drain():
+                    self._flush()
+                    if self._stopped:
+                        break
+                    native_sleep(self.interval)
+        finally:
+            self._running = False
+
+
+class QueueHandler(logging.Handler):
+    """Handler, which passes records to `handlers` through `LogQueue`"""
+
+    def __init__(self, queue, handlers):
+        logging.Handler.__init__(self, min(handler.level for handler in handlers) if handlers else 0)
+        self.queue = queue
+        self.handlers = list(handlers)
+        for handler in self.handlers:
+            if handler not in queue.targets:
+                queue.targets.append(handler)
+
+    def emit(self, record):
+        self.queue.put(record, self.handlers)
+
+    def close(self):
+        self.queue.stop()
+        logging.Handler.close(self)
+
+
+def install_log_queue(loggers=('openregistry.convoy', 'openregistry.convoy.metrics', ''), size=10000,
+                      interval=0.05):
+    """
+    Move handlers of `loggers` behind `QueueHandler` of shared `LogQueue`.
+    Should be called after `logging.config.dictConfig`.
+
+    :return: started queue
+    :rtype: LogQueue
+    """
+    queue = LogQueue(size, interval)
+    for name in loggers:
+        logger = logging.getLogger(name)
+        if logger.handlers:
+            logger.handlers = [QueueHandler(queue, logger.handlers)]
+    queue.start()
+    return queue
+
+
+class AggregatingStatsdHandler(logging.Handler):
+    """
+    Statsd handler, which aggregates metrics of records in memory and sends
+    them every `flush_interval` seconds in UDP packets up to `packet_size`
+    bytes, instead of packet per metric.
+
+    Uses `counters`, `gauges` and `histograms` attributes of statsdconfig.yaml
+    and its `main` section for host, port and `app_key`. Metrics are named
+    `<app_key>.<logger>.<attr>.<name>`, where name is value of counter
+    attribute or `MESSAGE_ID` of gauges and histograms.
+    """
+
+    def __init__(self, config_path, flush_interval=1, packet_size=512):
+        logging.Handler.__init__(self)
+        with open(config_path) as config_file:
+            config = safe_load(config_file)
+        main = config.get('main', {})
+        self.address = (main.get('host', 'localhost'), int(main.get('port', 8125)))
+        self.app_key = main.get('app_key', 'app_key')
+        self.counter_attrs = list(config.get('counters') or {})
+        self.gauge_attrs = list(config.get('gauges') or {})
+        self.histogram_attrs = list(config.get('histograms') or {})
+        self.flush_interval = flush_interval
+        self.packet_size = packet_size
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.timings = []
+        self.flushed_at = time()
+        self.socket = native_socket(AF_INET, SOCK_DGRAM)
+
+    def emit(self, record):
+        prefix = '{}.{}'.format(self.app_key, record.name)
+        for attr in self.counter_attrs:
+            value = getattr(record, attr, None)
+            if value is not None:
+                self.counters['{}.{}.{}'.format(prefix, attr, value)] += 1
+        message_id = getattr(record, 'MESSAGE_ID', None)
+        if message_id is not None:
+            for attr in self.gauge_attrs:
+                value = getattr(record, attr, None)
+                if value is not None:
+                    self.gauges['{}.{}.{}'.format(prefix, attr, message_id)] = value
+            for attr in self.histogram_attrs:
+                value = getattr(record, attr, None)
+                if value is not None:
+                    self.timings.append('{}.{}.{}:{}|ms'.format(prefix, attr, message_id, value))
+        self.flush()
+
+    def lines(self):
+        lines = ['{}:{}|c'.format(name, count) for name, count in self.counters.items()]
+        lines.extend('{}:{}|g'.format(name, value) for name, value in self.gauges.items())
+        lines.extend(self.timings)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.timings = []
+        return lines
+
+    def packets(self, lines):
+        packet = []
+        length = 0
+        for line in lines:
+            if packet and length + len(line) + 1 > self.packet_size:
+                yield '\n'.join(packet)
+                packet, length = [], 0
+            packet.append(line)
+            length += len(line) + 1
+        if packet:
+            yield '\n'.join(packet)
+
+    def send(self):
+        self.flushed_at = time()
+        for packet in self.packets(self.lines()):
+            try:
+                self.socket.sendto(packet, self.address)
+            except Exception:
+                pass
+
+    def flush(self):
+        if time() - self.flushed_at >= self.flush_interval:
+            self.send()
+
+    def close(self):
+        self.send()
+        self.socket.close()
+        logging.Handler.close(self)
@@ -20,7 +20,15 @@ from openregistry.convoy.loki.constants import (
     UNSUCCESSFUL_TERMINAL_STATUSES,
     UPDATE_CONTRACT_MESSAGE_ID,
 )
-from openregistry.convoy.utils import retry_on_error, make_contract, LOGGER
+from openregistry.convoy.metrics import stage
+from openregistry.convoy.views import LotView
+from openregistry.convoy.utils import (
+    LOGGER,
+    LotLockLost,
+    LotLockTimeout,
+    make_contract,
+    retry_on_error,
+)
 
 EXCEPTIONS = (Forbidden, RequestFailed, ResourceNotFound, UnprocessableEntity, PreconditionFailed, Conflict)
 
@@ -54,11 +62,31 @@ class ProcessingLoki(object):
         self.handled_lot_types += self.config.get('aliases', [])
 
     def process_auction(self, auction):
-        if not self.auctions_mapping.has(auction.id):
-            self.report_results(auction)
-
+        """
+        :return: True if results of auction were reported, False if they
+                 were reported already or could not be reported
+        :rtype: bool
+        """
+        if self.auctions_mapping.has(auction.id):
+            return False
+        try:
+            with self.lots_locker.lock(auction.get('merchandisingObject')):
+                # auction could be processed by other node while we waited for the lock
+                if self.auctions_mapping.has(auction.id):
+                    return False
+                return self.report_results(auction)
+        except LotLockTimeout:
+            LOGGER.warning('Postpone auction %s, its lot is processed by other '
+                           'node', auction.id)
+            raise
+        except LotLockLost:
+            LOGGER.warning('Postpone auction %s, lock of its lot was lost '
+                           'to other node', auction.id)
+            raise
+
+    @stage('report_results', 'loki')
     def report_results(self, auction_doc):
-        LOGGER.info('Report auction results {}'.format(auction_doc.id))
+        LOGGER.info('Report auction results %s', auction_doc.id)
 
         lot_processing = 'merchandisingObject' in auction_doc
         contract_processing = 'contractTerms' in auction_doc
@@ -67,11 +95,11 @@ class ProcessingLoki(object):
 
             lot = self._get_lot(auction_doc)  # get lot from the registry
             if not lot:
-                return
+                return False
 
             lot_auction = self._check_lot_auction(lot, auction_doc)  # search for the auction in the lot
             if not lot_auction:
-                return
+                return False
 
         # terminalize status of lot auction
         terminalized_status = PRE_TERMINAL_MAPPING.get(auction_doc.status, auction_doc.status)
@@ -79,8 +107,10 @@ class ProcessingLoki(object):
         # update lot's auction status with actual auction status
         if auction_doc.status in UNSUCCESSFUL_TERMINAL_STATUSES + UNSUCCESSFUL_PRE_TERMINAL_STATUSES:
             if lot_processing:
+                self.lots_locker.ensure(lot.id)
                 self._switch_auction_status(terminalized_status, lot.id, lot_auction.id)
             self.auctions_mapping.put(str(auction_doc.id), True)
+            return True
 
         elif auction_doc.status in SUCCESSFUL_TERMINAL_STATUSES + SUCCESSFUL_PRE_TERMINAL_STATUSES:
             if contract_processing and lot_processing:
@@ -91,26 +121,28 @@ class ProcessingLoki(object):
                 except EXCEPTIONS as e:
                     message = 'Server error: {}'.format(e.status_code) if e.status_code >= 500 else e.message
                     LOGGER.error(
-                        "Failed to extract transfer token from auction {} ({})".format(auction_doc.id, message)
+                        "Failed to extract transfer token from auction %s (%s)", auction_doc.id, message
                     )
-                    return
+                    return False
                 # create contract, if none of them are associated with lot
                 if lot.contracts[0].get('relatedProcessID') is None:
+                    self.lots_locker.ensure(lot.id)
                     contract = self._post_contract({'data': contract_data})
                 else:
                     LOGGER.info(
-                        'Contract {} has already created, and patched to lot {}'.format(
-                            lot.contracts[0].get('relatedProcessID'),
-                            lot.id
-                        )
+                        'Contract %s has already created, and patched to lot %s',
+                        lot.contracts[0].get('relatedProcessID'), lot.id
                     )
-                    return
+                    return False
             if lot_processing:
                 # update lot's auction status with actual auction status
+                self.lots_locker.ensure(lot.id)
                 self._switch_auction_status(terminalized_status, lot.id, lot_auction.id)
             if lot_processing and contract_processing:
                 self.update_lot_contract(lot, contract)
             self.auctions_mapping.put(str(auction_doc.id), True)
+            return True
+        return False
 
     @retry(stop_max_attempt_number=5, retry_on_exception=retry_on_error, wait_fixed=2000)
     def _switch_auction_status(self, status, lot_id, auction_id):
@@ -121,7 +153,7 @@ class ProcessingLoki(object):
             subitem_id=auction_id
         )
         LOGGER.info(
-            'Switch lot\'s {} auction {} to ({}) status'.format(lot_id, auction_id, status),
+            'Switch lot\'s %s auction %s to (%s) status', lot_id, auction_id, status,
             extra={
                 'MESSAGE_ID': SWITCH_LOT_AUCTION_STATUS_MESSAGE_ID,
                 'STATUS': status
@@ -137,7 +169,7 @@ class ProcessingLoki(object):
             subitem_id=contract_id
         )
         LOGGER.info(
-            'Update lot\'s {} contract data'.format(lot_id),
+            'Update lot\'s %s contract data', lot_id,
             extra={
                 'MESSAGE_ID': UPDATE_CONTRACT_MESSAGE_ID
             }
@@ -146,7 +178,7 @@ class ProcessingLoki(object):
     @retry(stop_max_attempt_number=5, retry_on_exception=retry_on_error, wait_fixed=2000)
     def _extract_transfer_token(self, auction_id):
         credentials = self.auctions_client.extract_credentials(resource_item_id=auction_id)
-        LOGGER.info("Successfully extracted tranfer_token from auction {})".format(auction_id))
+        LOGGER.info("Successfully extracted tranfer_token from auction %s)", auction_id)
         return credentials['data']['transfer_token']
 
     def _check_lot_auction(self, lot, auction_doc):
@@ -154,45 +186,46 @@ class ProcessingLoki(object):
                             if auction_doc.id == auction.get('relatedProcessID')), None)
         if not lot_auction:
             LOGGER.warning(
-                'Auction object {} not found in lot {}'.format(
-                    auction_doc.id, lot.id
-                )
+                'Auction object %s not found in lot %s', auction_doc.id, lot.id
             )
             return
         if lot_auction['status'] != 'active':
-            LOGGER.info('Auction {} results already reported to lot {}'.format(auction_doc.id, lot.id))
+            LOGGER.info('Auction %s results already reported to lot %s', auction_doc.id, lot.id)
             return
         return lot_auction
 
+    @stage('get_lot', 'loki')
     def _get_lot(self, auction_doc):
         lot_id = auction_doc.merchandisingObject
         try:
             lot = self.lots_client.get_lot(lot_id).data
+            if self.config.get('views'):
+                lot = LotView(lot, loader=lambda: self.lots_client.get_lot(lot_id).data)
         except ResourceNotFound:
             LOGGER.warning(
-                'Lot {} not found when report auction {} results'.format(
-                    lot_id, auction_doc.id
-                )
+                'Lot %s not found when report auction %s results', lot_id, auction_doc.id
             )
             return
 
-        LOGGER.info('Received lot {} from CDB'.format(lot_id))
+        LOGGER.info('Received lot %s from CDB', lot_id)
         return lot
 
     @retry(stop_max_attempt_number=5, retry_on_exception=retry_on_error, wait_fixed=2000)
     def _post_contract(self, contract_data):
         contract = self.contracts_client.create_contract(contract_data).data
-        log_msg = "Successfully created contract {}".format(contract.id)
+        log_msg, log_args = "Successfully created contract %s", (contract.id,)
         if 'merchandisingObject' in contract_data['data']:
-            log_msg += " from lot {}".format(contract_data['data']['merchandisingObject'])
+            log_msg += " from lot %s"
+            log_args += (contract_data['data']['merchandisingObject'],)
         LOGGER.info(
-            log_msg,
+            log_msg, *log_args,
             extra={
                 'MESSAGE_ID': CREATE_CONTRACT_MESSAGE_ID
             }
         )
         return contract
 
+    @stage('update_lot_contract', 'loki')
     def update_lot_contract(self, lot, contract):
         contract_id = lot.contracts[0].id
         contract_data = {
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from logging import INFO, getLogger
+from time import time
+
+from gevent import sleep
+from gevent.hub import get_hub
+
+try:
+    from gevent import config as gevent_config
+    from gevent.events import EventLoopBlocked, subscribers as gevent_subscribers
+except ImportError:  # gevent < 1.3 has no monitoring thread
+    EventLoopBlocked = None
+
+from openregistry.convoy.tracing import TRACER
+from openregistry.convoy.utils import LOGGER, parse_date, seq_number
+
+STAGE_DURATION = 'STAGE_DURATION'  # histogram of statsdconfig.yaml, milliseconds
+E2E_LATENCY = 'E2E_LATENCY'  # histogram of statsdconfig.yaml, milliseconds
+FEED_LAG_CHANGES = 'FEED_LAG_CHANGES'  # gauge of statsdconfig.yaml
+FEED_LAG_SECONDS = 'FEED_LAG_SECONDS'  # gauge of statsdconfig.yaml
+HUB_BLOCKED = 'HUB_BLOCKED'  # histogram of statsdconfig.yaml, milliseconds
+STATSD_HANDLER = 'StatsdHandler'
+CLIENTS = ('auctions_client', 'lots_client', 'assets_client', 'contracts_client')
+# Durations and latencies are logged at INFO whatever level console has,
+# configure it with statsd handler only to keep them off console
+METRICS_LOGGER = getLogger('{}.metrics'.format(LOGGER.name))
+METRICS_LOGGER.setLevel(INFO)
+
+
+def statsd_enabled(logger=METRICS_LOGGER):
+    """Check if records of logger reach statsd handler"""
+    while logger is not None:
+        handlers = list(logger.handlers)
+        for handler in logger.handlers:  # targets of queue handler
+            handlers.extend(getattr(handler, 'handlers', ()))
+        if any(type(handler).__name__.endswith(STATSD_HANDLER) for handler in handlers):
+            return True
+        if not logger.propagate:
+            break
+        logger = logger.parent
+    return False
+
+
+def outcome_of(exc):
+    """Status code of failed request, or name of exception"""
+    status_code = getattr(exc, 'status_code', None)
+    return str(status_code) if status_code else type(exc).__name__
+
+
+class StageMetrics(object):
+    """
+    Durations of client calls and processing stages, reported as
+    `STAGE_DURATION` histogram. Metric name is `<operation>.<resource>.<outcome>`
+    and is passed as `MESSAGE_ID`, so counter of calls is published too.
+
+    Number of calls by metric and operations in progress are also kept in
+    memory for introspection. While disabled, nothing is measured, with
+    `publish` unset nothing is sent to statsd. Records go to
+    `METRICS_LOGGER`, so they do not depend on level of convoy logger.
+    """
+
+    def __init__(self, enabled=False, publish=True):
+        self.enabled = enabled
+        self.publish = publish
+        self.in_flight = {}
+        self.calls = {}
+
+    def report(self, operation, resource, outcome, duration):
+        metric = '{}.{}.{}'.format(operation, resource, outcome)
+        self.calls[metric] = self.calls.get(metric, 0) + 1
+        if not self.publish:
+            return
+        METRICS_LOGGER.info('%s took %.1f ms', metric, duration * 1000,
+                            extra={'MESSAGE_ID': metric, STAGE_DURATION: duration * 1000})
+
+    @contextmanager
+    def timed(self, operation, resource):
+        if not self.enabled:
+            yield
+            return
+        key = (operation, resource)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        started = time()
+        outcome = 'ok'
+        try:
+            yield
+        except Exception as e:
+            outcome = outcome_of(e)
+            raise
+        finally:
+            self.in_flight[key] -= 1
+            duration = time() - started
+            TRACER.add_span(operation, resource, started, duration, {'outcome': outcome})
+            self.report(operation, resource, outcome, duration)
+
+    def report_e2e(self, auction, lot_type):
+        """
+        Report time from last modification of auction till convoy finished
+        its processing, as `E2E_LATENCY` histogram per lot type and status.
+        """
+        if not (self.enabled and self.publish) or not auction.get('dateModified'):
+            return
+        try:
+            latency = time() - parse_date(auction['dateModified'])
+        except ValueError:
+            return
+        metric = 'auction_e2e.{}.{}'.format(lot_type, auction['status'])
+        METRICS_LOGGER.info('%s took %.1f s', metric, latency,
+                            extra={'MESSAGE_ID': metric, E2E_LATENCY: latency * 1000})
+
+
+STAGE_METRICS = StageMetrics()
+
+
+def stage(operation, resource):
+    """Decorator, which measures processing stage with `STAGE_METRICS`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not STAGE_METRICS.enabled:
+                return func(*args, **kwargs)
+            with STAGE_METRICS.timed(operation, resource):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedClient(object):
+    """Proxy of API client, which measures every public method call"""
+
+    def __init__(self, client, resource):
+        self._client = client
+        self._resource = resource
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name == 'ds_client':
+            attr = InstrumentedClient(attr, 'ds')
+        elif callable(attr) and not name.startswith('_'):
+            attr = self._timed(name, attr)
+        else:
+            return attr
+        setattr(self, name, attr)
+        return attr
+
+    def _timed(self, name, method):
+        def call(*args, **kwargs):
+            with STAGE_METRICS.timed(name, self._resource):
+                return method(*args, **kwargs)
+        return call
+
+
+def instrument_clients(clients):
+    """Wrap API clients of `init_clients` result into `InstrumentedClient`"""
+    instrumented = dict(clients)
+    for key in CLIENTS:
+        if key in clients:
+            instrumented[key] = InstrumentedClient(clients[key], key[:-len('_client')])
+    return instrumented
+
+
+class FeedLagMonitor(object):
+    """
+    Periodically compare sequence convoy has processed with `update_seq` of
+    database and report number of pending changes and estimated time to
+    process them as `FEED_LAG_CHANGES` and `FEED_LAG_SECONDS` gauges.
+    """
+
+    def __init__(self, db, feed_state, interval=30):
+        self.db = db
+        self.feed_state = feed_state
+        self.interval = interval
+        self.previous = None
+        self.progressed_at = time()
+
+    def sample(self):
+        """
+        :return: number of pending changes and seconds convoy is behind
+        :rtype: tuple
+        """
+        now = time()
+        update_seq = seq_number(self.db.info()['update_seq'])
+        processed_seq = seq_number(self.feed_state['last_seq'])
+        pending = max(0, update_seq - processed_seq)
+        rate = 0
+        if self.previous is not None:
+            previous_time, previous_seq = self.previous
+            if processed_seq > previous_seq:
+                self.progressed_at = now
+                rate = (processed_seq - previous_seq) / (now - previous_time)
+        self.previous = (now, processed_seq)
+        if not pending:
+            self.progressed_at = now
+            seconds = 0
+        elif rate:
+            seconds = pending / rate
+        else:
+            seconds = now - self.progressed_at
+        METRICS_LOGGER.info(
+            'Feed lag: %d pending changes, %.0f s behind', pending, seconds,
+            extra={'MESSAGE_ID': 'feed_lag', FEED_LAG_CHANGES: pending,
+                   FEED_LAG_SECONDS: seconds}
+        )
+        return pending, seconds
+
+    def run(self, killer):
+        while not killer.kill_now:
+            try:
+                self.sample()
+            except Exception as e:
+                LOGGER.warning('Failed to measure feed lag: {!r}'.format(e))
+            sleep(self.interval)
+
+
+class HubBlockMonitor(object):
+    """
+    Report greenlets, which block gevent hub longer than `threshold` seconds.
+
+    Blocking is detected by gevent monitoring thread, which checks every
+    `threshold` seconds that greenlets were switched. Its events are queued
+    and reported from `run` greenlet as `hub_blocked` warnings with stack of
+    blocking greenlet and `HUB_BLOCKED` histogram of estimated duration.
+    Consecutive detections of the same block are merged.
+    """
+
+    def __init__(self, threshold=0.1, interval=1):
+        self.threshold = threshold
+        self.interval = interval
+        self.blocks = 0
+        self.blocked_time = 0
+        self._events = deque(maxlen=1000)
+        self._pending = None
+
+    def start(self):
+        if EventLoopBlocked is None:
+            LOGGER.warning('Hub blocking monitor requires gevent >= 1.3')
+            return False
+        gevent_config.max_blocking_time = self.threshold
+        gevent_config.monitor_thread = True
+        if self.notify not in gevent_subscribers:
+            gevent_subscribers.append(self.notify)
+        get_hub().start_periodic_monitoring_thread()
+        LOGGER.info('Monitor hub blocks longer than {}s'.format(self.threshold))
+        return True
+
+    def stop(self):
+        if EventLoopBlocked is not None and self.notify in gevent_subscribers:
+            gevent_subscribers.remove(self.notify)
+
+    def notify(self, event):
+        """Subscriber of gevent events, called from monitoring thread"""
+        if isinstance(event, EventLoopBlocked):
+            self._events.append((time(), event.greenlet, event.info))
+
+    def report(self):
+        """
+        Report blocks detected since previous call.
+
+        :return: number of reported blocks
+        :rtype: int
+        """
+        reported = 0
+        while self._events:
+            detected_at, glet, info = self._events.popleft()
+            pending = self._pending
+            if (pending is not None and pending[1] is glet and
+                    detected_at - pending[3] <= self.threshold * 2):
+                pending[2] += self.threshold
+                pending[3] = detected_at
+                continue
+            if pending is not None:
+                self._report_block(*pending)
+                reported += 1
+            self._pending = [info, glet, self.threshold, detected_at]
+        if self._pending is not None and time() - self._pending[3] > self.threshold * 2:
+            self._report_block(*self._pending)
+            self._pending = None
+            reported += 1
+        return reported
+
+    def _report_block(self, info, glet, duration, detected_at):
+        self.blocks += 1
+        self.blocked_time += duration
+        LOGGER.warning(
+            'Hub was blocked for at least {:.0f} ms by {!r}\n{}'.format(
+                duration * 1000, glet, '\n'.join(info)),
+            extra={'MESSAGE_ID': 'hub_blocked', HUB_BLOCKED: duration * 1000}
+        )
+
+    def run(self, killer):
+        while not killer.kill_now:
+            self.report()
+            sleep(self.interval)
+        self.stop()
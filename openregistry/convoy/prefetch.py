@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from time import time
+
+from gevent.event import AsyncResult
+from gevent.pool import Pool
+
+from openregistry.convoy.metrics import METRICS_LOGGER
+
+ASSET = 'asset'
+
+
+class Prefetcher(object):
+    """
+    Fetch assets of lot of `pending.verification` auction as soon as
+    auction is read from feed, so they are ready when processor needs them.
+
+    Lot is read only to find its assets and is not kept: processor decides
+    on lot status and auctions after it locked the lot, so it always reads
+    the lot itself. Assets are requested in background with at most `concurrency`
+    requests at the same time, and are kept until processor takes them, at
+    most `ttl` seconds and `max_size` documents. Each prefetched document is
+    used once, so later requests get fresh one. Processor, which asks for
+    document while it is being fetched, waits for that request, failed
+    prefetch is repeated by processor.
+
+    Hits, misses and wasted (expired or evicted) documents are counted and
+    published with `prefetch.hit`, `prefetch.miss` and `prefetch.waste`
+    `MESSAGE_ID`.
+    """
+
+    def __init__(self, lots_client, assets_client, ttl=30, concurrency=10, max_size=1000):
+        self.lots_client = lots_client
+        self.assets_client = assets_client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.pool = Pool(concurrency)
+        self.entries = OrderedDict()  # (kind, id): (time, AsyncResult with response)
+        self.reading = set()  # ids of lots, whose assets are being found
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    def watch(self, auctions):
+        """Pass through `auctions` iterable, prefetching assets of auctions being formed"""
+        for auction in auctions:
+            if auction.get('status') == 'pending.verification' and auction.get('merchandisingObject'):
+                self.prefetch_assets(auction['merchandisingObject'])
+            yield auction
+
+    def prefetch_assets(self, lot_id):
+        if lot_id in self.reading or self.pool.full():  # do not hold up feed
+            return
+        self.reading.add(lot_id)
+        self.pool.spawn(self._fetch_assets, lot_id)
+
+    def _add(self, kind, resource_id):
+        now = time()
+        while self.entries:
+            key, (created, _) = next(self.entries.iteritems())
+            if len(self.entries) < self.max_size and now - created < self.ttl:
+                break
+            del self.entries[key]
+            self._count('waste')
+        result = self.entries[(kind, resource_id)] = (now, AsyncResult())
+        self.prefetched += 1
+        return result[1]
+
+    def _fetch(self, method, resource_id, result):
+        try:
+            response = method(resource_id)
+        except Exception as e:
+            result.set_exception(e)
+            return None
+        result.set(response)
+        return response
+
+    def _fetch_assets(self, lot_id):
+        try:
+            lot = self.lots_client.get_lot(lot_id)
+        except Exception:
+            return
+        finally:
+            self.reading.discard(lot_id)
+        for asset_id in lot.data.get('assets') or []:
+            if (ASSET, asset_id) not in self.entries:
+                self.pool.spawn(self._fetch, self.assets_client.get_asset, asset_id,
+                                self._add(ASSET, asset_id))
+
+    def get(self, kind, resource_id, fetch):
+        """
+        Take prefetched response, or call `fetch` with `resource_id` if
+        there is none.
+        """
+        created, result = self.entries.pop((kind, resource_id), (None, None))
+        if result is not None and time() - created >= self.ttl:
+            self._count('waste')
+            result = None
+        if result is not None:
+            try:
+                response = result.get()
+            except Exception:
+                pass
+            else:
+                self._count('hit')
+                return response
+        self._count('miss')
+        return fetch(resource_id)
+
+    def _count(self, event):
+        if event == 'hit':
+            self.hits += 1
+        elif event == 'miss':
+            self.misses += 1
+        else:
+            self.wasted += 1
+        METRICS_LOGGER.info('Prefetch %s', event, extra={'MESSAGE_ID': 'prefetch.{}'.format(event)})
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'prefetched': self.prefetched,
+            'hits': self.hits,
+            'misses': self.misses,
+            'wasted': self.wasted,
+            'hit_rate': float(self.hits) / requests if requests else 0.0,
+            'waste_rate': float(self.wasted) / self.prefetched if self.prefetched else 0.0,
+        }
+
+
+class PrefetchedClient(object):
+    """Proxy of assets API client, which takes documents from `Prefetcher`"""
+
+    def __init__(self, client, prefetcher):
+        self._client = client
+        self._prefetcher = prefetcher
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get_asset(self, asset_id):
+        return self._prefetcher.get(ASSET, asset_id, self._client.get_asset)
+
+
+def prefetch_clients(clients, config):
+    """
+    Wrap assets client of `init_clients` result into `PrefetchedClient`
+    of `Prefetcher`, which finds assets with lots client.
+
+    :param config: `prefetch` section of configuration with `Prefetcher`
+                   arguments
+    :type config: dict
+    :return: wrapped clients and prefetcher
+    :rtype: tuple
+    """
+    prefetcher = Prefetcher(clients['lots_client'], clients['assets_client'], **config)
+    prefetched = dict(clients)
+    prefetched['assets_client'] = PrefetchedClient(clients['assets_client'], prefetcher)
+    return prefetched, prefetcher
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import os
+import pstats
+import signal
+from collections import defaultdict
+from time import time
+from weakref import WeakKeyDictionary
+
+import greenlet
+from gevent import spawn_later
+from gevent.hub import Hub
+
+from openregistry.convoy.utils import LOGGER
+
+DETERMINISTIC = 'deterministic'
+SAMPLING = 'sampling'
+MODES = (DETERMINISTIC, SAMPLING)
+
+
+def greenlet_label(glet):
+    """Name of function greenlet runs, `main` and `hub` for special ones"""
+    if glet.parent is None:
+        return 'main'
+    if isinstance(glet, Hub):
+        return 'hub'
+    run = getattr(glet, '_run', None)
+    run = getattr(run, 'func', run)  # functools.partial
+    return getattr(run, '__name__', None) or type(glet).__name__
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+class Profiler(object):
+    """
+    CPU profiler of convoy with per-greenlet attribution.
+
+    `deterministic` mode keeps `cProfile` profile per greenlet function and
+    switches them on every greenlet switch, profiles are written as
+    `<output>-<timestamp>.<greenlet>.prof` for `pstats` or `snakeviz`.
+    `sampling` mode takes stack of running greenlet every `interval` seconds
+    of CPU time and writes them to `<output>-<timestamp>.folded` in the
+    collapsed format of `flamegraph.pl`.
+
+    Profiling stops after `seconds` or `auctions` processed auctions,
+    whichever comes first, or by `stop` / `toggle`.
+    """
+
+    def __init__(self, mode=DETERMINISTIC, output='convoy_profile', seconds=None,
+                 auctions=None, interval=0.005):
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode {}, use one of: {}'.format(mode, ', '.join(MODES)))
+        self.mode = mode
+        self.output = output
+        self.seconds = seconds
+        self.auctions = auctions
+        self.interval = interval
+        self.active = False
+        self._processed = 0
+        self._timer = None
+        self._profiles = {}
+        self._labels = WeakKeyDictionary()
+        self._current = None
+        self._previous_trace = None
+        self._samples = defaultdict(int)
+        self._started = None
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        self._processed = 0
+        self._started = time()
+        if self.mode == DETERMINISTIC:
+            self._profiles = {}
+            self._labels = WeakKeyDictionary()
+            self._previous_trace = greenlet.settrace(self._trace)
+            self._switch_to(greenlet.getcurrent())
+        else:
+            self._samples = defaultdict(int)
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        if self.seconds:
+            self._timer = spawn_later(self.seconds, self.stop)
+        LOGGER.info('Started {} profiling'.format(self.mode),
+                    extra={'MESSAGE_ID': 'profiling_started'})
+
+    def stop(self):
+        """
+        Stop profiling and write results.
+
+        :return: paths of written files
+        :rtype: list
+        """
+        if not self.active:
+            return []
+        self.active = False
+        if self._timer is not None and self._timer is not greenlet.getcurrent():
+            self._timer.kill(block=False)
+        self._timer = None
+        prefix = '{}-{}'.format(self.output, int(self._started))
+        if self.mode == DETERMINISTIC:
+            greenlet.settrace(self._previous_trace)
+            self._previous_trace = None
+            if self._current is not None:
+                self._current.disable()
+                self._current = None
+            paths = self._write_profiles(prefix)
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            paths = self._write_samples(prefix)
+        LOGGER.info('Profiling finished after {:.1f}s and {} auctions, written {}'.format(
+            time() - self._started, self._processed, ', '.join(paths) or 'nothing'),
+            extra={'MESSAGE_ID': 'profiling_finished'})
+        return paths
+
+    def toggle(self, signum=None, frame=None):
+        """Signal handler, which starts or stops profiling"""
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def auction_processed(self):
+        if not self.active:
+            return
+        self._processed += 1
+        if self.auctions and self._processed >= self.auctions:
+            self.stop()
+
+    def _switch_to(self, target):
+        label = self._labels.get(target)
+        if label is None:
+            label = self._labels[target] = greenlet_label(target)
+        profile = self._profiles.get(label)
+        if profile is None:
+            profile = self._profiles[label] = cProfile.Profile()
+        if self._current is not None:
+            self._current.disable()
+        self._current = profile
+        profile.enable()
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            self._switch_to(args[1])
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame_label(frame))
+            frame = frame.f_back
+        stack.append(greenlet_label(greenlet.getcurrent()))
+        self._samples[';'.join(reversed(stack))] += 1
+
+    def _write_profiles(self, prefix):
+        paths = []
+        combined = None
+        for label, profile in sorted(self._profiles.items()):
+            try:
+                stats = pstats.Stats(profile)
+            except TypeError:  # nothing was recorded
+                continue
+            path = '{}.{}.prof'.format(prefix, label)
+            stats.dump_stats(path)
+            paths.append(path)
+            if combined is None:
+                combined = pstats.Stats(path)
+            else:
+                combined.add(path)
+        if combined is not None:
+            path = '{}.prof'.format(prefix)
+            combined.dump_stats(path)
+            paths.append(path)
+        self._profiles = {}
+        self._labels = WeakKeyDictionary()
+        return paths
+
+    def _write_samples(self, prefix):
+        if not self._samples:
+            return []
+        path = '{}.folded'.format(prefix)
+        with open(path, 'w') as output:
+            for stack, count in sorted(self._samples.items()):
+                output.write('{} {}\n'.format(stack, count))
+        self._samples = defaultdict(int)
+        return [path]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging.config
+import os
+import sys
+from time import time
+
+from gevent import sleep
+from munch import Munch
+from yaml import load
+
+from openregistry.convoy.constants import DEFAULTS
+from openregistry.convoy.utils import (
+    FEED_FILTER_DOC,
+    LOGGER,
+    get_changes_page,
+    prepare_couchdb,
+)
+
+
+def replay_changes_feed(path, killer, loads=json.loads, item_factory=Munch,
+                        feed_state=None):
+    """
+    Generator of auctions from recorded changes, replacement of
+    `continuous_changes_feed` for offline runs.
+
+    :param path: JSON Lines file with `{"seq": ..., "doc": ...}` objects,
+                 `-` stands for stdin
+    :type path: str
+    :param loads: JSON decoder of records
+    :param item_factory: callable, which makes yielded item from document
+    :param feed_state: dict, where `last_seq` is saved after auction was
+                       processed
+    :type feed_state: dict
+    """
+    records = sys.stdin if path == '-' else open(path)
+    replayed = 0
+    started = time()
+    try:
+        for line in records:
+            line = line.strip()
+            if not line:
+                continue
+            record = loads(line)
+            yield item_factory(record['doc'])
+            replayed += 1
+            if feed_state is not None:
+                feed_state['last_seq'] = record['seq']
+                feed_state['heartbeat'] = time()
+            if killer.kill_now:
+                break
+    finally:
+        if records is not sys.stdin:
+            records.close()
+    elapsed = time() - started
+    LOGGER.info(
+        'Replayed {} auctions in {:.1f}s'.format(replayed, elapsed),
+        extra={'MESSAGE_ID': 'replay_finished'}
+    )
+
+
+def record_changes_feed(db, output, killer, since=0, limit=100,
+                        filter_doc=FEED_FILTER_DOC, max_changes=None,
+                        follow=False, timeout=10, dumps=json.dumps):
+    """
+    Write filtered changes feed to file in format `replay_changes_feed` reads.
+
+    :param output: file object records are written to
+    :param since: sequence to start from
+    :param max_changes: stop after this number of records
+    :type max_changes: int
+    :param follow: wait for new changes instead of stopping when feed is drained
+    :type follow: bool
+    :return: number of records written and last recorded sequence
+    :rtype: tuple
+    """
+    recorded = 0
+    while not killer.kill_now:
+        data = get_changes_page(db, since, limit, filter_doc)
+        for row in data['results']:
+            output.write(dumps({'seq': row['seq'], 'doc': row['doc']}) + '\n')
+            recorded += 1
+            since = row['seq']
+            if max_changes and recorded >= max_changes:
+                return recorded, since
+        since = data['last_seq']
+        if not data['results']:
+            if not follow:
+                break
+            sleep(timeout)
+    return recorded, since
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='--- OpenRegistry Convoy changes recorder ---'
+    )
+    parser.add_argument('config', type=str, help='Path to configuration file')
+    parser.add_argument('output', type=str,
+                        help='File changes are recorded to, "-" for stdout')
+    parser.add_argument('--since', dest='since', default=0,
+                        help='Sequence to start recording from')
+    parser.add_argument('--max', dest='max_changes', type=int,
+                        help='Number of changes to record')
+    parser.add_argument('--follow', dest='follow', action='store_const',
+                        const=True, default=False,
+                        help='Keep recording new changes until interrupted')
+    params = parser.parse_args()
+    config = {}
+    if os.path.isfile(params.config):
+        with open(params.config) as config_file_obj:
+            config = load(config_file_obj.read())
+        logging.config.dictConfig(config)
+    DEFAULTS.update(config)
+
+    from openregistry.convoy.convoy import GracefulKiller
+    db_config = DEFAULTS['db']
+    if db_config.get('login', '') and db_config.get('password', ''):
+        db_url = "http://{login}:{password}@{host}:{port}".format(**db_config)
+    else:
+        db_url = "http://{host}:{port}".format(**db_config)
+    db = prepare_couchdb(db_url, db_config['name'])
+
+    output = sys.stdout if params.output == '-' else open(params.output, 'a')
+    try:
+        recorded, last_seq = record_changes_feed(
+            db, output, GracefulKiller(), since=params.since,
+            max_changes=params.max_changes, follow=params.follow,
+            timeout=DEFAULTS.get('timeout', 10)
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    LOGGER.info('Recorded {} changes, last sequence {}'.format(recorded, last_seq))
+
+
+###############################################################################
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
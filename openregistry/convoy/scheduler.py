@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from heapq import heappop, heappush
+from itertools import count
+from time import time
+
+from gevent import spawn, joinall
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.pool import Group
+from gevent.queue import Empty, PriorityQueue
+
+from openregistry.convoy.metrics import METRICS_LOGGER
+from openregistry.convoy.utils import LOGGER, parse_date
+
+QUEUE_WAIT = 'QUEUE_WAIT'  # histogram of statsdconfig.yaml, milliseconds
+PIPELINE_QUEUED = 'PIPELINE_QUEUED'  # gauge of statsdconfig.yaml
+PIPELINE_ACTIVE = 'PIPELINE_ACTIVE'  # gauge of statsdconfig.yaml
+ACTIVATION = 'activation'
+REPORTING = 'reporting'
+PRIORITY_CLASSES = (ACTIVATION, REPORTING)  # in order of priority
+DEADLINE_FIELDS = ('tenderPeriod', 'auctionPeriod')
+NO_DEADLINE = float('inf')
+STOP = sys.maxint
+PENDING_WAIT = 1  # seconds between checks of killer while read ahead is full
+
+
+def priority_class(auction):
+    """Auctions waiting to be formed go before reporting of results"""
+    return ACTIVATION if auction['status'] == 'pending.verification' else REPORTING
+
+
+def deadline(auction):
+    """Earliest start date of auction periods as unix time"""
+    dates = []
+    for field in DEADLINE_FIELDS:
+        start_date = (auction.get(field) or {}).get('startDate')
+        if start_date:
+            try:
+                dates.append(parse_date(start_date))
+            except ValueError:
+                pass
+    return min(dates) if dates else NO_DEADLINE
+
+
+def rank(auction):
+    return PRIORITY_CLASSES.index(priority_class(auction)), deadline(auction)
+
+
+def acquire_pending(pending, killer=None):
+    """
+    Wait for free slot of read ahead.
+
+    :return: False if `killer` was set while waiting
+    :rtype: bool
+    """
+    while not pending.acquire(timeout=PENDING_WAIT):
+        if killer is not None and killer.kill_now:
+            return False
+    return True
+
+
+@contextmanager
+def unlimited():
+    yield
+
+
+def report_wait(auction_id, queue_name, priority, enqueued_at):
+    name = '{}.{}'.format(queue_name, PRIORITY_CLASSES[priority]) if queue_name else PRIORITY_CLASSES[priority]
+    wait = time() - enqueued_at
+    METRICS_LOGGER.info('Auction %s waited %.1f ms in %s queue', auction_id, wait * 1000, name,
+                        extra={'MESSAGE_ID': 'queue_wait.{}'.format(name), QUEUE_WAIT: wait * 1000})
+
+
+class PriorityScheduler(object):
+    """
+    Process auctions from feed in order of priority class and deadline
+    instead of arrival order.
+
+    Feed is read ahead into queue of at most `max_pending` auctions, feed
+    reading waits while it is full. `concurrency` workers take the most
+    urgent auction from it. When auction gets new change while it is
+    queued, the newest document is processed once. Time auction waited in
+    queue is reported as `QUEUE_WAIT` histogram per priority class.
+
+    With `limiter` worker waits for its slot after it took auction from
+    queue, so idle workers do not hold slots and number of auctions
+    processed at the same time follows adapted limit up to `maximum` of
+    limiter instead of fixed `concurrency`. Newer change of auction, which
+    waits for slot, still replaces it.
+    """
+
+    def __init__(self, process, concurrency=1, max_pending=1000, limiter=None):
+        self.process = process
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.queue = PriorityQueue()
+        self.pending = Semaphore(max_pending)
+        self.latest = {}
+        self.in_progress = set()
+        self.deferred = {}
+        self.processed = dict((name, 0) for name in PRIORITY_CLASSES)
+        self._requeued = set()  # ids of queued auctions, which do not hold `pending`
+        self._counter = count()
+
+    def rank(self, auction):
+        return rank(auction)
+
+    def put(self, auction, killer=None):
+        if auction['id'] in self.in_progress:  # queued again once processed
+            self.deferred[auction['id']] = auction
+            return
+        if auction['id'] in self.latest:
+            self.latest[auction['id']] = auction
+            return
+        if acquire_pending(self.pending, killer):
+            self._enqueue(auction)
+
+    def _enqueue(self, auction):
+        self.latest[auction['id']] = auction
+        self.queue.put(self.rank(auction) + (next(self._counter), time(), auction['id']))
+
+    @contextmanager
+    def slot(self):
+        """Free slot of limiter, held while auction is processed"""
+        if self.limiter is None:
+            yield
+            return
+        self.limiter.acquire()
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    def work(self, killer):
+        while not killer.kill_now:
+            try:
+                priority, _, _, enqueued_at, auction_id = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            if priority == STOP:
+                break
+            if auction_id in self._requeued:
+                self._requeued.discard(auction_id)
+            else:
+                self.pending.release()
+            with self.slot():
+                if killer.kill_now:  # slot was waited for
+                    break
+                auction = self.latest.pop(auction_id)
+                report_wait(auction_id, None, priority, enqueued_at)
+                self.in_progress.add(auction_id)
+                try:
+                    with self.limiter.measured() if self.limiter is not None else unlimited():
+                        self.process(auction)
+                except Exception as e:
+                    LOGGER.error('Failed to process auction {}: {!r}'.format(auction_id, e))
+                finally:
+                    self.in_progress.discard(auction_id)
+            self.processed[PRIORITY_CLASSES[priority]] += 1
+            if auction_id in self.deferred:
+                # queue is not bounded, so worker never waits for itself here
+                self._requeued.add(auction_id)
+                self._enqueue(self.deferred.pop(auction_id))
+
+    def run(self, auctions, killer):
+        """Process `auctions` iterable until it ends or `killer` is set"""
+        concurrency = self.concurrency if self.limiter is None else int(self.limiter.maximum)
+        workers = [spawn(self.work, killer) for _ in xrange(concurrency)]
+        try:
+            for auction in auctions:
+                self.put(auction, killer)
+                if killer.kill_now:
+                    break
+        finally:
+            if not killer.kill_now:  # let workers process the rest
+                for _ in workers:
+                    self.queue.put((STOP, NO_DEADLINE, next(self._counter), time(), None))
+            joinall(workers)
+
+
+class Pipeline(object):
+    """
+    Queue and concurrency budget of one lot type processor.
+
+    Auctions are queued by priority class and deadline separately for each
+    procurementMethodType, so type, which exhausted its sub-budget from
+    `budgets`, does not hold up other types of the same pipeline. Auction,
+    which gets new change while it is processed, is queued again once
+    processing finishes, so it is never processed concurrently.
+    """
+
+    def __init__(self, name, concurrency=1, weight=1, budgets=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.weight = float(weight)
+        self.budgets = budgets or {}
+        self.queues = defaultdict(list)
+        self.latest = {}
+        self.in_progress = set()
+        self.deferred = {}
+        self.active_by_type = defaultdict(int)
+        self.processed = 0
+        self.virtual_time = 0.0
+
+    @property
+    def queued(self):
+        return len(self.latest)
+
+    @property
+    def active(self):
+        return len(self.in_progress)
+
+    @property
+    def idle(self):
+        return not self.latest and not self.in_progress
+
+    def put(self, auction, number):
+        """
+        :return: True if auction was added to queue, False if it replaced
+                 newer document of queued or processed auction
+        :rtype: bool
+        """
+        auction_id = auction['id']
+        if auction_id in self.in_progress:
+            self.deferred[auction_id] = auction
+            return False
+        queued = auction_id in self.latest
+        self.latest[auction_id] = auction
+        if not queued:
+            heappush(self.queues[auction['procurementMethodType']],
+                     rank(auction) + (number, time(), auction_id))
+        return not queued
+
+    def next_type(self):
+        """procurementMethodType of the most urgent auction budgets let start"""
+        if self.active >= self.concurrency:
+            return None
+        best = None
+        for auction_type, queue in self.queues.items():
+            if queue and self.active_by_type[auction_type] < self.budgets.get(auction_type, self.concurrency):
+                if best is None or queue[0] < self.queues[best][0]:
+                    best = auction_type
+        return best
+
+    def pop(self, auction_type):
+        priority, _, _, enqueued_at, auction_id = heappop(self.queues[auction_type])
+        report_wait(auction_id, self.name, priority, enqueued_at)
+        self.in_progress.add(auction_id)
+        self.active_by_type[auction_type] += 1
+        return self.latest.pop(auction_id)
+
+    def done(self, auction, duration):
+        """
+        Release budget of processed auction and charge its processing time.
+
+        :return: newer document of auction received while it was processed
+        """
+        self.in_progress.discard(auction['id'])
+        self.active_by_type[auction['procurementMethodType']] -= 1
+        self.processed += 1
+        self.virtual_time += duration / self.weight
+        METRICS_LOGGER.info('Pipeline %s: %d queued, %d active', self.name, self.queued, self.active,
+                            extra={'MESSAGE_ID': 'pipeline.{}'.format(self.name),
+                                   PIPELINE_QUEUED: self.queued, PIPELINE_ACTIVE: self.active})
+        return self.deferred.pop(auction['id'], None)
+
+
+class FairScheduler(object):
+    """
+    Process auctions in isolated pipelines, one per lot type, so slow or
+    busy processor of one lot type can not starve the other.
+
+    Each pipeline has its own queue and `concurrency` budget. Free slot of
+    total `concurrency` goes to pipeline with the least processing time
+    divided by its `weight` (weighted fair queueing on service time), so
+    busy pipelines share processing time in proportion to their weights.
+    Auctions of types without pipeline are processed right away. At most
+    `max_pending` auctions are read ahead from feed. With `limiter` total
+    concurrency is its adapted limit instead of fixed `concurrency`.
+    """
+
+    def __init__(self, process, pipelines, pipeline_of, concurrency=None, max_pending=1000,
+                 limiter=None):
+        self.process = process
+        self.pipelines = dict((pipeline.name, pipeline) for pipeline in pipelines)
+        self.pipeline_of = pipeline_of
+        self.concurrency = concurrency or sum(pipeline.concurrency for pipeline in pipelines)
+        self.limiter = limiter
+        self.pending = Semaphore(max_pending)
+        self.workers = Group()
+        self.active = 0  # slots taken, freed before greenlet leaves `workers`
+        self.wakeup = Event()
+        self.closed = False
+        self._requeued = set()  # ids of queued auctions, which do not hold `pending`
+        self._counter = count()
+
+    def put(self, auction, killer=None):
+        pipeline = self.pipelines.get(self.pipeline_of(auction))
+        if pipeline is None:
+            self.process(auction)
+            return
+        if not acquire_pending(self.pending, killer):
+            return
+        if pipeline.idle:  # pipeline does not save up time it was idle
+            busy = [other.virtual_time for other in self.pipelines.values() if not other.idle]
+            if busy:
+                pipeline.virtual_time = max(pipeline.virtual_time, min(busy))
+        if not pipeline.put(auction, next(self._counter)):
+            self.pending.release()
+        self.wakeup.set()
+
+    @property
+    def limit(self):
+        """Auctions processed at the same time"""
+        return self.concurrency if self.limiter is None else int(self.limiter.limit)
+
+    def select(self):
+        """
+        :return: pipeline, which gets next slot, and procurementMethodType
+                 to take from it, or (None, None) if nothing can start
+        """
+        if self.active >= self.limit:
+            return None, None
+        candidates = []
+        for name, pipeline in self.pipelines.items():
+            auction_type = pipeline.next_type()
+            if auction_type is not None:
+                candidates.append((pipeline.virtual_time, name, auction_type))
+        if not candidates:
+            return None, None
+        _, name, auction_type = min(candidates)
+        return self.pipelines[name], auction_type
+
+    def dispatch(self, killer):
+        while not killer.kill_now:
+            pipeline, auction_type = self.select()
+            if pipeline is None:
+                if self.closed and all(p.idle for p in self.pipelines.values()):
+                    break
+                self.wakeup.clear()
+                self.wakeup.wait(1)
+                continue
+            auction = pipeline.pop(auction_type)
+            if auction['id'] in self._requeued:
+                self._requeued.discard(auction['id'])
+            else:
+                self.pending.release()
+            self.active += 1
+            self.workers.spawn(self._process, pipeline, auction)
+
+    def _process(self, pipeline, auction):
+        started = time()
+        try:
+            with self.limiter.limited() if self.limiter is not None else unlimited():
+                self.process(auction)
+        except Exception as e:
+            LOGGER.error('Failed to process auction {}: {!r}'.format(auction['id'], e))
+        finally:
+            newer = pipeline.done(auction, time() - started)
+            if newer is not None and pipeline.put(newer, next(self._counter)):
+                self._requeued.add(newer['id'])
+            self.active -= 1
+            self.wakeup.set()
+
+    def run(self, auctions, killer):
+        """Process `auctions` iterable until it ends or `killer` is set"""
+        dispatcher = spawn(self.dispatch, killer)
+        try:
+            for auction in auctions:
+                self.put(auction, killer)
+                if killer.kill_now:
+                    break
+        finally:
+            self.closed = True
+            self.wakeup.set()
+            dispatcher.join()
+            self.workers.join()
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for CouchDB, auctions, lots, assets, contracts APIs and Document
+Service, which convoy works with. World of auctions and their lots is
+generated from scenario file, responses are delayed and failed according to
+it:
+
+    python -m openregistry.convoy.simulator simulator.yaml --port 6543
+
+CouchDB is served from the root, APIs from `/api/<version>/<resource>` and
+Document Service from `/ds`, so convoy should be configured with the same
+host for `db`, every `api` section and `host_url` + `/ds` for `ds`.
+"""
+import argparse
+import json
+import math
+from copy import deepcopy
+from random import Random
+from time import time
+from urllib import unquote
+from urlparse import parse_qsl
+from uuid import uuid4
+
+from gevent import sleep
+from gevent.pywsgi import WSGIServer
+from yaml import safe_load as load
+
+from openregistry.convoy.constants import FEED_DOC_FIELDS
+from openregistry.convoy.utils import LOGGER, convoy_feed_selector, match_selector
+
+SCENARIO_DEFAULTS = {
+    'seed': None,
+    'api_version': 0,
+    'auctions': [
+        {'lot_type': 'loki', 'procurementMethodType': 'sellout.english',
+         'status': 'complete', 'count': 100},
+        {'lot_type': 'basic', 'procurementMethodType': 'rubble',
+         'status': 'pending.verification', 'count': 100},
+    ],
+    'assets_per_lot': 2,
+    'documents': {'per_asset': 1, 'size': 1024},
+    'latency': {},
+    'errors': {},
+}
+
+GROUPS = ('couchdb', 'auctions', 'lots', 'assets', 'contracts', 'ds')
+
+STATUS_REASONS = {
+    200: 'OK', 201: 'Created', 404: 'Not Found', 405: 'Method Not Allowed',
+    409: 'Conflict', 412: 'Precondition Failed', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 502: 'Bad Gateway',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+def load_scenario(path):
+    scenario = deepcopy(SCENARIO_DEFAULTS)
+    if path:
+        with open(path) as scenario_file:
+            scenario.update(load(scenario_file.read()) or {})
+    return scenario
+
+
+def sample_latency(spec, rnd):
+    """
+    Delay of response in seconds, drawn from distribution described by `spec`:
+    `constant` (value), `uniform` (min, max), `lognormal` (median, sigma) or
+    `exponential` (mean).
+    """
+    if not spec:
+        return 0
+    distribution = spec.get('distribution', 'constant')
+    if distribution == 'constant':
+        return spec.get('value', 0)
+    if distribution == 'uniform':
+        return rnd.uniform(spec.get('min', 0), spec.get('max', 0))
+    if distribution == 'lognormal':
+        return rnd.lognormvariate(math.log(spec['median']), spec.get('sigma', 0.5))
+    if distribution == 'exponential':
+        return rnd.expovariate(1.0 / spec['mean'])
+    raise ValueError('Unknown latency distribution {}'.format(distribution))
+
+
+class SimulatorError(Exception):
+
+    def __init__(self, status, reason=None):
+        super(SimulatorError, self).__init__(status)
+        self.status = status
+        self.reason = reason or STATUS_REASONS.get(status, '')
+
+
+class Simulator(object):
+    """WSGI application with generated world of auctions, lots and assets"""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.random = Random(scenario.get('seed'))
+        self.api_prefix = ['api', str(scenario.get('api_version', 0))]
+        self.update_seq = 0
+        self.docs = {}
+        self.seqs = {}
+        self.resources = {'auctions': {}, 'lots': {}, 'assets': {}, 'contracts': {}}
+        self.files = {}
+        self.auctions_types = {}
+        self.stats = {'requests': dict.fromkeys(GROUPS, 0), 'errors': {}, 'timings': []}
+        self.populate()
+        self.feed_selector = convoy_feed_selector(self.auctions_types)
+
+    # World
+
+    def populate(self):
+        for spec in self.scenario['auctions']:
+            lot_type = spec.get('lot_type', 'loki')
+            pmt = spec['procurementMethodType']
+            self.auctions_types.setdefault(lot_type, [])
+            if pmt not in self.auctions_types[lot_type]:
+                self.auctions_types[lot_type].append(pmt)
+            for _ in xrange(spec.get('count', 1)):
+                if lot_type == 'basic':
+                    self._basic_auction(pmt, spec.get('status', 'pending.verification'))
+                else:
+                    self._loki_auction(pmt, spec.get('status', 'complete'))
+
+    def _new_id(self):
+        return '{:032x}'.format(self.random.getrandbits(128))
+
+    def _save_doc(self, doc):
+        self.update_seq += 1
+        doc['_rev'] = '{}-{}'.format(self.update_seq, self._new_id())
+        self.docs[doc['_id']] = doc
+        self.seqs[doc['_id']] = self.update_seq
+
+    def _auction(self, pmt, status, lot_id):
+        auction_id = self._new_id()
+        auction = {
+            '_id': auction_id,
+            'id': auction_id,
+            'doc_type': 'Auction',
+            'procurementMethodType': pmt,
+            'status': status,
+            'merchandisingObject': lot_id,
+            'auctionID': 'UA-EA-{}'.format(auction_id[:8]),
+            'dateModified': '2018-01-01T00:00:00+02:00',
+        }
+        self.resources['auctions'][auction_id] = auction
+        return auction
+
+    def _loki_auction(self, pmt, status):
+        lot_id = self._new_id()
+        auction = self._auction(pmt, status, lot_id)
+        auction['contractTerms'] = {'type': 'yoke'}
+        auction['contracts'] = [{
+            'id': self._new_id(),
+            'awardID': self._new_id(),
+            'contractID': '{}-1'.format(auction['auctionID']),
+            'items': [{'id': self._new_id(), 'description': 'item'}],
+            'suppliers': [{'name': 'supplier'}],
+            'value': {'amount': 100.0, 'currency': 'UAH'},
+            'dateSigned': '2018-01-01T00:00:00+02:00',
+        }]
+        self.resources['lots'][lot_id] = {
+            'id': lot_id,
+            'status': 'active.auction',
+            'lotType': 'loki',
+            'auctions': [{'id': self._new_id(), 'relatedProcessID': auction['id'],
+                          'status': 'active'}],
+            'contracts': [{'id': self._new_id(), 'type': 'yoke'}],
+        }
+        self._save_doc(auction)
+
+    def _basic_auction(self, pmt, status):
+        lot_id = self._new_id()
+        assets = [self._asset(lot_id) for _ in xrange(self.scenario.get('assets_per_lot', 1))]
+        self.resources['lots'][lot_id] = {
+            'id': lot_id,
+            'status': 'active.salable',
+            'lotType': 'basic',
+            'lotIdentifier': 'L{}'.format(lot_id[:8]),
+            'assets': assets,
+            'auctions': [],
+        }
+        self._save_doc(self._auction(pmt, status, lot_id))
+
+    def _asset(self, lot_id):
+        asset_id = self._new_id()
+        documents_config = self.scenario.get('documents', {})
+        documents = []
+        for _ in xrange(documents_config.get('per_asset', 0)):
+            file_id = self._new_id()
+            self.files[file_id] = documents_config.get('size', 1024)
+            documents.append({
+                'id': self._new_id(),
+                'hash': 'md5:{}'.format(file_id),
+                'title': 'document.pdf',
+                'format': 'application/pdf',
+                'documentType': 'technicalSpecifications',
+                'url': '/ds/get/{}'.format(file_id),
+            })
+        self.resources['assets'][asset_id] = {
+            'id': asset_id,
+            'status': 'active',
+            'relatedLot': lot_id,
+            'title': 'asset {}'.format(asset_id[:8]),
+            'description': 'asset description',
+            'classification': {'scheme': 'CAV', 'id': '39513200-3', 'description': 'Cars'},
+            'unit': {'code': 'H87', 'name': 'pieces'},
+            'quantity': 1,
+            'address': {'countryName': 'Ukraine'},
+            'documents': documents,
+        }
+        return asset_id
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        started = time()
+        method = environ['REQUEST_METHOD']
+        parts = [unquote(part) for part in environ['PATH_INFO'].strip('/').split('/') if part]
+        if parts[:2] == self.api_prefix and len(parts) > 2:
+            group = parts[2] if parts[2] in self.resources else 'auctions'
+        elif parts[:1] == ['ds']:
+            group = 'ds'
+        else:
+            group = 'couchdb'
+        self.stats['requests'][group] += 1
+
+        sleep(sample_latency(self.scenario['latency'].get(group), self.random))
+        headers = [('Content-Type', 'application/json')]
+        try:
+            if parts[-1:] != ['spore']:
+                self._inject_error(group)
+            if group == 'couchdb':
+                status, body = self.couchdb(method, parts, environ)
+            elif group == 'ds':
+                status, body = self.document_service(method, parts[1:], environ, headers)
+            else:
+                status, body = self.api(method, parts[2:], environ)
+        except SimulatorError as e:
+            self.stats['errors'][e.status] = self.stats['errors'].get(e.status, 0) + 1
+            status, body = e.status, {'status': 'error', 'errors': [{'description': e.reason}]}
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        if ('Content-Type', 'application/json') in headers and status in (200, 201):
+            headers.append(('Set-Cookie', 'SERVER_ID=simulator; Path=/'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response('{} {}'.format(status, STATUS_REASONS.get(status, '')), headers)
+        self.stats['timings'].append(time() - started)
+        return [body if method != 'HEAD' else '']
+
+    def _inject_error(self, group):
+        draw = self.random.random()
+        for status, probability in sorted(self.scenario['errors'].get(group, {}).items()):
+            if draw < probability:
+                raise SimulatorError(int(status))
+            draw -= probability
+
+    @staticmethod
+    def _body(environ):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        data = environ['wsgi.input'].read(length) if length else ''
+        return json.loads(data) if data else {}
+
+    @staticmethod
+    def _params(environ):
+        params = {}
+        for name, value in parse_qsl(environ.get('QUERY_STRING', '')):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
+
+    # CouchDB
+
+    def couchdb(self, method, parts, environ):
+        if not parts:
+            return 200, {'couchdb': 'Welcome', 'version': '1.6.1'}
+        if len(parts) == 1:
+            if method == 'PUT':
+                return 201, {'ok': True}
+            return 200, {'db_name': parts[0], 'update_seq': self.update_seq,
+                         'doc_count': len(self.docs)}
+        params = self._params(environ)
+        if method == 'POST':
+            params.update(self._body(environ))
+        action = parts[1]
+        if action == '_changes':
+            return 200, self._changes(params)
+        if action == '_all_docs':
+            return 200, self._all_docs(params)
+        if action == '_find':
+            return 200, self._find(params)
+        if action == '_design' and parts[3:5] == ['_view', 'pending_work']:
+            return 200, self._pending_work(params)
+        if action == '_design' and parts[3:5] == ['_view', 'projection']:
+            return 200, self._projection(params)
+        doc_id = '/'.join(parts[1:])
+        if method == 'PUT':
+            doc = self._body(environ)
+            doc['_id'] = doc_id
+            self._save_doc(doc)
+            return 201, {'ok': True, 'id': doc_id, 'rev': doc['_rev']}
+        if doc_id not in self.docs:
+            raise SimulatorError(404, 'missing')
+        return 200, self.docs[doc_id]
+
+    def _changes(self, params):
+        since = int(str(params.get('since', 0)).split('-')[0])
+        limit = int(params.get('limit', 0)) or None
+        selector = None
+        if '_selector' in params:
+            selector = params['_selector'].get('selector', params['_selector'])
+        elif params.get('filter'):
+            selector = self.feed_selector
+        changed = sorted((seq, doc_id) for doc_id, seq in self.seqs.items() if seq > since)
+        results = []
+        last_seq = since
+        for seq, doc_id in changed:
+            last_seq = seq
+            doc = self.docs[doc_id]
+            if selector is not None and not match_selector(doc, selector):
+                continue
+            row = {'seq': seq, 'id': doc_id, 'changes': [{'rev': doc['_rev']}]}
+            if params.get('include_docs'):
+                row['doc'] = doc
+            results.append(row)
+            if limit and len(results) == limit:
+                break
+        else:
+            last_seq = self.update_seq if changed else since
+        return {'results': results, 'last_seq': last_seq}
+
+    def _all_docs(self, params):
+        rows = []
+        for key in params.get('keys', sorted(self.docs)):
+            doc = self.docs.get(key)
+            if doc is None:
+                rows.append({'key': key, 'error': 'not_found'})
+                continue
+            row = {'id': key, 'key': key, 'value': {'rev': doc['_rev']}}
+            if params.get('include_docs'):
+                row['doc'] = doc
+            rows.append(row)
+        return {'total_rows': len(self.docs), 'offset': 0, 'rows': rows}
+
+    def _find(self, query):
+        docs = [doc for doc in self.docs.values() if match_selector(doc, query['selector'])]
+        fields = query.get('fields')
+        if fields:
+            docs = [{field: doc[field] for field in fields if field in doc} for doc in docs]
+        return {'docs': docs[:query.get('limit', 25)]}
+
+    def _projection(self, params):
+        rows = []
+        for key in params.get('keys', sorted(self.docs)):
+            doc = self.docs.get(key)
+            if doc is None or doc.get('doc_type') != 'Auction':
+                continue
+            rows.append({'id': key, 'key': key, 'value': {
+                field: doc[field] for field in FEED_DOC_FIELDS if field in doc
+            }})
+        return {'total_rows': len(self.docs), 'offset': 0, 'rows': rows}
+
+    def _pending_work(self, params):
+        rows = sorted(
+            ([doc['procurementMethodType'], doc['status']], doc_id)
+            for doc_id, doc in self.docs.items()
+            if doc.get('doc_type') == 'Auction' and match_selector(doc, self.feed_selector)
+        )
+        startkey, endkey = params.get('startkey'), params.get('endkey')
+        start_doc_id = params.get('startkey_docid')
+        result = []
+        for key, doc_id in rows:
+            if startkey is not None and (
+                    key < startkey or (key == startkey and start_doc_id and doc_id < start_doc_id)):
+                continue
+            if endkey is not None and key > endkey:
+                continue
+            row = {'id': doc_id, 'key': key, 'value': None}
+            if params.get('include_docs'):
+                row['doc'] = self.docs[doc_id]
+            result.append(row)
+        limit = params.get('limit')
+        return {'total_rows': len(rows), 'offset': 0, 'rows': result[:limit] if limit else result}
+
+    # APIs
+
+    def api(self, method, parts, environ):
+        if parts == ['spore']:
+            return 200, {}
+        resource = self.resources.get(parts[0])
+        if resource is None:
+            raise SimulatorError(404)
+        if len(parts) == 1:
+            if method != 'POST':
+                raise SimulatorError(405)
+            data = self._body(environ)['data']
+            data['id'] = self._new_id()
+            resource[data['id']] = data
+            return 201, {'data': data}
+        item = resource.get(parts[1])
+        if item is None:
+            raise SimulatorError(404)
+        if parts[2:] == ['extract_credentials']:
+            return 200, {'data': {'id': item['id'], 'transfer_token': uuid4().hex}}
+        if len(parts) == 2:
+            if method == 'PATCH':
+                item.update(self._body(environ)['data'])
+                if parts[0] == 'auctions':
+                    self._save_doc(item)
+            return 200, {'data': self._public(item, environ)}
+        subitems = item.setdefault(parts[2], [])
+        if method == 'POST' and len(parts) == 3:
+            subitem = self._body(environ)['data']
+            subitem['id'] = self._new_id()
+            subitems.append(subitem)
+            return 201, {'data': subitem}
+        subitem = next((s for s in subitems if s.get('id') == parts[3]), None) if len(parts) == 4 else None
+        if subitem is None:
+            raise SimulatorError(404)
+        if method == 'PATCH':
+            subitem.update(self._body(environ)['data'])
+        return 200, {'data': subitem}
+
+    @staticmethod
+    def _public(item, environ):
+        """Resource as API returns it, with absolute urls of documents"""
+        item = {key: value for key, value in item.items() if not key.startswith('_')}
+        item.pop('doc_type', None)
+        if item.get('documents'):
+            host = 'http://{}'.format(environ.get('HTTP_HOST', 'localhost'))
+            item['documents'] = [
+                dict(document, url=host + document['url']) if document['url'].startswith('/') else document
+                for document in item['documents']
+            ]
+        return item
+
+    # Document Service
+
+    def document_service(self, method, parts, environ, headers):
+        host = 'http://{}/ds'.format(environ.get('HTTP_HOST', 'localhost'))
+        if parts == ['register'] and method == 'POST':
+            file_id = self._new_id()
+            self.files[file_id] = self.scenario.get('documents', {}).get('size', 1024)
+            data = self._body(environ)['data']
+            return 201, {
+                'upload_url': '{}/upload/{}'.format(host, file_id),
+                'data': {'url': '{}/get/{}'.format(host, file_id), 'hash': data['hash']},
+            }
+        if parts[:1] == ['upload'] and method == 'POST':
+            self._body_size(environ)
+            file_id = parts[1] if len(parts) > 1 else self._new_id()
+            return 200, {'data': {'url': '{}/get/{}'.format(host, file_id)},
+                         'get_url': '{}/get/{}'.format(host, file_id)}
+        if parts[:1] == ['get'] and len(parts) == 2 and parts[1] in self.files:
+            del headers[:]
+            headers.append(('Content-Type', 'application/pdf'))
+            headers.append(('Content-Disposition', 'attachment; filename="document.pdf"'))
+            return 200, 'x' * self.files[parts[1]]
+        raise SimulatorError(404)
+
+    @staticmethod
+    def _body_size(environ):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        return len(environ['wsgi.input'].read(length)) if length else 0
+
+
+def serve(simulator, host='127.0.0.1', port=0):
+    """Start simulator in background, port 0 picks free one"""
+    server = WSGIServer((host, port), simulator, log=None)
+    server.start()
+    LOGGER.info('Simulator is listening on {}:{}'.format(*server.address[:2]))
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--- OpenRegistry Convoy simulator ---')
+    parser.add_argument('scenario', type=str, nargs='?', help='Path to scenario file')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6543)
+    params = parser.parse_args()
+    simulator = Simulator(load_scenario(params.scenario))
+    WSGIServer((params.host, params.port), simulator).serve_forever()
+
+
+###############################################################################
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
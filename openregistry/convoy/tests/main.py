@@ -1,12 +1,41 @@
 # -*- coding: utf-8 -*-
 import unittest
-from openregistry.convoy.tests import test_convoy, test_utils
+from openregistry.convoy.tests import (
+    test_benchmarks,
+    test_codec,
+    test_convoy,
+    test_introspection,
+    test_limiter,
+    test_logqueue,
+    test_metrics,
+    test_prefetch,
+    test_profiling,
+    test_replay,
+    test_scheduler,
+    test_simulator,
+    test_tracing,
+    test_utils,
+    test_views,
+)
 
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(test_convoy.suite())
     suite.addTest(test_utils.suite())
+    suite.addTest(test_benchmarks.suite())
+    suite.addTest(test_codec.suite())
+    suite.addTest(test_introspection.suite())
+    suite.addTest(test_limiter.suite())
+    suite.addTest(test_logqueue.suite())
+    suite.addTest(test_metrics.suite())
+    suite.addTest(test_prefetch.suite())
+    suite.addTest(test_profiling.suite())
+    suite.addTest(test_replay.suite())
+    suite.addTest(test_scheduler.suite())
+    suite.addTest(test_simulator.suite())
+    suite.addTest(test_tracing.suite())
+    suite.addTest(test_views.suite())
     return suite
 
 
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from munch import munchify
+
+from openregistry.convoy.benchmarks import percentile
+from openregistry.convoy.benchmarks.documents import synthetic_asset, synthetic_auction
+from openregistry.convoy.benchmarks.suite import compare, main
+from openregistry.convoy.utils import make_contract
+
+
+class TestBenchmarksSuite(unittest.TestCase):
+    """ TestCase of benchmarks helpers """
+
+    @mock.patch('openregistry.convoy.benchmarks.suite.sys.stdout')
+    def test_benchmarks_regression_gate(self, mock_stdout):
+        results = [{'name': 'make_contract', 'median': 1.1},
+                   {'name': 'feed to dispatch', 'median': 1.3},
+                   {'name': 'new benchmark', 'median': 5.0}]
+        baseline = {'make_contract': 1.0, 'feed to dispatch': 1.0}
+        self.assertEqual(compare(results, baseline, 0.2), ['feed to dispatch'])
+        self.assertEqual(compare(results, baseline, 0.5), [])
+        self.assertEqual(mock_stdout.write.call_count, 4)
+
+        self.assertEqual(percentile([], 50), 0)
+        self.assertEqual(percentile(range(1, 101), 50), 50)
+        self.assertEqual(percentile(range(1, 101), 99), 99)
+        self.assertEqual(percentile([3, 1, 2], 100), 3)
+
+    @mock.patch('openregistry.convoy.benchmarks.suite.AuctionsMapping')
+    @mock.patch('openregistry.convoy.benchmarks.suite.measure')
+    @mock.patch('openregistry.convoy.benchmarks.suite.sys.stdout')
+    def test_benchmarks_main(self, mock_stdout, mock_measure, _):
+        mock_measure.return_value = ([1.0], None)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        baseline = os.path.join(directory, 'baseline.json')
+        argv = ['openregistry_convoy_benchmarks', '--baseline', baseline, '--number', '1', '--repeat', '1']
+
+        with mock.patch('sys.argv', argv):
+            # without baseline there is nothing to compare with
+            self.assertEqual(main(), 0)
+            self.assertFalse(os.path.isfile(baseline))
+
+        with mock.patch('sys.argv', argv + ['--save']):
+            self.assertEqual(main(), 0)
+        with open(baseline) as baseline_file:
+            self.assertEqual(json.load(baseline_file)['make_contract'], 1.0)
+
+        with mock.patch('sys.argv', argv):
+            self.assertEqual(main(), 0)
+
+            # slower than baseline beyond threshold fails the run
+            with open(baseline, 'w') as baseline_file:
+                json.dump({'make_contract': 0.5}, baseline_file)
+            self.assertEqual(main(), 1)
+        mock_stdout.write.assert_any_call('Regressed beyond 20%: make_contract\n')
+
+    def test_synthetic_documents(self):
+        asset = synthetic_asset(items=3, documents=2)
+        self.assertEqual((len(asset['items']), len(asset['documents'])), (3, 2))
+        self.assertEqual(asset['classification']['scheme'], 'CAV')
+        self.assertEqual(asset['documents'][0]['relatedItem'], asset['id'])
+        self.assertNotEqual(synthetic_asset()['id'], asset['id'])
+
+        # auction is complete enough for processing
+        contract = make_contract(munchify(synthetic_auction()))
+        self.assertEqual(contract['contractType'], 'yoke')
+        self.assertEqual(contract['value']['amount'], 479.0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBenchmarksSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import mock
+
+from openregistry.convoy.codec import get_codec, install_codec
+
+
+class TestCodecSuite(unittest.TestCase):
+    """ TestCase of JSON codecs """
+
+    @mock.patch('logging.Logger.warning')
+    def test_get_codec(self, mock_warning):
+        codec = get_codec('json')
+        self.assertEqual(codec.name, 'json')
+        self.assertIs(codec.loads, json.loads)
+        self.assertIs(codec.dumps, json.dumps)
+
+        codec = get_codec('not_installed_json')
+        self.assertEqual(codec.name, 'json')
+        mock_warning.assert_called_once_with(
+            'JSON codec not_installed_json is not installed, fall back to json'
+        )
+
+        codec = get_codec('auto')
+        self.assertEqual(codec.loads('{"id": 1}'), {'id': 1})
+
+    def test_auto_codec_decodes_floats_exactly(self):
+        ujson = mock.MagicMock()
+        with mock.patch.dict('sys.modules', {'ujson': ujson}):
+            # installed ujson is not picked by default
+            codec = get_codec('auto')
+            self.assertIn(codec.name, ('simplejson', 'json'))
+            self.assertEqual(codec.loads('{"amount": 0.1}')['amount'], json.loads('0.1'))
+
+            codec = get_codec('ujson')
+            codec.loads('{"amount": 0.1}')
+        ujson.loads.assert_called_once_with('{"amount": 0.1}', precise_float=True)
+
+    @mock.patch('openregistry.convoy.codec.couchdb.json.use')
+    def test_install_codec(self, mock_use):
+        client_module = mock.MagicMock(loads=json.loads)
+        codec = get_codec('json')
+        codec.loads = mock.MagicMock()
+        with mock.patch.dict('sys.modules', {'openprocurement_client.clients': client_module}):
+            install_codec(codec)
+        mock_use.assert_called_once_with(decode=codec.loads, encode=codec.dumps)
+        # third party client modules are not patched
+        self.assertIs(client_module.loads, json.loads)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestCodecSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
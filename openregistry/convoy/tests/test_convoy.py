@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from gevent import monkey
 from openregistry.convoy.tests.test_utils import AlmostAlwaysTrue
-from openregistry.convoy.utils import make_contract
+from openregistry.convoy.utils import LotLockLost, LotLockTimeout, make_contract
 
 monkey.patch_all()
 
@@ -21,7 +21,8 @@ from openprocurement_client.resources.assets import AssetsClient
 from openprocurement_client.resources.lots import LotsClient
 from openprocurement_client.clients import APIResourceClient
 from openregistry.convoy.convoy import Convoy, main as convoy_main
-from openregistry.convoy.constants import DEFAULTS, GET_AUCTION_MESSAGE_ID
+from openregistry.convoy.constants import DEFAULTS, GET_AUCTION_MESSAGE_ID, LOT_LOCKED
+from openregistry.convoy.introspection import CACHES, unregister_cache
 from openregistry.convoy.loki.constants import (
     CREATE_CONTRACT_MESSAGE_ID,
     PRE_TERMINAL_MAPPING,
@@ -51,7 +52,13 @@ class MockedArgumentParser(mock.MagicMock):
         return munchify({
             'config': '{}/{}'.format(ROOT, '/convoy.yaml'),
             'check': False,
-            'auction_id': None
+            'auction_id': None,
+            'ids_file': None,
+            'since': None,
+            'until': None,
+            'replay': None,
+            'catch_up': False,
+            'profile': None
         })
 
 
@@ -408,10 +415,9 @@ class TestConvoySuite(unittest.TestCase):
 
         mock_loki_process.assert_called_with(auction_doc['data'])
         mock_info.assert_called_with(
-            'Received auction {} in status {}'.format(
-                auction_id,
-                auction_doc['data'].status,
-            ),
+            'Received auction %s in status %s',
+            auction_id,
+            auction_doc['data'].status,
             extra={'MESSAGE_ID': GET_AUCTION_MESSAGE_ID, 'STATUS': auction_doc['data'].status}
         )
 
@@ -422,7 +428,7 @@ class TestConvoySuite(unittest.TestCase):
 
         assert mock_loki_process.call_count == 1
         mock_warning.assert_called_with(
-            'Auction object {} not found'.format(auction_id)
+            'Auction object %s not found', auction_id
         )
 
     @mock.patch('requests.Response.raise_for_status')
@@ -447,7 +453,7 @@ class TestConvoySuite(unittest.TestCase):
         basic_processing = convoy.auction_type_processing_configurator['rubble']
         convoy.lots_client = basic_processing.lots_client = lc
         convoy.assets_client = basic_processing.assets_client = mock.MagicMock()
-        basic_processing.report_results(auction_doc)
+        self.assertTrue(basic_processing.report_results(auction_doc))
         convoy.lots_client.patch_resource_item.assert_called_with(
             auction_doc.merchandisingObject,
             {'data': {'status': 'pending.sold'}}
@@ -547,9 +553,8 @@ class TestConvoySuite(unittest.TestCase):
         )
 
         mock_logger.assert_called_with(
-            'Lot {} not found when report auction {} results'.format(
-                auction_doc.merchandisingObject, auction_doc.id
-            )
+            'Lot %s not found when report auction %s results',
+            auction_doc.merchandisingObject, auction_doc.id
         )
 
     @mock.patch('logging.Logger.info')
@@ -588,9 +593,8 @@ class TestConvoySuite(unittest.TestCase):
             auction_doc.merchandisingObject
         )
         mock_logger.assert_called_with(
-            'Auction {} results already reported to lot {}'.format(
-                auction_doc.id, auction_doc.merchandisingObject
-            )
+            'Auction %s results already reported to lot %s',
+            auction_doc.id, auction_doc.merchandisingObject
         )
 
     @mock.patch('logging.Logger.warning')
@@ -634,8 +638,8 @@ class TestConvoySuite(unittest.TestCase):
             auction_doc.merchandisingObject
         )
         mock_logger.assert_called_with(
-            'Auction object {} not found in lot {}'.format(
-                auction_doc.id, auction_doc.merchandisingObject))
+            'Auction object %s not found in lot %s',
+            auction_doc.id, auction_doc.merchandisingObject)
 
     @mock.patch('logging.Logger.info')
     @mock.patch('requests.Response.raise_for_status')
@@ -688,9 +692,8 @@ class TestConvoySuite(unittest.TestCase):
             {"data": contract_data}
         )
         mock_logger.assert_any_call(
-            'Successfully created contract {} from lot {}'.format(
-                contract.data.id, auction_doc.merchandisingObject
-            ),
+            'Successfully created contract %s from lot %s',
+            contract.data.id, auction_doc.merchandisingObject,
             extra={'MESSAGE_ID': CREATE_CONTRACT_MESSAGE_ID}
         )
 
@@ -752,10 +755,9 @@ class TestConvoySuite(unittest.TestCase):
             {"data": contract_data}
         )
         mock_logger.assert_any_call(
-            'Successfully created contract {} from lot {}'.format(
-                contract.data.id,
-                auction_doc.merchandisingObject
-            ),
+            'Successfully created contract %s from lot %s',
+            contract.data.id,
+            auction_doc.merchandisingObject,
             extra={'MESSAGE_ID': CREATE_CONTRACT_MESSAGE_ID}
         )
         mock_logger.assert_any_call(
@@ -816,10 +818,9 @@ class TestConvoySuite(unittest.TestCase):
         assert mock_update_lot_contract.call_count == 0
 
         mock_logger.assert_any_call(
-            'Contract {} has already created, and patched to lot {}'.format(
-                lot.contracts[0].get('relatedProcessID'),
-                lot.id
-            )
+            'Contract %s has already created, and patched to lot %s',
+            lot.contracts[0].get('relatedProcessID'),
+            lot.id
         )
 
     @mock.patch('requests.Response.raise_for_status')
@@ -871,6 +872,332 @@ class TestConvoySuite(unittest.TestCase):
                 ), True
             )
 
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.spawn')
+    def test_run_catch_up(self, mock_spawn, mock_raise, mock_request):
+        processed_id, outstanding_id = uuid4().hex, uuid4().hex
+        config = deepcopy(self.config)
+        config['feed'] = {'catch_up': True}
+        convoy = Convoy(config)
+        convoy.auctions_mapping.put(processed_id, True)
+        convoy.db.info = mock.MagicMock(return_value={'update_seq': 42})
+        convoy.db.iterview = mock.MagicMock(side_effect=lambda *args, **kwargs: [
+            Munch(id=auction_id, doc={'_id': auction_id,
+                                      'status': 'complete',
+                                      'merchandisingObject': uuid4().hex,
+                                      'procurementMethodType': 'sellout.english'})
+            for auction_id in (processed_id, outstanding_id)
+        ] if kwargs['startkey'] == ['sellout.english', 'complete'] else [])
+        convoy.process_auction = mock.MagicMock()
+        mock_feed = mock.MagicMock(return_value=[])
+        convoy.changes_feed = mock_feed
+
+        convoy.run()
+
+        self.assertEqual(convoy.process_auction.call_count, 1)
+        self.assertEqual(convoy.process_auction.call_args[0][0].id, outstanding_id)
+        # live feed is tailed from the sequence catch up started at
+        mock_feed.assert_called_once_with(42)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.spawn')
+    def test_run_priority_scheduling(self, mock_spawn, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['scheduling'] = {'priority': True}
+        convoy = Convoy(config)
+        auctions = [
+            Munch(id='complete', status='complete'),
+            Munch(id='late', status='pending.verification',
+                  auctionPeriod={'startDate': '2018-02-01T00:00:00+02:00'}),
+            Munch(id='unsuccessful', status='unsuccessful'),
+            Munch(id='soon', status='pending.verification',
+                  tenderPeriod={'startDate': '2018-01-01T00:00:00+02:00'}),
+        ]
+        convoy.changes_feed = mock.MagicMock(return_value=auctions)
+        convoy.process_auction = mock.MagicMock()
+
+        convoy.run()
+
+        self.assertEqual([call[0][0].id for call in convoy.process_auction.call_args_list],
+                         ['soon', 'late', 'complete', 'unsuccessful'])
+        self.assertIn('heartbeat', convoy.feed_state)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.spawn')
+    def test_run_pipelines(self, mock_spawn, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['scheduling'] = {'pipelines': {'loki': {'concurrency': 2, 'weight': 2,
+                                                       'types': {'sellout.english': 1}}}}
+        convoy = Convoy(config)
+        scheduler = convoy.fair_scheduler(config['scheduling'])
+        self.assertEqual(sorted(scheduler.pipelines), ['basic', 'loki'])
+        self.assertEqual(scheduler.concurrency, 3)
+        loki = scheduler.pipelines['loki']
+        self.assertEqual((loki.concurrency, loki.weight, loki.budgets), (2, 2, {'sellout.english': 1}))
+        self.assertEqual(scheduler.pipeline_of(Munch(procurementMethodType='rubble')), 'basic')
+
+        auctions = [
+            Munch(id='english', status='complete', procurementMethodType='sellout.english'),
+            Munch(id='rubble', status='complete', procurementMethodType='rubble'),
+            Munch(id='unknown', status='complete', procurementMethodType='unknown'),
+        ]
+        convoy.changes_feed = mock.MagicMock(return_value=auctions)
+        convoy.process_auction = mock.MagicMock()
+
+        convoy.run()
+
+        self.assertEqual(sorted(call[0][0].id for call in convoy.process_auction.call_args_list),
+                         ['english', 'rubble', 'unknown'])
+        self.assertFalse(convoy.running)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.spawn')
+    def test_run_prefetch(self, mock_spawn, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['prefetch'] = None
+        convoy = Convoy(config)
+        self.addCleanup(unregister_cache, 'prefetch')
+        self.assertIs(convoy.lots_client._prefetcher, convoy.prefetcher)
+        self.assertIn('prefetch', CACHES)
+        auctions = [Munch(id='1', status='pending.verification', merchandisingObject='lot1')]
+        convoy.changes_feed = mock.MagicMock(return_value=auctions)
+        convoy.process_auction = mock.MagicMock()
+        convoy.prefetcher.prefetch_lot = mock.MagicMock()
+
+        convoy.run()
+
+        convoy.prefetcher.prefetch_lot.assert_called_once_with('lot1')
+        self.assertEqual(convoy.process_auction.call_args[0][0].id, '1')
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.fetch_docs_by_ids')
+    def test_process_auctions_batch(self, mock_fetch, mock_raise, mock_request):
+        db_id, api_id, missing_id, failed_id = [uuid4().hex for _ in range(4)]
+        mock_fetch.return_value = {
+            db_id: {'_id': db_id, 'id': db_id, 'status': 'complete'},
+            failed_id: {'_id': failed_id, 'id': failed_id, 'status': 'unsuccessful'},
+        }
+        convoy = Convoy(self.config)
+        convoy.auctions_client = mock.MagicMock()
+        convoy.auctions_client.get_auction.side_effect = lambda auction_id: (
+            munchify({'data': {'id': api_id, 'status': 'complete'}})
+            if auction_id == api_id else self._raise(ResourceNotFound())
+        )
+        convoy.process_auction = mock.MagicMock(side_effect=lambda auction: (
+            self._raise(ValueError('boom')) if auction['id'] == failed_id else None
+        ))
+
+        outcomes = convoy.process_auctions_batch(
+            [db_id, api_id, missing_id, failed_id], concurrency=2
+        )
+
+        mock_fetch.assert_called_once_with(convoy.db, [db_id, api_id, missing_id, failed_id])
+        self.assertEqual(outcomes, {
+            db_id: 'processed',
+            api_id: 'processed',
+            missing_id: 'not found',
+            failed_id: "failed: ValueError('boom',)"
+        })
+        self.assertEqual(convoy.auctions_client.get_auction.call_count, 2)
+        self.assertEqual(convoy.process_auction.call_count, 3)
+
+        # database failure falls back to API for every auction
+        mock_fetch.side_effect = Exception('db is down')
+        convoy.process_auction.reset_mock()
+        outcomes = convoy.process_auctions_batch([db_id, api_id])
+        self.assertEqual(outcomes, {db_id: 'not found', api_id: 'processed'})
+        self.assertEqual(convoy.process_auction.call_count, 1)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.fetch_docs_by_ids')
+    def test_lot_lock_timeout(self, mock_fetch, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['lots_locker'] = {'postpone': 0}
+        convoy = Convoy(config)
+        locked = set()
+
+        def process_auction(auction):
+            if auction['id'] not in locked:  # locked by other node on first attempt
+                locked.add(auction['id'])
+                raise LotLockTimeout(auction['merchandisingObject'])
+        convoy.process_auction = mock.MagicMock(side_effect=process_auction)
+
+        # feed auction is processed again later
+        convoy._process_feed_auction(Munch(id='feed', merchandisingObject='lot'))
+        self.assertEqual(len(convoy.postponed), 1)
+        convoy.postponed.join()
+        self.assertEqual(convoy.process_auction.call_count, 2)
+        self.assertEqual(len(convoy.postponed), 0)
+
+        # batch retries auctions with locked lots once
+        mock_fetch.return_value = {'batch': {'id': 'batch', 'merchandisingObject': 'lot'}}
+        self.assertEqual(convoy.process_auctions_batch(['batch']), {'batch': 'processed'})
+        self.assertEqual(convoy.process_auction.call_count, 4)
+        convoy.process_auction.side_effect = LotLockTimeout('lot')
+        self.assertEqual(convoy.process_auctions_batch(['batch']), {'batch': LOT_LOCKED})
+        self.assertEqual(convoy.process_auction.call_count, 6)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.STAGE_METRICS')
+    def test_process_auction_reports_e2e(self, mock_metrics, mock_raise, mock_request):
+        convoy = Convoy(self.config)
+        auction = Munch(id=uuid4().hex, status='complete', merchandisingObject=uuid4().hex,
+                        procurementMethodType='sellout.english', dateModified='2018-01-01T00:00:00Z')
+        loki_processing = convoy.auction_type_processing_configurator['sellout.english']
+        loki_processing.report_results = mock.MagicMock(return_value=True)
+        loki_processing.lots_locker = mock.MagicMock()
+
+        convoy.process_auction(auction)
+        mock_metrics.report_e2e.assert_called_once_with(auction, 'loki')
+
+        # auction, which is in mapping already, e.g. replayed from the start of feed
+        loki_processing.auctions_mapping = mock.MagicMock()
+        loki_processing.auctions_mapping.has.return_value = True
+        convoy.process_auction(auction)
+        self.assertEqual(loki_processing.report_results.call_count, 1)
+        self.assertEqual(mock_metrics.report_e2e.call_count, 1)
+
+        # processor, which had nothing to do
+        loki_processing.auctions_mapping.has.return_value = False
+        loki_processing.report_results.return_value = False
+        convoy.process_auction(auction)
+        self.assertEqual(loki_processing.report_results.call_count, 2)
+        self.assertEqual(mock_metrics.report_e2e.call_count, 1)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    def test_lot_lock_lost(self, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['lots_locker'] = {'postpone': 0}
+        convoy = Convoy(config)
+        auction = Munch(id=uuid4().hex, status='complete', merchandisingObject=uuid4().hex,
+                        procurementMethodType='rubble')
+
+        # processor does not swallow lock, which expired in the middle of processing
+        basic_processing = convoy.auction_type_processing_configurator['rubble']
+        basic_processing.lots_locker = mock.MagicMock()
+        basic_processing.report_results = mock.MagicMock(side_effect=LotLockLost(auction.merchandisingObject))
+        with self.assertRaises(LotLockLost):
+            basic_processing.process_auction(auction)
+
+        # feed auction is processed again later
+        convoy.process_auction = mock.MagicMock(side_effect=[LotLockLost('lot'), None])
+        convoy._process_feed_auction(auction)
+        self.assertEqual(len(convoy.postponed), 1)
+        convoy.postponed.join()
+        self.assertEqual(convoy.process_auction.call_count, 2)
+
+        convoy.process_auction = mock.MagicMock(side_effect=LotLockLost('lot'))
+        convoy.auctions_client = mock.MagicMock()
+        convoy.process_single_auction(auction.id)
+        self.assertEqual(convoy.process_auction.call_count, 1)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.spawn')
+    def test_run_replay(self, mock_spawn, mock_raise, mock_request):
+        auction_ids = [uuid4().hex for _ in range(3)]
+        path = os.path.join(self.test_files_path, 'changes.jsonl.tmp')
+        with open(path, 'w') as records_file:
+            for seq, auction_id in enumerate(auction_ids, 1):
+                records_file.write(json.dumps({'seq': seq, 'doc': {'id': auction_id}}) + '\n')
+        self.addCleanup(os.remove, path)
+        config = deepcopy(self.config)
+        config['feed'] = {'replay': path}
+        convoy = Convoy(config)
+        convoy.db.changes = mock.MagicMock()
+        convoy.process_auction = mock.MagicMock()
+
+        convoy.run()
+
+        self.assertEqual([call[0][0]['id'] for call in convoy.process_auction.call_args_list],
+                         auction_ids)
+        self.assertEqual(convoy.feed_state['last_seq'], 3)
+        self.assertEqual(convoy.db.changes.call_count, 0)
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    def test_backfill(self, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['backfill'] = {'chunks': 2, 'concurrency': 2}
+        convoy = Convoy(config)
+        since = choice(range(1000, 100000, 1000))
+        until = since + 10
+        changes = [{'seq': since + seq, 'id': uuid4().hex} for seq in (1, 4, 6, 9, 11)]
+        for row in changes:
+            row['doc'] = {'_id': row['id'], 'id': row['id'], 'status': 'complete'}
+
+        def get_changes(since, limit, **kwargs):
+            results = [row for row in changes if row['seq'] > int(since)][:limit]
+            return {'results': results,
+                    'last_seq': results[-1]['seq'] if results else since}
+        convoy.db.changes = mock.MagicMock(side_effect=get_changes)
+        convoy.process_auction = mock.MagicMock(side_effect=lambda auction: (
+            self._raise(ValueError('boom')) if auction['id'] == changes[2]['id'] else None
+        ))
+
+        stats = convoy.backfill(since, until)
+
+        self.assertEqual(stats['processed'], 3)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['chunks'], 2)
+        self.assertEqual(sorted(call[0][0]['id'] for call in convoy.process_auction.call_args_list),
+                         sorted(row['id'] for row in changes[:4]))
+        for start in (since, since + 5):
+            checkpoint = 'backfill:{}:{}:{}'.format(since, until, start)
+            self.assertEqual(convoy.auctions_mapping.get(checkpoint), 'done')
+
+        # finished chunks are not read again
+        convoy.process_auction.reset_mock()
+        convoy.db.changes.reset_mock()
+        stats = convoy.backfill(since, until)
+        self.assertEqual(stats['processed'], 0)
+        self.assertEqual(convoy.db.changes.call_count, 0)
+
+        # interrupted chunk is resumed from saved sequence
+        checkpoint = 'backfill:{}:{}:{}'.format(since, until, since)
+        convoy.auctions_mapping.put(checkpoint, str(since + 1))
+        stats = convoy.backfill(since, until)
+        self.assertEqual(stats['processed'], 1)
+        self.assertEqual(convoy.process_auction.call_args[0][0]['id'], changes[1]['id'])
+        for start in (since, since + 5):
+            convoy.auctions_mapping.delete('backfill:{}:{}:{}'.format(since, until, start))
+
+    @mock.patch('requests.Response.raise_for_status')
+    @mock.patch('requests.Session.request')
+    def test_backfill_opaque_sequences(self, mock_raise, mock_request):
+        config = deepcopy(self.config)
+        config['backfill'] = {'chunks': 4}
+        convoy = Convoy(config)
+        since, until = '5-g1AAAAA{}'.format(uuid4().hex), '7-g1AAAAB{}'.format(uuid4().hex)
+        changes = [{'seq': seq, 'id': uuid4().hex} for seq in ('6-g1AAAAC', until, '8-g1AAAAD')]
+        for row in changes:
+            row['doc'] = {'_id': row['id'], 'id': row['id'], 'status': 'complete'}
+        convoy.db.changes = mock.MagicMock(return_value={'results': changes, 'last_seq': changes[-1]['seq']})
+        convoy.process_auction = mock.MagicMock()
+
+        stats = convoy.backfill(since, until)
+
+        # CouchDB 2.x sequence is passed as given, range is not split
+        self.assertEqual(stats['chunks'], 1)
+        self.assertEqual(convoy.db.changes.call_args[1]['since'], since)
+        self.assertEqual([call[0][0]['id'] for call in convoy.process_auction.call_args_list],
+                         [row['id'] for row in changes[:2]])
+        checkpoint = 'backfill:{}:{}:{}'.format(since, until, since)
+        self.assertEqual(convoy.auctions_mapping.get(checkpoint), 'done')
+        convoy.auctions_mapping.delete(checkpoint)
+
+    @staticmethod
+    def _raise(exc):
+        raise exc
+
     @mock.patch('logging.config')
     @mock.patch('requests.Session.request')
     @mock.patch('openregistry.convoy.convoy.argparse.ArgumentParser',
@@ -884,6 +1211,30 @@ class TestConvoySuite(unittest.TestCase):
         mock_convoy.assert_called_once_with(config_dict)
         self.assertEqual(mock_convoy().run.call_count, 1)
 
+    @mock.patch('logging.config')
+    @mock.patch('requests.Session.request')
+    @mock.patch('openregistry.convoy.convoy.argparse.ArgumentParser')
+    @mock.patch('openregistry.convoy.convoy.Convoy')
+    def test__main_ids_file(self, mock_convoy, mock_parser, mock_request, logging_config):
+        ids_file = os.path.join(self.test_files_path, 'auction_ids.tmp')
+        with open(ids_file, 'w') as ids_file_obj:
+            ids_file_obj.write('# reprocess after incident\nid1\n\nid2\nid1\n')
+        self.addCleanup(os.remove, ids_file)
+        mock_parser().parse_args.return_value = munchify({
+            'config': '{}/{}'.format(ROOT, '/convoy.yaml'),
+            'check': False,
+            'auction_id': None,
+            'ids_file': ids_file,
+            'since': None,
+            'until': None,
+            'replay': None,
+            'catch_up': False,
+            'profile': None
+        })
+        convoy_main()
+        mock_convoy().process_auctions_batch.assert_called_once_with(['id1', 'id2'])
+        self.assertEqual(mock_convoy().run.call_count, 0)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import unittest
+from time import time
+
+import mock
+from webtest import TestApp
+
+from openregistry.convoy.introspection import Introspection, register_cache, unregister_cache
+from openregistry.convoy.metrics import STAGE_METRICS, HubBlockMonitor
+
+
+class TestIntrospectionSuite(unittest.TestCase):
+    """ TestCase of introspection endpoint """
+
+    def test_introspection(self):
+        convoy = mock.MagicMock()
+        convoy.feed_state = {'last_seq': '40-g1AAAA', 'heartbeat': time()}
+        convoy.db.info.return_value = {'update_seq': '100-g1AAAA'}
+        convoy.documents_transfer_queue.qsize.return_value = 3
+        convoy.killer.kill_now = False
+        convoy.running = True
+        convoy.hub_monitor = HubBlockMonitor()
+        convoy.hub_monitor.blocks = 2
+        app = TestApp(Introspection(convoy, stall_timeout=60))
+        self.addCleanup(STAGE_METRICS.in_flight.pop, ('get_lot', 'lots'), None)
+        STAGE_METRICS.in_flight[('get_lot', 'lots')] = 2
+        register_cache('lots', lambda: {'hits': 5, 'misses': 1})
+        self.addCleanup(unregister_cache, 'lots')
+
+        status = app.get('/status').json
+        self.assertTrue(status['live'])
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['feed']['last_seq'], '40-g1AAAA')
+        self.assertEqual(status['feed']['lag'], 60)
+        self.assertEqual(status['documents_transfer_queue'], 3)
+        self.assertIn({'operation': 'get_lot', 'resource': 'lots', 'count': 2}, status['in_flight'])
+        self.assertEqual(status['caches'], {'lots': {'hits': 5, 'misses': 1}})
+        convoy.auctions_mapping.has.assert_called_once_with('introspection_probe')
+        self.assertGreaterEqual(status['mapping_latency'], 0)
+
+        metrics = app.get('/metrics')
+        self.assertTrue(metrics.content_type.startswith('text/plain'))
+        self.assertIn('convoy_feed_lag_changes 60.0', metrics.text)
+        self.assertIn('convoy_feed_seq 40.0', metrics.text)
+        self.assertIn('convoy_stage_in_flight{operation="get_lot",resource="lots"} 2.0', metrics.text)
+        self.assertIn('convoy_cache_hits{cache="lots"} 5.0', metrics.text)
+        self.assertIn('convoy_hub_blocks_total 2.0', metrics.text)
+
+        self.assertEqual(app.get('/healthz').text, 'ok\n')
+        self.assertEqual(app.get('/readyz').text, 'ok\n')
+        convoy.killer.kill_now = True
+        app.get('/readyz', status=503)
+        convoy.feed_state['heartbeat'] = time() - 120
+        app.get('/healthz', status=503)
+        app.get('/unknown', status=404)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestIntrospectionSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
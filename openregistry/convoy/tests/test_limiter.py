@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+from gevent import sleep, spawn
+from munch import munchify
+
+from openprocurement_client.exceptions import Conflict, ResourceNotFound
+
+from openregistry.convoy.limiter import (
+    LIMITERS,
+    AdaptiveLimiter,
+    LimitedClient,
+    limit_clients,
+    processing_limiter,
+)
+
+
+class TestLimiterSuite(unittest.TestCase):
+    """ TestCase of adaptive concurrency limits """
+
+    @mock.patch('openregistry.convoy.limiter.time')
+    @mock.patch('openregistry.convoy.limiter.METRICS_LOGGER')
+    def test_adaptive_limiter(self, mock_logger, mock_time):
+        clock = [100]
+        mock_time.side_effect = lambda: clock[0]
+        limiter = AdaptiveLimiter('lots', initial=2, maximum=4)
+        limiter.acquire()
+        limiter.acquire()
+        waiter = spawn(limiter.acquire)
+        sleep(0)
+        self.assertEqual((limiter.in_flight, limiter.waiting), (2, 1))
+
+        # limit is used up and latency is flat, so it grows and waiter gets a slot
+        for _ in range(3):
+            limiter.sample(0.1)
+        self.assertEqual(int(limiter.limit), 3)
+        sleep(0)
+        self.assertTrue(waiter.dead)
+        self.assertEqual((limiter.in_flight, limiter.waiting), (3, 0))
+        self.assertEqual(mock_logger.info.call_args[1]['extra'],
+                         {'MESSAGE_ID': 'concurrency_limit.lots', 'CONCURRENCY_LIMIT': 3})
+
+        # rising latency, decreased once per smoothed latency
+        limiter.sample(0.5)
+        limiter.sample(1.0)
+        limiter.sample(1.0)
+        self.assertEqual((int(limiter.limit), limiter.decreases), (2, 1))
+        self.assertLess(limiter.baseline, 0.15)  # follows higher latency slowly
+        for _ in range(3):
+            limiter.release()
+
+        # retried errors back off, others do not
+        clock[0] += 1
+        with self.assertRaises(Conflict):
+            with limiter.limited():
+                raise Conflict(munchify({'status_code': 429}))
+        self.assertEqual(limiter.decreases, 2)
+        clock[0] += 1
+        with self.assertRaises(ResourceNotFound):
+            with limiter.limited():
+                raise ResourceNotFound(munchify({'status_code': 404}))
+        self.assertEqual((limiter.decreases, limiter.in_flight), (2, 0))
+        for _ in range(10):
+            clock[0] += 1
+            limiter.decrease()
+        self.assertEqual(limiter.limit, 1)
+
+    def test_limited_client(self):
+        self.addCleanup(LIMITERS.clear)
+        client = mock.MagicMock()
+        client.host_url = 'http://localhost'
+        lots, ds = AdaptiveLimiter('lots'), AdaptiveLimiter('ds')
+        limited = LimitedClient(client, lots, ds)
+        self.assertEqual(limited.get_lot('id'), client.get_lot.return_value)
+        self.assertEqual(limited.host_url, 'http://localhost')
+        self.assertIsNotNone(lots.latency)
+        self.assertIsNone(ds.latency)
+        limited.ds_client.document_upload_not_register('file', {})
+        client.ds_client.document_upload_not_register.assert_called_once_with('file', {})
+        self.assertIsNotNone(ds.latency)
+
+        db = object()
+        clients = limit_clients({'lots_client': client, 'db': db}, {'initial': 4})
+        self.assertIs(clients['db'], db)
+        self.assertIsInstance(clients['lots_client'], LimitedClient)
+        self.assertEqual(sorted(LIMITERS), ['ds', 'lots'])
+        self.assertEqual(LIMITERS['lots'].limit, 4)
+
+    def test_processing_limiter(self):
+        self.addCleanup(LIMITERS.clear)
+        config = {'initial': 4, 'maximum': 16, 'processing': {'maximum': 8, 'tolerance': 4.0}}
+        limiter = processing_limiter(config)
+        self.assertIs(LIMITERS['processing'], limiter)
+        self.assertEqual((limiter.limit, limiter.maximum, limiter.tolerance), (4, 8, 4.0))
+        # processing overrides are not passed to limiters of clients
+        limit_clients({'lots_client': mock.MagicMock()}, config)
+        self.assertEqual((LIMITERS['lots'].maximum, LIMITERS['lots'].tolerance), (16, 2.0))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestLimiterSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import unittest
+
+from openregistry.convoy.logqueue import (
+    AF_INET,
+    SOCK_DGRAM,
+    AggregatingStatsdHandler,
+    LogQueue,
+    QueueHandler,
+    install_log_queue,
+    native_socket,
+)
+
+ROOT = '/'.join(os.path.dirname(__file__).split('/')[:-3])
+
+
+class TestLogQueueSuite(unittest.TestCase):
+    """ TestCase of queued logging """
+
+    def test_log_queue(self):
+        records = []
+        handler = logging.Handler(logging.INFO)
+        handler.emit = records.append
+        logger = logging.getLogger('openregistry.convoy.tests.queue')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.handlers = [handler]
+        self.addCleanup(setattr, logger, 'handlers', [])
+
+        queue = LogQueue(size=2)
+        logger.handlers = [QueueHandler(queue, [handler])]
+        self.assertEqual(logger.handlers[0].level, logging.INFO)
+        logger.debug('filtered %s', 'out')
+        for number in range(4):
+            logger.info('Record %s', number)
+        self.assertEqual(records, [])
+        self.assertEqual(queue.dropped, 2)
+
+        self.assertEqual(queue.drain(), 2)
+        self.assertEqual([record.getMessage() for record in records],
+                         ['Record 0', 'Record 1', 'Dropped 2 log records, log queue is full'])
+        self.assertEqual(records[-1].MESSAGE_ID, 'log_records_dropped')
+        queue.drain()
+        self.assertEqual(len(records), 3)
+
+        # records are handled by background thread
+        del records[:]
+        logger.handlers = [handler]
+        queue = install_log_queue(loggers=[logger.name], size=100, interval=0.01)
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+        self.assertEqual(logger.handlers[0].handlers, [handler])
+        logger.info('Record %s', 'from thread')
+        logger.handlers[0].close()
+        self.assertEqual([record.getMessage() for record in records], ['Record from thread'])
+        self.assertFalse(queue._running)
+
+        receiver = native_socket(AF_INET, SOCK_DGRAM)
+        self.addCleanup(receiver.close)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        handler = AggregatingStatsdHandler(os.path.join(ROOT, 'statsdconfig.yaml'), flush_interval=60)
+        handler.address = receiver.getsockname()
+        logger.handlers = [handler]
+        for _ in range(3):
+            logger.info('Processed', extra={'MESSAGE_ID': 'auction_processed'})
+        logger.info('Feed lag', extra={'MESSAGE_ID': 'feed_lag', 'FEED_LAG_CHANGES': 5})
+        logger.info('Stage', extra={'MESSAGE_ID': 'get_lot.lots.ok', 'STAGE_DURATION': 12.5})
+        handler.close()
+        lines = receiver.recv(handler.packet_size).split('\n')
+        prefix = 'app_key.{}.'.format(logger.name)
+        self.assertItemsEqual(lines, [
+            prefix + 'MESSAGE_ID.auction_processed:3|c',
+            prefix + 'MESSAGE_ID.feed_lag:1|c',
+            prefix + 'MESSAGE_ID.get_lot.lots.ok:1|c',
+            prefix + 'FEED_LAG_CHANGES.feed_lag:5|g',
+            prefix + 'STAGE_DURATION.get_lot.lots.ok:12.5|ms',
+        ])
+        handler.packet_size = 50
+        self.assertEqual(list(handler.packets(['a' * 30, 'b' * 30, 'c'])), ['a' * 30, 'b' * 30 + '\nc'])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestLogQueueSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+import mock
+from gevent.events import EventLoopBlocked, notify, subscribers as gevent_subscribers
+from munch import Munch, munchify
+
+from openprocurement_client.exceptions import ResourceNotFound
+
+from openregistry.convoy.metrics import (
+    METRICS_LOGGER,
+    STAGE_METRICS,
+    FeedLagMonitor,
+    HubBlockMonitor,
+    InstrumentedClient,
+    instrument_clients,
+    stage,
+    statsd_enabled,
+)
+from openregistry.convoy.utils import LOGGER
+
+
+class TestMetricsSuite(unittest.TestCase):
+    """ TestCase of stage metrics and monitors """
+
+    @mock.patch('openregistry.convoy.metrics.METRICS_LOGGER')
+    def test_stage_metrics(self, mock_logger):
+        self.addCleanup(setattr, STAGE_METRICS, 'enabled', False)
+        self.addCleanup(setattr, STAGE_METRICS, 'publish', STAGE_METRICS.publish)
+        STAGE_METRICS.publish = True
+
+        @stage('prepare_auction', 'basic')
+        def prepare_auction(fail=False):
+            if fail:
+                raise ResourceNotFound(munchify({'status_code': 404}))
+            return 'prepared'
+
+        # nothing is measured while disabled
+        STAGE_METRICS.enabled = False
+        self.assertEqual(prepare_auction(), 'prepared')
+        self.assertEqual(mock_logger.info.call_count, 0)
+
+        STAGE_METRICS.enabled = True
+        self.assertEqual(prepare_auction(), 'prepared')
+        with self.assertRaises(ResourceNotFound):
+            prepare_auction(fail=True)
+        metrics = [call[1]['extra']['MESSAGE_ID'] for call in mock_logger.info.call_args_list]
+        self.assertEqual(metrics, ['prepare_auction.basic.ok', 'prepare_auction.basic.404'])
+        for call in mock_logger.info.call_args_list:
+            self.assertGreaterEqual(call[1]['extra']['STAGE_DURATION'], 0)
+
+        mock_logger.reset_mock()
+        client = mock.MagicMock()
+        client.get_lot.return_value = 'lot'
+        clients = instrument_clients({'lots_client': client, 'db': 'db'})
+        self.assertEqual(clients['db'], 'db')
+        self.assertIsInstance(clients['lots_client'], InstrumentedClient)
+        self.assertEqual(clients['lots_client'].get_lot('id'), 'lot')
+        client.get_lot.assert_called_once_with('id')
+        clients['lots_client'].ds_client.register_document_upload('hash')
+        metrics = [call[1]['extra']['MESSAGE_ID'] for call in mock_logger.info.call_args_list]
+        self.assertEqual(metrics, ['get_lot.lots.ok', 'register_document_upload.ds.ok'])
+
+        # calls are counted but not sent to statsd without publishing
+        mock_logger.reset_mock()
+        STAGE_METRICS.publish = False
+        calls = STAGE_METRICS.calls.get('prepare_auction.basic.ok', 0)
+        prepare_auction()
+        self.assertEqual(mock_logger.info.call_count, 0)
+        self.assertEqual(STAGE_METRICS.calls['prepare_auction.basic.ok'], calls + 1)
+        self.assertEqual(STAGE_METRICS.in_flight[('prepare_auction', 'basic')], 0)
+
+    def test_stage_metrics_level(self):
+        self.addCleanup(setattr, STAGE_METRICS, 'publish', STAGE_METRICS.publish)
+        STAGE_METRICS.publish = True
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        METRICS_LOGGER.addHandler(handler)
+        self.addCleanup(METRICS_LOGGER.removeHandler, handler)
+        self.addCleanup(LOGGER.setLevel, LOGGER.level)
+
+        # console shows only warnings, statsd still gets durations
+        LOGGER.setLevel(logging.WARNING)
+        STAGE_METRICS.report('get_lot', 'lots', 'ok', 0.25)
+        self.assertEqual([(record.MESSAGE_ID, record.STAGE_DURATION) for record in records],
+                         [('get_lot.lots.ok', 250)])
+
+    @mock.patch('openregistry.convoy.metrics.time')
+    @mock.patch('openregistry.convoy.metrics.METRICS_LOGGER')
+    @mock.patch('openregistry.convoy.metrics.LOGGER')
+    def test_feed_lag_and_e2e(self, mock_logger, mock_metrics_logger, mock_time):
+        db = mock.MagicMock()
+        feed_state = {'last_seq': 0}
+        mock_time.return_value = 1000
+        monitor = FeedLagMonitor(db, feed_state)
+
+        db.info.return_value = {'update_seq': 100}
+        self.assertEqual(monitor.sample(), (100, 0))
+
+        # 40 changes processed in 10 seconds, 60 left
+        mock_time.return_value = 1010
+        feed_state['last_seq'] = '40-g1AAAA'
+        self.assertEqual(monitor.sample(), (60, 15))
+        self.assertEqual(mock_metrics_logger.info.call_args[1]['extra'],
+                         {'MESSAGE_ID': 'feed_lag', 'FEED_LAG_CHANGES': 60, 'FEED_LAG_SECONDS': 15})
+
+        # no progress, lag is time since last progress
+        mock_time.return_value = 1040
+        self.assertEqual(monitor.sample(), (60, 30))
+
+        feed_state['last_seq'] = 100
+        mock_time.return_value = 1050
+        self.assertEqual(monitor.sample(), (0, 0))
+        self.assertEqual(mock_metrics_logger.info.call_count, 4)
+        self.assertEqual(mock_logger.info.call_count, 0)
+        mock_metrics_logger.reset_mock()
+
+        # end to end latency
+        self.addCleanup(setattr, STAGE_METRICS, 'enabled', False)
+        self.addCleanup(setattr, STAGE_METRICS, 'publish', STAGE_METRICS.publish)
+        STAGE_METRICS.publish = True
+        auction = Munch(status='complete', dateModified='1970-01-01T00:10:00+00:00')
+        STAGE_METRICS.report_e2e(auction, 'loki')
+        self.assertEqual(mock_metrics_logger.info.call_count, 0)
+        STAGE_METRICS.enabled = True
+        STAGE_METRICS.report_e2e(auction, 'loki')
+        STAGE_METRICS.report_e2e(Munch(status='complete'), 'loki')
+        self.assertEqual(mock_metrics_logger.info.call_count, 1)
+        self.assertEqual(mock_metrics_logger.info.call_args[1]['extra'],
+                         {'MESSAGE_ID': 'auction_e2e.loki.complete', 'E2E_LATENCY': 450000})
+
+    @mock.patch('openregistry.convoy.metrics.get_hub')
+    @mock.patch('openregistry.convoy.metrics.time')
+    @mock.patch('openregistry.convoy.metrics.LOGGER')
+    def test_hub_block_monitor(self, mock_logger, mock_time, mock_get_hub):
+        monitor = HubBlockMonitor(threshold=0.1)
+        self.assertTrue(monitor.start())
+        self.addCleanup(monitor.stop)
+        mock_get_hub().start_periodic_monitoring_thread.assert_called_once_with()
+        self.assertIn(monitor.notify, gevent_subscribers)
+
+        blocking, other = object(), object()
+        mock_time.return_value = 100.0
+        for detected_at in (100.0, 100.1, 100.2):  # one block detected three times
+            mock_time.return_value = detected_at
+            notify(EventLoopBlocked(blocking, 0.1, ['File "utils.py", line 1, in put']))
+        mock_time.return_value = 101.0
+        notify(EventLoopBlocked(other, 0.1, ['File "codec.py", line 1, in loads']))
+        notify(object())
+        self.assertEqual(monitor.report(), 1)
+        self.assertAlmostEqual(mock_logger.warning.call_args[1]['extra']['HUB_BLOCKED'], 300)
+        self.assertIn('utils.py', mock_logger.warning.call_args[0][0])
+
+        # last block is reported when it is not continued
+        self.assertEqual(monitor.report(), 0)
+        mock_time.return_value = 102.0
+        self.assertEqual(monitor.report(), 1)
+        self.assertEqual(mock_logger.warning.call_args[1]['extra'],
+                         {'MESSAGE_ID': 'hub_blocked', 'HUB_BLOCKED': 100})
+        self.assertEqual(monitor.blocks, 2)
+        self.assertAlmostEqual(monitor.blocked_time, 0.4)
+
+        monitor.stop()
+        self.assertNotIn(monitor.notify, gevent_subscribers)
+
+    def test_statsd_enabled(self):
+        logger = logging.getLogger('openregistry.convoy.tests.statsd')
+        self.assertFalse(statsd_enabled(logger))
+        StatsdHandler = type('StatsdHandler', (logging.NullHandler,), {})
+        handler = StatsdHandler()
+        logger.parent.addHandler(handler)
+        self.addCleanup(logger.parent.removeHandler, handler)
+        self.assertTrue(statsd_enabled(logger))
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+        self.assertFalse(statsd_enabled(logger))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMetricsSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+from munch import Munch, munchify
+
+from openregistry.convoy.prefetch import PrefetchedClient, prefetch_clients
+
+
+class TestPrefetchSuite(unittest.TestCase):
+    """ TestCase of lots and assets prefetch """
+
+    @mock.patch('openregistry.convoy.prefetch.METRICS_LOGGER')
+    @mock.patch('openregistry.convoy.prefetch.time')
+    def test_prefetcher(self, mock_time, mock_logger):
+        mock_time.return_value = 1000
+        lots_client, assets_client = mock.MagicMock(), mock.MagicMock()
+        lots = {'lot1': munchify({'data': {'id': 'lot1', 'status': 'active.salable',
+                                           'assets': ['asset1', 'asset2']}})}
+        lots_client.get_lot.side_effect = lambda lot_id: lots[lot_id]
+        assets_client.get_asset.side_effect = lambda asset_id: munchify({'data': {'id': asset_id}})
+        clients, prefetcher = prefetch_clients(
+            {'lots_client': lots_client, 'assets_client': assets_client, 'db': None}, {'ttl': 30})
+        self.assertIsInstance(clients['assets_client'], PrefetchedClient)
+        self.assertIs(clients['lots_client'], lots_client)
+        self.assertIsNone(clients['db'])
+
+        auctions = [Munch(id='1', status='pending.verification', merchandisingObject='lot1'),
+                    Munch(id='2', status='complete', merchandisingObject='lot2'),
+                    Munch(id='3', status='pending.verification', merchandisingObject='missing')]
+        self.assertEqual(list(prefetcher.watch(auctions)), auctions)
+        prefetcher.pool.join()
+        self.assertEqual(lots_client.get_lot.call_count, 2)
+        self.assertEqual(assets_client.get_asset.call_count, 2)
+        self.assertEqual(prefetcher.reading, set())
+
+        # lot changed after prefetch, processor reads it again once it is locked
+        lots['lot1'] = munchify({'data': {'id': 'lot1', 'status': 'active.awaiting',
+                                          'assets': ['asset1', 'asset2']}})
+        self.assertEqual(clients['lots_client'].get_lot('lot1').data.status, 'active.awaiting')
+        self.assertEqual(lots_client.get_lot.call_count, 3)
+
+        # prefetched assets are used once
+        self.assertEqual(clients['assets_client'].get_asset('asset2').data.id, 'asset2')
+        self.assertEqual(assets_client.get_asset.call_count, 2)
+        clients['assets_client'].get_asset('asset2')
+        self.assertEqual(assets_client.get_asset.call_count, 3)
+        self.assertEqual(clients['assets_client'].patch_resource_item, assets_client.patch_resource_item)
+
+        # documents not taken within ttl are wasted
+        mock_time.return_value = 1030
+        clients['assets_client'].get_asset('asset1')
+        self.assertEqual(assets_client.get_asset.call_count, 4)
+        stats = prefetcher.stats()
+        self.assertEqual(dict((key, stats[key]) for key in ('size', 'prefetched', 'hits', 'misses', 'wasted')),
+                         {'size': 0, 'prefetched': 2, 'hits': 1, 'misses': 2, 'wasted': 1})
+        self.assertEqual((stats['hit_rate'], stats['waste_rate']), (1 / 3.0, 0.5))
+
+        # oldest documents are evicted when cache is full
+        prefetcher.max_size = 1
+        prefetcher.prefetch_assets('lot1')
+        prefetcher.pool.join()
+        self.assertEqual(lots_client.get_lot.call_count, 4)
+        self.assertEqual(assets_client.get_asset.call_count, 6)
+        self.assertEqual(prefetcher.wasted, 2)
+        self.assertEqual(list(prefetcher.entries), [('asset', 'asset2')])
+        mock_logger.info.assert_any_call('Prefetch %s', 'waste', extra={'MESSAGE_ID': 'prefetch.waste'})
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPrefetchSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os
+import pstats
+import signal
+import tempfile
+import unittest
+from time import clock
+from uuid import uuid4
+
+import mock
+from gevent import joinall, sleep, spawn
+
+from openregistry.convoy.profiling import Profiler
+
+
+class TestProfilingSuite(unittest.TestCase):
+    """ TestCase of profiling mode """
+
+    @mock.patch('openregistry.convoy.profiling.LOGGER')
+    def test_profiler(self, mock_logger):
+        output = os.path.join(tempfile.gettempdir(), 'profile_{}'.format(uuid4().hex))
+
+        def file_bridge():
+            sum(xrange(1000))
+            sleep(0)
+
+        with self.assertRaises(ValueError):
+            Profiler(mode='unknown')
+        profiler = Profiler(output=output, auctions=2)
+        profiler.toggle()
+        self.assertTrue(profiler.active)
+        joinall([spawn(file_bridge), spawn(file_bridge)])
+        profiler.auction_processed()
+        self.assertTrue(profiler.active)
+        profiler.auction_processed()
+        self.assertFalse(profiler.active)
+        paths = mock_logger.info.call_args[0][0].split('written ')[1].split(', ')
+        for path in paths:
+            self.addCleanup(os.remove, path)
+        labels = [os.path.basename(path)[len(os.path.basename(output)):].split('.')[1] for path in paths]
+        self.assertIn('main', labels)
+        self.assertIn('file_bridge', labels)
+        self.assertIn('prof', labels)  # combined profile
+        functions = [func[2] for func in pstats.Stats(paths[labels.index('file_bridge')]).stats]
+        self.assertIn('file_bridge', functions)
+        self.assertEqual(profiler.stop(), [])
+
+        profiler = Profiler(mode='sampling', output=output, interval=0.001)
+        profiler.start()
+        started = clock()
+        while clock() - started < 0.1:
+            sum(xrange(1000))
+        paths = profiler.stop()
+        self.assertEqual(len(paths), 1)
+        self.addCleanup(os.remove, paths[0])
+        with open(paths[0]) as folded:
+            lines = folded.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertTrue(line.startswith('main;'))
+            self.assertGreater(int(line.rsplit(' ', 1)[1]), 0)
+        self.assertEqual(signal.getsignal(signal.SIGPROF), signal.SIG_DFL)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestProfilingSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
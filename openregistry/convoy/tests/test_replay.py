@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import unittest
+from StringIO import StringIO
+from uuid import uuid4
+
+import mock
+from munch import Munch
+
+from openregistry.convoy.replay import record_changes_feed, replay_changes_feed
+
+
+class TestReplaySuite(unittest.TestCase):
+    """ TestCase of recording and replaying changes feed """
+
+    def test_record_and_replay_changes_feed(self):
+        changes = [{'seq': seq, 'id': uuid4().hex} for seq in range(1, 6)]
+        for row in changes:
+            row['doc'] = {'_id': row['id'], 'id': row['id'], 'status': 'complete'}
+
+        def get_changes(since, limit, **kwargs):
+            results = [row for row in changes if row['seq'] > int(since)][:limit]
+            return {'results': results,
+                    'last_seq': results[-1]['seq'] if results else since}
+        db = mock.MagicMock()
+        db.changes.side_effect = get_changes
+        killer = mock.MagicMock(kill_now=False)
+
+        output = StringIO()
+        self.assertEqual(record_changes_feed(db, output, killer, limit=2), (5, 5))
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(records, [{'seq': row['seq'], 'doc': row['doc']} for row in changes])
+
+        output = StringIO()
+        self.assertEqual(record_changes_feed(db, output, killer, since=1, max_changes=3), (3, 4))
+        self.assertEqual(len(output.getvalue().splitlines()), 3)
+
+        path = os.path.join(os.path.dirname(__file__), 'changes.jsonl.tmp')
+        with open(path, 'w') as records_file:
+            records_file.write(output.getvalue() + '\n')
+        self.addCleanup(os.remove, path)
+        feed_state = {}
+        auctions = list(replay_changes_feed(path, killer, feed_state=feed_state))
+        self.assertEqual(auctions, [Munch(row['doc']) for row in changes[1:4]])
+        self.assertEqual(feed_state['last_seq'], 4)
+
+        killer.kill_now = True
+        self.assertEqual(len(list(replay_changes_feed(path, killer))), 1)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestReplaySuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import mock
+from gevent import Timeout, sleep, spawn_later
+from munch import Munch
+
+from openregistry.convoy.limiter import AdaptiveLimiter
+from openregistry.convoy.scheduler import FairScheduler, Pipeline, PriorityScheduler
+
+
+class TestSchedulerSuite(unittest.TestCase):
+    """ TestCase of feed auctions schedulers """
+
+    @mock.patch('openregistry.convoy.scheduler.METRICS_LOGGER')
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_priority_scheduler(self, mock_logger, mock_metrics_logger):
+        processed = []
+        killer = Munch(kill_now=False)
+
+        def process(auction):
+            processed.append((auction.id, auction.status))
+            if auction.id == 'broken':
+                raise ValueError('broken')
+
+        scheduler = PriorityScheduler(process, concurrency=1)
+        self.assertEqual(scheduler.rank(Munch(status='complete')), (1, float('inf')))
+        self.assertEqual(scheduler.rank(Munch(status='pending.verification', auctionPeriod={
+            'startDate': '2018-01-01T00:00:00Z'}, tenderPeriod={'startDate': 'unknown'})), (0, 1514764800))
+        scheduler.run([
+            Munch(id='first', status='cancelled'),
+            Munch(id='broken', status='complete'),
+            Munch(id='forming', status='pending.verification'),
+            Munch(id='first', status='complete'),  # newer change of queued auction
+        ], killer)
+        self.assertEqual(processed, [('forming', 'pending.verification'), ('first', 'complete'),
+                                     ('broken', 'complete')])
+        self.assertEqual(scheduler.processed, {'activation': 1, 'reporting': 2})
+        self.assertEqual(mock_logger.error.call_count, 1)
+        waits = [call[1]['extra']['MESSAGE_ID'] for call in mock_metrics_logger.info.call_args_list]
+        self.assertEqual(waits, ['queue_wait.activation', 'queue_wait.reporting', 'queue_wait.reporting'])
+
+        # workers stop without draining queue when killed
+        del processed[:]
+        killer.kill_now = True
+        scheduler.run([Munch(id='killed', status='complete')], killer)
+        self.assertEqual(processed, [])
+
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_priority_scheduler_full_queue(self, mock_logger):
+        processed = []
+        killer = Munch(kill_now=False)
+
+        def process(auction):
+            processed.append((auction.id, auction.status))
+            sleep(0.01)
+
+        def auctions_feed():
+            yield Munch(id='first', status='cancelled')
+            sleep(0.001)  # worker takes the first auction
+            yield Munch(id='first', status='complete')
+            yield Munch(id='second', status='complete')
+
+        # the only worker queues newer change of processed auction while
+        # feed filled the queue
+        scheduler = PriorityScheduler(process, concurrency=1, max_pending=1)
+        with Timeout(5):
+            scheduler.run(auctions_feed(), killer)
+        self.assertEqual(processed, [('first', 'cancelled'), ('second', 'complete'),
+                                     ('first', 'complete')])
+        self.assertEqual(scheduler.pending.counter, 1)
+
+    @mock.patch('openregistry.convoy.scheduler.PENDING_WAIT', 0.01)
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_priority_scheduler_killed_while_queue_is_full(self, mock_logger):
+        processed = []
+        killer = Munch(kill_now=False)
+
+        def process(auction):
+            processed.append(auction.id)
+            sleep(0.05)
+
+        # feed reader waits for free slot when SIGTERM comes
+        spawn_later(0.01, setattr, killer, 'kill_now', True)
+        scheduler = PriorityScheduler(process, concurrency=1, max_pending=1)
+        with Timeout(5):
+            scheduler.run((Munch(id=str(i), status='complete') for i in range(3)), killer)
+        self.assertEqual(processed, ['0'])
+
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_priority_scheduler_limited(self, mock_logger):
+        killer = Munch(kill_now=False)
+        latency = [0.01]
+        active = [0]
+        concurrency = []
+
+        def process(auction):
+            active[0] += 1
+            concurrency.append((active[0], int(limiter.limit)))
+            if len(concurrency) == 100:  # API slows down
+                latency[0] = 0.05
+            sleep(latency[0])
+            active[0] -= 1
+
+        limiter = AdaptiveLimiter('processing', initial=1, maximum=8, tolerance=3.0)
+        scheduler = PriorityScheduler(process, concurrency=1, limiter=limiter)
+        with Timeout(30):
+            scheduler.run((Munch(id=str(i), status='complete') for i in range(140)), killer)
+        self.assertEqual(len(concurrency), 140)
+        # concurrency grows while latency is flat and shrinks once it rises
+        self.assertEqual(concurrency[0], (1, 1))
+        self.assertEqual(max(running for running, _ in concurrency[:100]), 8)
+        self.assertLessEqual(max(running for running, _ in concurrency[-10:]), 3)
+        self.assertGreater(limiter.decreases, 0)
+        self.assertEqual(limiter.in_flight, 0)
+
+    @mock.patch('openregistry.convoy.scheduler.time')
+    @mock.patch('openregistry.convoy.scheduler.METRICS_LOGGER')
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_fair_scheduler(self, mock_logger, mock_metrics_logger, mock_time):
+        clock = [0]
+        mock_time.side_effect = lambda: clock[0]
+        costs = {'sellout.english': 2, 'sellout.insider': 2, 'rubble': 1}
+        lot_types = {'sellout.english': 'loki', 'sellout.insider': 'loki', 'rubble': 'basic'}
+        processed = []
+        killer = Munch(kill_now=False)
+
+        def process(auction):
+            processed.append(auction.id)
+            clock[0] += costs.get(auction.procurementMethodType, 0)
+
+        # loki auctions take twice as long, so basic gets two slots per loki one
+        scheduler = FairScheduler(process, [Pipeline('loki'), Pipeline('basic')],
+                                  lambda auction: lot_types.get(auction.procurementMethodType),
+                                  concurrency=1)
+        auctions = [Munch(id='l{}'.format(i), status='complete', procurementMethodType='sellout.english')
+                    for i in range(1, 4)]
+        auctions += [Munch(id='b{}'.format(i), status='complete', procurementMethodType='rubble')
+                     for i in range(1, 7)]
+        auctions.append(Munch(id='other', status='complete', procurementMethodType='dgf'))
+        scheduler.run(auctions, killer)
+        self.assertEqual(processed, ['other', 'b1', 'l1', 'b2', 'b3', 'l2', 'b4', 'b5', 'l3', 'b6'])
+        self.assertEqual(scheduler.pipelines['loki'].virtual_time, 6)
+        self.assertEqual(scheduler.pipelines['basic'].processed, 6)
+        waits = set(call[1]['extra']['MESSAGE_ID'] for call in mock_metrics_logger.info.call_args_list)
+        self.assertEqual(waits, {'queue_wait.loki.reporting', 'queue_wait.basic.reporting',
+                                 'pipeline.loki', 'pipeline.basic'})
+
+        # weight doubles share of processing time
+        del processed[:]
+        scheduler = FairScheduler(process, [Pipeline('loki', weight=2), Pipeline('basic')],
+                                  lambda auction: lot_types.get(auction.procurementMethodType),
+                                  concurrency=1)
+        scheduler.run(auctions[:-1], killer)
+        self.assertEqual(processed, ['b1', 'l1', 'b2', 'l2', 'b3', 'l3', 'b4', 'b5', 'b6'])
+
+        # sub-budget of procurementMethodType, newer change of processed auction
+        active = {'sellout.english': 0, 'sellout.insider': 0}
+        peaks = dict(active)
+        del processed[:]
+
+        def process_concurrently(auction):
+            processed.append((auction.id, auction.status))
+            active[auction.procurementMethodType] += 1
+            peaks[auction.procurementMethodType] = max(peaks[auction.procurementMethodType],
+                                                       active[auction.procurementMethodType])
+            sleep(0.01)
+            active[auction.procurementMethodType] -= 1
+            if auction.id == 'broken':
+                raise ValueError('broken')
+
+        def auctions_feed():
+            yield Munch(id='e1', status='cancelled', procurementMethodType='sellout.english')
+            yield Munch(id='e2', status='complete', procurementMethodType='sellout.english')
+            yield Munch(id='broken', status='complete', procurementMethodType='sellout.insider')
+            yield Munch(id='i1', status='complete', procurementMethodType='sellout.insider')
+            sleep(0.005)
+            yield Munch(id='e1', status='complete', procurementMethodType='sellout.english')
+
+        loki = Pipeline('loki', concurrency=3, budgets={'sellout.english': 1})
+        scheduler = FairScheduler(process_concurrently, [loki], lambda auction: 'loki')
+        self.assertEqual(scheduler.concurrency, 3)
+        scheduler.run(auctions_feed(), killer)
+        self.assertEqual(peaks, {'sellout.english': 1, 'sellout.insider': 2})
+        self.assertEqual(sorted(processed), [('broken', 'complete'), ('e1', 'cancelled'), ('e1', 'complete'),
+                                             ('e2', 'complete'), ('i1', 'complete')])
+        self.assertLess(processed.index(('e1', 'cancelled')), processed.index(('e1', 'complete')))
+        self.assertEqual((loki.processed, loki.active, loki.queued), (5, 0, 0))
+        self.assertEqual(mock_logger.error.call_count, 1)
+
+    @mock.patch('openregistry.convoy.scheduler.PENDING_WAIT', 0.01)
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_fair_scheduler_killed_while_queue_is_full(self, mock_logger):
+        processed = []
+        killer = Munch(kill_now=False)
+
+        def process(auction):
+            processed.append(auction.id)
+            sleep(0.05)
+
+        # feed reader waits for free slot when SIGTERM comes
+        spawn_later(0.01, setattr, killer, 'kill_now', True)
+        scheduler = FairScheduler(process, [Pipeline('loki')], lambda auction: 'loki', max_pending=1)
+        with Timeout(5):
+            scheduler.run((Munch(id=str(i), status='complete', procurementMethodType='sellout.english')
+                           for i in range(3)), killer)
+        self.assertEqual(processed, ['0'])
+
+    @mock.patch('openregistry.convoy.scheduler.LOGGER')
+    def test_fair_scheduler_limited(self, mock_logger):
+        killer = Munch(kill_now=False)
+        active = [0]
+        concurrency = []
+
+        def process(auction):
+            active[0] += 1
+            concurrency.append(active[0])
+            sleep(0.01)
+            active[0] -= 1
+
+        limiter = AdaptiveLimiter('processing', initial=2, maximum=4)
+        scheduler = FairScheduler(process, [Pipeline('loki', concurrency=8)], lambda auction: 'loki',
+                                  limiter=limiter)
+        self.assertEqual(scheduler.limit, 2)
+        with Timeout(30):
+            scheduler.run((Munch(id=str(i), status='complete', procurementMethodType='sellout.english')
+                           for i in range(40)), killer)
+        self.assertEqual(len(concurrency), 40)
+        # total concurrency is adapted limit, not sum of pipelines
+        self.assertEqual(max(concurrency), 4)
+        self.assertEqual(scheduler.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSchedulerSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
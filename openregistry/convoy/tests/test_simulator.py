@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+
+monkey.patch_all()
+
+import unittest
+from uuid import uuid4
+
+import mock
+from couchdb import Database
+from webtest import TestApp
+
+from openregistry.convoy.constants import FEED_DOC_FIELDS
+from openregistry.convoy.simulator import (
+    Simulator,
+    load_scenario,
+    sample_latency,
+    serve,
+)
+from openregistry.convoy.tests.test_utils import AlmostAlwaysTrue
+from openregistry.convoy.utils import (
+    continuous_changes_feed,
+    convoy_feed_selector,
+    fetch_projected_docs,
+    pending_work,
+)
+
+
+class TestSimulatorSuite(unittest.TestCase):
+    """ TestCase of simulated CouchDB and APIs """
+
+    def setUp(self):
+        self.scenario = load_scenario(None)
+        self.scenario['seed'] = 1
+        self.scenario['auctions'][0]['count'] = 3
+        self.scenario['auctions'][1]['count'] = 2
+        self.simulator = Simulator(self.scenario)
+        self.app = TestApp(self.simulator)
+
+    def test_populate(self):
+        self.assertEqual(self.simulator.auctions_types,
+                         {'loki': ['sellout.english'], 'basic': ['rubble']})
+        self.assertEqual(len(self.simulator.resources['auctions']), 5)
+        self.assertEqual(len(self.simulator.resources['lots']), 5)
+        self.assertEqual(len(self.simulator.resources['assets']), 2 * 2)
+        self.assertEqual(self.simulator.update_seq, 5)
+        # same seed generates the same world
+        self.assertEqual(sorted(Simulator(self.scenario).docs), sorted(self.simulator.docs))
+
+    def test_changes(self):
+        response = self.app.get('/ea_auctions/_changes', {
+            'since': 0, 'limit': 2, 'include_docs': 'true', 'filter': 'auction_filters/convoy_feed'
+        })
+        self.assertEqual([row['seq'] for row in response.json['results']], [1, 2])
+        self.assertEqual(response.json['last_seq'], 2)
+        auction = response.json['results'][0]['doc']
+
+        # patch of auction through API moves it to the end of feed
+        self.app.patch_json('/api/0/auctions/{}'.format(auction['id']),
+                            {'data': {'status': 'unsuccessful'}})
+        response = self.app.get('/ea_auctions/_changes', {'since': 0, 'filter': 'auction_filters/convoy_feed'})
+        self.assertEqual([row['seq'] for row in response.json['results']], [2, 3, 4, 5, 6])
+        self.assertEqual(response.json['results'][-1]['id'], auction['id'])
+
+        # auctions, which are not convoy work, are filtered out
+        basic_id = next(doc_id for doc_id, doc in self.simulator.docs.items()
+                        if doc['procurementMethodType'] == 'rubble')
+        self.app.patch_json('/api/0/auctions/{}'.format(basic_id),
+                            {'data': {'status': 'active.tendering'}})
+        response = self.app.get('/ea_auctions/_changes', {'since': 6, 'filter': 'auction_filters/convoy_feed'})
+        self.assertEqual(response.json, {'results': [], 'last_seq': 7})
+        self.assertEqual(self.app.get('/ea_auctions').json['update_seq'], 7)
+
+    def test_projection(self):
+        server = serve(self.simulator)
+        self.addCleanup(server.stop)
+        db = Database('http://{}:{}/ea_auctions'.format(*server.address[:2]))
+        auctions_types = self.simulator.auctions_types
+        selector = convoy_feed_selector(auctions_types)
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            auctions = list(continuous_changes_feed(
+                db, mock.MagicMock(kill_now=False), timeout=0.1,
+                fields=FEED_DOC_FIELDS, doc_selector=selector
+            ))
+        self.assertEqual(sorted(auction['id'] for auction in auctions), sorted(self.simulator.docs))
+        for auction in auctions:
+            doc = self.simulator.docs[auction['id']]
+            self.assertEqual(auction, dict((field, doc[field]) for field in FEED_DOC_FIELDS if field in doc))
+        self.assertEqual(sorted(auction['id'] for auction in pending_work(db, auctions_types, fields=FEED_DOC_FIELDS)),
+                         sorted(self.simulator.docs))
+
+        # auction, which is not convoy work anymore, is dropped by selector
+        basic_id = next(doc_id for doc_id, doc in self.simulator.docs.items()
+                        if doc['procurementMethodType'] == 'rubble')
+        self.app.patch_json('/api/0/auctions/{}'.format(basic_id),
+                            {'data': {'status': 'active.tendering'}})
+        self.assertEqual(fetch_projected_docs(db, [{'id': basic_id}], FEED_DOC_FIELDS, selector), [])
+
+        # Mango query with ids and feed selector, as CouchDB evaluates it
+        ids = sorted(self.simulator.docs)[:2]
+        response = self.app.post_json('/ea_auctions/_find', {
+            'selector': {'$and': [{'_id': {'$in': ids}}, selector]}, 'fields': ['_id']
+        })
+        self.assertEqual(sorted(doc['_id'] for doc in response.json['docs']),
+                         [doc_id for doc_id in ids if doc_id != basic_id])
+
+    def test_api(self):
+        auction = next(doc for doc in self.simulator.docs.values()
+                       if doc['procurementMethodType'] == 'sellout.english')
+        self.assertEqual(self.app.head('/api/0/spore').status_int, 200)
+        data = self.app.get('/api/0/auctions/{}'.format(auction['id'])).json['data']
+        self.assertNotIn('_rev', data)
+        lot = self.app.get('/api/0/lots/{}'.format(data['merchandisingObject'])).json['data']
+        self.assertEqual(lot['auctions'][0]['relatedProcessID'], auction['id'])
+
+        response = self.app.patch_json(
+            '/api/0/lots/{}/auctions/{}'.format(lot['id'], lot['auctions'][0]['id']),
+            {'data': {'status': 'complete'}}
+        )
+        self.assertEqual(response.json['data']['status'], 'complete')
+        response = self.app.post_json('/api/0/contracts', {'data': {'relatedProcessID': auction['id']}})
+        self.assertEqual(response.status_int, 201)
+        self.assertIn(response.json['data']['id'], self.simulator.resources['contracts'])
+        self.app.get('/api/0/lots/{}'.format(uuid4().hex), status=404)
+
+        asset_id = next(iter(self.simulator.resources['assets']))
+        asset = self.app.get('/api/0/assets/{}'.format(asset_id)).json['data']
+        response = self.app.get(asset['documents'][0]['url'].replace('http://localhost:80', ''))
+        self.assertEqual(len(response.body), 1024)
+        self.assertIn('filename=', response.headers['Content-Disposition'])
+        response = self.app.post_json('/ds/register', {'data': {'hash': 'md5:0'}})
+        self.assertEqual(response.status_int, 201)
+        self.assertIn('upload_url', response.json)
+        self.assertEqual(self.simulator.stats['requests']['lots'], 3)
+
+    def test_errors_and_latency(self):
+        self.simulator.scenario['errors'] = {'lots': {409: 1}}
+        lot_id = next(iter(self.simulator.resources['lots']))
+        self.app.get('/api/0/lots/{}'.format(lot_id), status=409)
+        self.assertEqual(self.simulator.stats['errors'], {409: 1})
+        self.app.head('/api/0/spore', status=200)
+
+        rnd = mock.MagicMock()
+        rnd.uniform.return_value = 0.5
+        self.assertEqual(sample_latency(None, rnd), 0)
+        self.assertEqual(sample_latency({'value': 0.1}, rnd), 0.1)
+        self.assertEqual(sample_latency({'distribution': 'uniform', 'min': 0, 'max': 1}, rnd), 0.5)
+        with self.assertRaises(ValueError):
+            sample_latency({'distribution': 'pareto'}, rnd)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSimulatorSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
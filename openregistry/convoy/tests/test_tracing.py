@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import unittest
+from uuid import uuid4
+
+import mock
+from munch import munchify
+
+from openprocurement_client.exceptions import ResourceNotFound
+
+from openregistry.convoy.metrics import STAGE_METRICS
+from openregistry.convoy.tracing import Tracer
+
+
+class TestTracingSuite(unittest.TestCase):
+    """ TestCase of auction traces """
+
+    @mock.patch('openregistry.convoy.tracing.random')
+    def test_tracer(self, mock_random):
+        path = os.path.join(tempfile.gettempdir(), 'trace_{}.json'.format(uuid4().hex))
+        tracer = Tracer()
+        self.addCleanup(os.remove, path)
+        self.addCleanup(tracer.close)
+        tracer.configure(path, sample_rate=0.5)
+        self.assertTrue(tracer.enabled)
+
+        mock_random.return_value = 0.1
+        with tracer.trace('process_auction', auction_id='a1'):
+            with tracer.span('get_lot', 'lots'):
+                pass
+            tracer.event('retry', 'client', status=429)
+            with self.assertRaises(ResourceNotFound):
+                with tracer.span('patch_resource_item', 'auctions'):
+                    raise ResourceNotFound(munchify({'status_code': 404}))
+        # not sampled
+        mock_random.return_value = 0.9
+        with tracer.trace('process_auction', auction_id='a2'):
+            self.assertIsNone(tracer.current)
+            with tracer.span('get_lot', 'lots'):
+                pass
+        self.assertEqual(tracer.written, 1)
+        tracer.close()
+
+        with open(path) as trace_file:
+            events = json.loads(trace_file.read().rstrip().rstrip(',') + ']')
+        self.assertEqual([(event['name'], event['ph']) for event in events], [
+            ('thread_name', 'M'), ('get_lot', 'X'), ('retry', 'i'),
+            ('patch_resource_item', 'X'), ('process_auction', 'X')
+        ])
+        self.assertEqual(len(set(event['tid'] for event in events)), 1)
+        self.assertEqual(events[3]['args'], {'outcome': 404})
+        self.assertEqual(events[4]['args'], {'auction_id': 'a1', 'outcome': 'ok'})
+        self.assertGreaterEqual(events[1]['ts'], events[4]['ts'])
+
+        # appended traces keep file a valid trace
+        tracer.configure(path)
+        self.addCleanup(setattr, STAGE_METRICS, 'enabled', False)
+        STAGE_METRICS.enabled = True
+        with tracer.trace('process_auction', auction_id='a3'), \
+                mock.patch('openregistry.convoy.metrics.TRACER', tracer):
+            with STAGE_METRICS.timed('get_lot', 'lots'):
+                pass
+        tracer.close()
+        with open(path) as trace_file:
+            content = trace_file.read()
+        self.assertEqual(content.count('['), 1)
+        self.assertEqual(len(json.loads(content.rstrip().rstrip(',') + ']')), 8)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestTracingSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
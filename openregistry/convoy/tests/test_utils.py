@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+import json
 import os
 import unittest
+from StringIO import StringIO
 from uuid import uuid4
 
 import mock
 from couchdb import Database
+from couchdb.client import Row
+from gevent import joinall, sleep, spawn
+from gevent.event import Event
 from lazydb import Db as LazyDB
+from munch import Munch
 from yaml import safe_load as load
 
 from openprocurement_client.clients import APIResourceClient
@@ -14,12 +20,30 @@ from openprocurement_client.resources.lots import LotsClient
 
 from openregistry.convoy.utils import (
     push_filter_doc,
+    push_views_doc,
+    parse_date,
+    seq_number,
+    parse_seq,
+    split_seq_range,
+    changes_range,
+    fetch_docs_by_ids,
+    pending_work,
+    pending_work_keys,
+    VIEWS_DOC_ID,
+    PROJECTION_VIEW,
+    match_selector,
     continuous_changes_feed,
+    convoy_feed_selector,
+    ChangesStream,
     FILTER_DOC_ID,
     FILTER_CONVOY_FEED_DOC,
     init_clients,
-    AuctionsMapping
+    AuctionsMapping,
+    LotLockLost,
+    LotLockTimeout,
+    LotsLocker,
 )
+from openregistry.convoy.benchmarks import destroy_lazydb
 from openregistry.convoy.constants import DEFAULTS
 
 ROOT = '/'.join(os.path.dirname(__file__).split('/')[:-3])
@@ -66,6 +90,161 @@ class TestUtilsSuite(unittest.TestCase):
         self.assertEqual(db.get.call_count, 2)
         db.save.assert_called_once_with(filter_doc)
 
+    def test_push_views_doc(self):
+        db = mock.MagicMock()
+        saved = {}
+        db.get.side_effect = lambda doc_id, default: saved.get(doc_id, default)
+        db.save.side_effect = lambda doc: saved.update({doc['_id']: doc})
+        auction_types = {'basic': ['rubble'], 'loki': ['sellout.english']}
+        push_views_doc(db, auction_types)
+        self.assertEqual(db.save.call_count, 1)
+        pending_work_map = saved[VIEWS_DOC_ID]['views']['pending_work']['map']
+        self.assertIn("['rubble'].indexOf(doc.procurementMethodType)", pending_work_map)
+        self.assertIn("['sellout.english'].indexOf(doc.procurementMethodType)", pending_work_map)
+        self.assertIn('emit([doc.procurementMethodType, doc.status], null)', pending_work_map)
+
+        # the same view is not saved again
+        push_views_doc(db, auction_types)
+        self.assertEqual(db.save.call_count, 1)
+
+        # projection view is added to the same design document
+        push_views_doc(db, auction_types, fields=['_id', 'status'])
+        self.assertEqual(db.save.call_count, 2)
+        projection_map = saved[VIEWS_DOC_ID]['views']['projection']['map']
+        self.assertIn('var fields = ["_id", "status"];', projection_map)
+        self.assertIn('emit(doc._id, projected)', projection_map)
+        self.assertIn('pending_work', saved[VIEWS_DOC_ID]['views'])
+
+    def test_match_selector(self):
+        selector = {'doc_type': 'Auction', '$or': [{'status': {'$in': ['complete']}},
+                                                   {'merchandisingObject': {'$gt': ''}}]}
+        self.assertTrue(match_selector({'doc_type': 'Auction', 'status': 'complete'}, selector))
+        self.assertTrue(match_selector({'doc_type': 'Auction', 'merchandisingObject': 'a'}, selector))
+        self.assertFalse(match_selector({'doc_type': 'Auction', 'merchandisingObject': ''}, selector))
+        self.assertFalse(match_selector({'status': 'complete'}, selector))
+        selector = {'$and': [{'_id': {'$in': ['a', 'b']}}, selector]}
+        self.assertTrue(match_selector({'_id': 'a', 'doc_type': 'Auction', 'status': 'complete'}, selector))
+        self.assertFalse(match_selector({'_id': 'c', 'doc_type': 'Auction', 'status': 'complete'}, selector))
+        self.assertFalse(match_selector({'_id': 'a', 'doc_type': 'Auction'}, selector))
+
+    def test_fetch_docs_by_ids(self):
+        found_id, deleted_id, missing_id = uuid4().hex, uuid4().hex, uuid4().hex
+        db = mock.MagicMock()
+        db.view.return_value = [
+            Row(id=found_id, key=found_id, value={'rev': '1-a'},
+                doc={'_id': found_id, 'status': 'complete'}),
+            Row(id=deleted_id, key=deleted_id, value={'rev': '2-b', 'deleted': True}, doc=None),
+            Row(key=missing_id, error='not_found'),
+        ]
+        docs = fetch_docs_by_ids(db, [found_id, deleted_id, missing_id])
+        db.view.assert_called_once_with(
+            '_all_docs', keys=[found_id, deleted_id, missing_id], include_docs=True
+        )
+        self.assertEqual(docs, {found_id: {'_id': found_id, 'id': found_id, 'status': 'complete'}})
+
+        db.view.reset_mock()
+        self.assertEqual(fetch_docs_by_ids(db, []), {})
+        self.assertEqual(db.view.call_count, 0)
+
+    def test_split_seq_range(self):
+        self.assertEqual(split_seq_range(0, 10, 3), [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(split_seq_range(5, 7, 8), [(5, 6), (6, 7)])
+        self.assertEqual(split_seq_range(5, 5, 8), [])
+        self.assertEqual(seq_number(42), 42)
+        self.assertEqual(seq_number('42-g1AAAAB'), 42)
+
+        # opaque sequences of CouchDB 2.x are not split
+        self.assertEqual(parse_seq('42'), 42)
+        self.assertEqual(parse_seq('42-g1AAAAB'), '42-g1AAAAB')
+        self.assertEqual(split_seq_range('12-g1AAAAA', '42-g1AAAAB', 3),
+                         [('12-g1AAAAA', '42-g1AAAAB')])
+        self.assertEqual(split_seq_range(0, '42-g1AAAAB', 3), [(0, '42-g1AAAAB')])
+
+    def test_changes_range(self):
+        db = mock.MagicMock()
+        changes = [{'seq': seq, 'id': str(seq), 'doc': {'_id': str(seq)}}
+                   for seq in (3, 5, 6, 9, 12)]
+
+        def get_changes(since, limit, **kwargs):
+            results = [row for row in changes if row['seq'] > int(since)][:limit]
+            return {'results': results,
+                    'last_seq': results[-1]['seq'] if results else since}
+        db.changes.side_effect = get_changes
+
+        pages = list(changes_range(db, 2, 9, limit=2))
+        self.assertEqual([[row['seq'] for row in rows] for rows, _ in pages],
+                         [[3, 5], [6, 9]])
+        self.assertEqual([last_seq for _, last_seq in pages], [5, 9])
+
+        # range end is in the middle of a page
+        pages = list(changes_range(db, 5, 10, limit=3))
+        self.assertEqual(pages, [(changes[2:4], 9)])
+
+        # nothing in range
+        pages = list(changes_range(db, 12, 20))
+        self.assertEqual(pages, [([], 12)])
+
+        # opaque sequences of CouchDB 2.x, which do not follow numeric order
+        opaque = [{'seq': seq, 'id': seq} for seq in ('9-b', '7-c', '12-a', '11-d')]
+
+        def get_opaque_changes(since, limit, **kwargs):
+            start = [row['seq'] for row in opaque].index(since) + 1 if since else 0
+            results = opaque[start:start + limit]
+            return {'results': results,
+                    'last_seq': results[-1]['seq'] if results else since}
+        db.changes.side_effect = get_opaque_changes
+
+        pages = list(changes_range(db, 0, '12-a', limit=2))
+        self.assertEqual(pages, [(opaque[:2], '7-c'), (opaque[2:3], '12-a')])
+
+        # range ends with page, which ends with the sequence
+        pages = list(changes_range(db, 0, '7-c', limit=2))
+        self.assertEqual(pages, [(opaque[:2], '7-c')])
+
+        # sequence, which was not seen, ends range with feed
+        pages = list(changes_range(db, '9-b', '99-z', limit=2))
+        self.assertEqual(pages, [(opaque[1:3], '12-a'), (opaque[3:], '11-d'), ([], '11-d')])
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2018-01-01T00:00:00Z'), 1514764800)
+        self.assertEqual(parse_date('2018-01-01T00:00:00'), 1514764800)
+        self.assertEqual(parse_date('2018-01-01T02:00:00+02:00'), 1514764800)
+        self.assertEqual(parse_date('2017-12-31T23:00:00-0100'), 1514764800)
+        self.assertAlmostEqual(parse_date('2018-01-01T02:00:00.250000+02:00'), 1514764800.25)
+        with self.assertRaises(ValueError):
+            parse_date('01.01.2018')
+
+    def test_pending_work(self):
+        auction_types = {'basic': ['rubble'], 'loki': ['sellout.english']}
+        keys = pending_work_keys(auction_types)
+        self.assertEqual(len(keys), 4 + 6)
+        self.assertIn(['rubble', 'pending.verification'], keys)
+        self.assertIn(['sellout.english', 'pending.complete'], keys)
+        self.assertNotIn(['rubble', 'pending.complete'], keys)
+
+        auction_id = uuid4().hex
+        db = mock.MagicMock()
+        db.iterview.side_effect = lambda *args, **kwargs: (
+            [Munch(id=auction_id, doc={'_id': auction_id, 'status': 'complete'})]
+            if kwargs['startkey'] == ['sellout.english', 'complete'] else []
+        )
+        docs = list(pending_work(db, auction_types))
+        self.assertEqual(docs, [{'_id': auction_id, 'id': auction_id, 'status': 'complete'}])
+        self.assertEqual(db.iterview.call_count, len(keys))
+        db.iterview.assert_any_call(
+            'convoy_views/pending_work', 100, include_docs=True,
+            startkey=['sellout.english', 'complete'], endkey=['sellout.english', 'complete']
+        )
+
+        # with projection documents are fetched by ids
+        db.view.return_value = [Row(id=auction_id, key=auction_id, value={
+            '_id': auction_id, 'doc_type': 'Auction', 'status': 'complete',
+            'procurementMethodType': 'sellout.english', 'merchandisingObject': uuid4().hex
+        })]
+        docs = list(pending_work(db, auction_types, fields=['_id', 'status']))
+        self.assertEqual(docs, [{'_id': auction_id, 'id': auction_id, 'status': 'complete'}])
+        db.view.assert_called_once_with(PROJECTION_VIEW, keys=[auction_id])
+
     @mock.patch('requests.Response.raise_for_status')
     @mock.patch('requests.Session.request')
     def test_init_clients(self, mock_raise, mock_request):
@@ -108,6 +287,231 @@ class TestUtilsSuite(unittest.TestCase):
                                       'contracts': [{'status': 'cancelled'}]
                                       })
 
+    def test_continuous_changes_feed_selector(self):
+        db = mock.MagicMock()
+        db.changes.side_effect = [
+            {'last_seq': 1, 'results': [{'doc': {'id': uuid4().hex}}]},
+            {'last_seq': 1, 'results': []}
+        ]
+        selector = convoy_feed_selector({'basic': ['rubble']})
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(2)):
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(), timeout=0.1, selector=selector
+            ))
+        self.assertEqual(len(results), 1)
+        db.changes.assert_called_with(
+            include_docs=True, since=0, limit=100, filter='_selector',
+            _selector={'selector': selector}
+        )
+
+    def test_continuous_changes_feed_projection(self):
+        db = mock.MagicMock()
+        auction_id, deleted_id, missing_id = uuid4().hex, uuid4().hex, uuid4().hex
+        db.changes.return_value = {'last_seq': 3, 'results': [
+            {'id': auction_id, 'seq': 1, 'changes': [{'rev': '1-a'}]},
+            {'id': deleted_id, 'seq': 2, 'changes': [{'rev': '2-b'}], 'deleted': True},
+            {'id': missing_id, 'seq': 3, 'changes': [{'rev': '1-c'}]},
+        ]}
+        db.view.return_value = [
+            Row(id=auction_id, key=auction_id,
+                value={'_id': auction_id, 'status': 'pending.verification', 'mode': 'test'})
+        ]
+        fields = ['_id', 'id', 'status']
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(), timeout=0.1, fields=fields
+            ))
+        db.changes.assert_called_once_with(
+            include_docs=False, since=0, limit=100,
+            filter='auction_filters/convoy_feed'
+        )
+        db.view.assert_called_once_with(PROJECTION_VIEW, keys=[auction_id, missing_id])
+        self.assertEqual(results, [
+            {'_id': auction_id, 'id': auction_id, 'status': 'pending.verification'}
+        ])
+
+        # documents, which changed after changes were read, are filtered again
+        selector = convoy_feed_selector({'basic': ['rubble']})
+        matching_id = uuid4().hex
+        db.changes.return_value = {'last_seq': 5, 'results': [
+            {'id': auction_id, 'seq': 4}, {'id': matching_id, 'seq': 5}
+        ]}
+        db.view.return_value = [
+            Row(id=auction_id, key=auction_id, value={
+                '_id': auction_id, 'doc_type': 'Auction', 'status': 'active.tendering',
+                'procurementMethodType': 'rubble'
+            }),
+            Row(id=matching_id, key=matching_id, value={
+                '_id': matching_id, 'doc_type': 'Auction', 'status': 'pending.verification',
+                'procurementMethodType': 'rubble'
+            }),
+        ]
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(), timeout=0.1,
+                fields=fields + ['doc_type', 'procurementMethodType'], doc_selector=selector
+            ))
+        self.assertEqual([doc['id'] for doc in results], [matching_id])
+
+        # feed does not wait while pages of dropped rows are received
+        db.changes.reset_mock()
+        db.changes.side_effect = [
+            {'last_seq': 6, 'results': [{'id': auction_id, 'seq': 6}]},
+            {'last_seq': 6, 'results': []},
+        ]
+        db.view.return_value = []
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(2)), \
+                mock.patch('openregistry.convoy.utils.sleep') as mock_sleep:
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(kill_now=False), timeout=0.1, fields=fields
+            ))
+        self.assertEqual(results, [])
+        self.assertEqual(db.changes.call_count, 2)
+        mock_sleep.assert_called_once_with(0.1)
+
+    def test_coalesce_projected_changes(self):
+        db = mock.MagicMock()
+        ids = [uuid4().hex for _ in range(3)]
+        db.changes.side_effect = [
+            {'last_seq': 2, 'results': [{'id': ids[0], 'seq': 1, 'deleted': True},
+                                        {'id': ids[1], 'seq': 2}]},
+            {'last_seq': 3, 'results': [{'id': ids[2], 'seq': 3}]},
+        ]
+        db.view.side_effect = lambda name, keys: [
+            Row(id=doc_id, key=doc_id, value={'_id': doc_id}) for doc_id in keys
+        ]
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(kill_now=False), timeout=0.1, limit=2,
+                fields=['_id'], coalesce_window=10
+            ))
+        # deleted row does not end window before feed is drained
+        self.assertEqual([doc['id'] for doc in results], ids[1:])
+        self.assertEqual(db.changes.call_count, 2)
+
+    def test_continuous_changes_feed_coalesce(self):
+        db = mock.MagicMock()
+        first_id, second_id = uuid4().hex, uuid4().hex
+        db.changes.side_effect = [
+            {'last_seq': 2, 'results': [
+                {'id': first_id, 'doc': {'id': first_id, 'status': 'active.tendering'}},
+                {'id': second_id, 'doc': {'id': second_id, 'status': 'complete'}},
+            ]},
+            {'last_seq': 3, 'results': [
+                {'id': first_id, 'doc': {'id': first_id, 'status': 'complete'}},
+            ]},
+        ]
+        feed_state = {'last_seq': 0}
+        killer = mock.MagicMock(kill_now=False)
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            feed = continuous_changes_feed(db, killer, timeout=0.1, limit=2,
+                                           coalesce_window=10, feed_state=feed_state)
+            first = next(feed)
+            # checkpoint is not moved until the whole window is processed
+            self.assertEqual(feed_state['last_seq'], 0)
+            results = [first] + list(feed)
+        self.assertEqual(db.changes.call_count, 2)
+        self.assertEqual(results, [
+            {'id': second_id, 'status': 'complete'},
+            {'id': first_id, 'status': 'complete'},
+        ])
+        self.assertEqual(feed_state['last_seq'], 3)
+
+    @mock.patch('openregistry.convoy.utils.CHANGES_STREAM_CHUNK_SIZE', 16)
+    def test_changes_stream(self):
+        rows = [{'seq': i, 'id': uuid4().hex, 'doc': {'status': u'complete'}}
+                for i in range(1, 4)]
+        body = StringIO(
+            '{"results":[\n' +
+            ',\n'.join(json.dumps(row) for row in rows) +
+            '\n],\n"last_seq":3,"pending":0}\n'
+        )
+        stream = ChangesStream(body)
+        iterator = iter(stream)
+        self.assertEqual(next(iterator), rows[0])
+        # the first row is available before the rest of response is read
+        self.assertLess(body.tell(), len(body.getvalue()))
+        self.assertIsNone(stream.last_seq)
+        self.assertEqual(list(iterator), rows[1:])
+        self.assertEqual(stream.last_seq, 3)
+
+        # empty page
+        stream = ChangesStream(StringIO('{"results":[\n\n],\n"last_seq":"3-g1AAAA"}\n'))
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.last_seq, '3-g1AAAA')
+
+        # response without a row per line is decoded as a whole
+        stream = ChangesStream(StringIO(json.dumps({'results': rows, 'last_seq': 3})))
+        self.assertEqual(list(stream), rows)
+        self.assertEqual(stream.last_seq, 3)
+
+        # short response is read by couchdb-python at once
+        stream = ChangesStream('{"results":[\n' + json.dumps(rows[0]) + '\n],\n"last_seq":1}\n')
+        self.assertEqual(list(stream), rows[:1])
+        self.assertEqual(stream.last_seq, 1)
+
+    def test_continuous_changes_feed_stream(self):
+        db = mock.MagicMock()
+        auction_id = uuid4().hex
+        db.resource.get.return_value = (200, {}, StringIO(
+            '{"results":[\n{"seq":1,"id":"%s","doc":{"id":"%s"}}\n],\n"last_seq":1}\n' % (
+                auction_id, auction_id)
+        ))
+        feed_state = {'last_seq': 0}
+        with mock.patch(
+                'openregistry.convoy.utils.CONTINUOUS_CHANGES_FEED_FLAG',
+                AlmostAlwaysTrue(1)):
+            results = list(continuous_changes_feed(
+                db, mock.MagicMock(), timeout=0.1, stream=True, feed_state=feed_state
+            ))
+        db.resource.get.assert_called_once_with(
+            '_changes', filter='auction_filters/convoy_feed',
+            since=0, limit=100, include_docs=True
+        )
+        self.assertEqual(results, [{'id': auction_id}])
+        self.assertEqual(feed_state['last_seq'], 1)
+        self.assertEqual(db.changes.call_count, 0)
+
+    def test_convoy_feed_selector(self):
+        selector = convoy_feed_selector({
+            'basic': ['rubble'],
+            'loki': ['sellout.english', 'sellout.insider']
+        })
+        self.assertEqual(selector['doc_type'], 'Auction')
+        basic_pending, basic_terminal, loki = selector['$or']
+        self.assertEqual(basic_pending, {
+            'procurementMethodType': {'$in': ['rubble']},
+            'status': 'pending.verification'
+        })
+        self.assertEqual(basic_terminal['procurementMethodType'], {'$in': ['rubble']})
+        self.assertEqual(basic_terminal['status'],
+                         {'$in': ['complete', 'cancelled', 'unsuccessful']})
+        self.assertIn('merchandisingObject', basic_terminal)
+        self.assertEqual(loki['procurementMethodType'],
+                         {'$in': ['sellout.english', 'sellout.insider']})
+        self.assertEqual(loki['status'], {'$in': [
+            'complete', 'cancelled', 'unsuccessful',
+            'pending.complete', 'pending.cancelled', 'pending.unsuccessful'
+        ]})
+        self.assertIn('merchandisingObject', loki)
+
+        # Not configured lot types match nothing
+        selector = convoy_feed_selector({})
+        for condition in selector['$or']:
+            self.assertEqual(condition['procurementMethodType'], {'$in': []})
+
     @mock.patch('logging.Logger.info')
     @mock.patch('openregistry.convoy.utils.StrictRedis')
     def test_auctions_mapping_redis(self, mock_redis, mock_logger):
@@ -146,6 +550,125 @@ class TestUtilsSuite(unittest.TestCase):
             'Set lazydb "{name}" as auctions mapping'.format(**config)
         )
 
+    @mock.patch('openregistry.convoy.utils.spawn_later')
+    def test_auctions_mapping_threadpool_and_batch(self, mock_spawn_later):
+        name = 'test_auctions_mapping_{}'.format(uuid4().hex)
+        mapping = AuctionsMapping({'name': name, 'threadpool': 2, 'batch_size': 3})
+        self.addCleanup(destroy_lazydb, name)
+        self.addCleanup(mapping.db.close)
+        self.assertIsNotNone(mapping.pool)
+
+        mapping.put('first', True)
+        mapping.put('second', 'value')
+        self.assertEqual(mock_spawn_later.call_count, 1)
+        # buffered writes are visible, but not stored yet
+        self.assertTrue(mapping.has('first'))
+        self.assertEqual(mapping.get('second'), 'value')
+        self.assertFalse(mapping.db.has('first'))
+
+        mapping.put('third', True)
+        self.assertTrue(mapping.db.has('first'))
+        self.assertEqual(mapping.db.get('second'), 'value')
+        mock_spawn_later().kill.assert_called_once_with(block=False)
+
+        mapping.put('fourth', True)
+        mapping.delete('fourth')
+        mapping.flush()
+        self.assertFalse(mapping.has('fourth'))
+        self.assertTrue(mapping.db.has('third'))
+
+        # without pool and batching lazydb is called directly
+        mapping = AuctionsMapping({'name': name, 'threadpool': 0})
+        self.addCleanup(mapping.db.close)
+        self.assertIsNone(mapping.pool)
+        mapping.put('fifth', True)
+        self.assertTrue(mapping.db.has('fifth'))
+        self.assertTrue(mapping.has('third'))
+
+        # flush and deletion wait for batch in flight, which stays visible
+        mapping = AuctionsMapping({'name': name, 'threadpool': 0, 'batch_size': 10})
+        self.addCleanup(mapping.db.close)
+        written = Event()
+        write_batch = mapping._write_batch
+
+        def slow_write_batch(items):
+            written.wait()
+            write_batch(items)
+        mapping._write_batch = slow_write_batch
+        mapping.put('sixth', True)
+        greenlets = [spawn(mapping.flush)]
+        sleep(0)
+        mapping.put('seventh', True)
+        greenlets += [spawn(mapping.flush), spawn(mapping.delete, 'sixth')]
+        sleep(0)
+        self.assertTrue(mapping.has('sixth'))
+        self.assertTrue(mapping.has('seventh'))
+        written.set()
+        joinall(greenlets, raise_error=True)
+        self.assertFalse(mapping.has('sixth'))
+        self.assertTrue(mapping.db.has('seventh'))
+        self.assertEqual((mapping._pending, mapping._flushing), ({}, {}))
+
+    @mock.patch('openregistry.convoy.utils.StrictRedis')
+    def test_auctions_mapping_redis_batch(self, mock_redis):
+        mapping = AuctionsMapping({'host': '127.0.0.1', 'batch_size': 2})
+        self.assertIsNone(mapping.pool)
+        mapping.put('first', True, px=1000)
+        mapping.put('second', True)
+        pipeline = mock_redis().pipeline
+        pipeline.assert_called_once_with(transaction=False)
+        self.assertItemsEqual(pipeline().set.call_args_list,
+                              [mock.call('first', True, px=1000), mock.call('second', True)])
+        pipeline().execute.assert_called_once_with()
+        self.assertEqual(mock_redis().set.call_count, 0)
+
+    def test_lots_locker_disabled(self):
+        locker = LotsLocker({})
+        self.assertIsNone(locker.db)
+        with locker.lock(uuid4().hex) as lease:
+            self.assertIsNone(lease.token)
+            locker.ensure(lease.lot_id)
+        self.assertEqual(locker.leases, {})
+
+    @mock.patch('openregistry.convoy.utils.sleep')
+    @mock.patch('openregistry.convoy.utils.StrictRedis')
+    def test_lots_locker_redis(self, mock_redis, mock_sleep):
+        lot_id = uuid4().hex
+        lock_keys = ['convoy:lot_lock:{}'.format(lot_id), 'convoy:lot_lock:{}:fence'.format(lot_id)]
+        redis = mock_redis.return_value
+        acquire = mock.MagicMock(side_effect=[0, 0, 3])
+        release, extend = mock.MagicMock(return_value=1), mock.MagicMock(return_value=1)
+        redis.register_script.side_effect = [acquire, release, extend]
+        locker = LotsLocker({'host': '127.0.0.1', 'lease': 1000, 'fence_ttl': 5000})
+        self.assertIn("redis.call('incr', KEYS[2])", redis.register_script.call_args_list[0][0][0])
+
+        with locker.lock(lot_id) as lease:
+            self.assertEqual(lease.token, 3)
+            self.assertIs(locker.leases[lot_id], lease)
+            locker.ensure(lot_id)
+        self.assertEqual(mock_sleep.call_count, 2)
+        # token is taken only when lock is granted, counter expires
+        acquire.assert_called_with(keys=lock_keys, args=[1000, 5000])
+        self.assertEqual(acquire.call_count, 3)
+        self.assertEqual(redis.incr.call_count, 0)
+        extend.assert_called_once_with(keys=lock_keys[:1], args=[3, 1000])
+        release.assert_called_once_with(keys=lock_keys[:1], args=[3])
+        self.assertEqual(locker.leases, {})
+
+        # Lease expired and was taken by other node
+        acquire.side_effect = [4]
+        extend.return_value = 0
+        with self.assertRaises(LotLockLost):
+            with locker.lock(lot_id):
+                locker.ensure(lot_id)
+        self.assertEqual(release.call_count, 2)
+
+        # Lot is locked by other node longer than we can wait
+        locker.wait = 0
+        acquire.side_effect = [0]
+        with self.assertRaises(LotLockTimeout):
+            locker.acquire(lot_id)
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestUtilsSuite))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import unittest
+from uuid import uuid4
+
+import mock
+from munch import Munch
+
+from openregistry.convoy.views import AuctionView, LotView
+
+
+class TestViewsSuite(unittest.TestCase):
+    """ TestCase of auction and lot views """
+
+    def test_auction_view(self):
+        auction_id = uuid4().hex
+        doc = {
+            '_id': auction_id,
+            'status': 'complete',
+            'contractTerms': {'type': 'yoke'},
+            'bids': [{'id': uuid4().hex}]
+        }
+        loader = mock.MagicMock(return_value=doc)
+        auction = AuctionView(doc, loader=loader)
+        self.assertEqual(auction.id, auction_id)
+        self.assertEqual(auction['status'], 'complete')
+        self.assertEqual(auction.contractTerms['type'], 'yoke')
+        self.assertIn('contractTerms', auction)
+        self.assertNotIn('merchandisingObject', auction)
+        self.assertIsNone(auction.get('merchandisingObject'))
+        with self.assertRaises(AttributeError):
+            auction.merchandisingObject
+        with self.assertRaises(AttributeError):
+            auction.status = 'cancelled'
+        self.assertFalse(hasattr(auction, '__dict__'))
+        self.assertEqual(loader.call_count, 0)
+
+        # fields not kept by view are read from lazily loaded document
+        self.assertEqual(auction.bids, doc['bids'])
+        self.assertEqual(auction['bids'], doc['bids'])
+        self.assertIs(auction.raw, doc)
+        self.assertEqual(loader.call_count, 1)
+
+        auction = AuctionView(doc)
+        self.assertNotIn('bids', auction)
+        self.assertEqual(auction.get('bids', []), [])
+        with self.assertRaises(AttributeError):
+            auction.raw
+
+    def test_lot_view(self):
+        lot = LotView({
+            'id': uuid4().hex,
+            'status': 'active.auction',
+            'auctions': [Munch({'id': uuid4().hex, 'status': 'active'})],
+            'description': 'not used by convoy'
+        })
+        self.assertEqual(lot.auctions[0].status, 'active')
+        self.assertEqual(lot.get('contracts', []), [])
+        self.assertNotIn('description', lot)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestViewsSuite))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
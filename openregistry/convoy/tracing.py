@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from contextlib import contextmanager
+from itertools import count
+from random import random
+from time import time
+
+from gevent.local import local
+
+
+class Trace(object):
+    """Spans of one auction event, kept until the event is processed"""
+
+    def __init__(self, number, name, args):
+        self.number = number
+        self.name = name
+        self.args = args
+        self.started = time()
+        self.events = []
+
+
+class Tracer(object):
+    """
+    Per-auction traces in Chrome Trace Event format, which can be opened in
+    chrome://tracing, Perfetto or speedscope.
+
+    Every auction event is a trace with `process_auction` span and child
+    spans of client calls, processing stages, document service requests and
+    auctions mapping access, retries are instant events. Each trace has its
+    own thread lane. Traces are sampled at start with `sample_rate`
+    probability, spans of not sampled ones are not collected at all.
+
+    Events are appended to `path` as JSON array without closing bracket,
+    which trace viewers accept, so file stays valid while convoy runs.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.sample_rate = 1.0
+        self.output = None
+        self.pid = os.getpid()
+        self.written = 0
+        self._numbers = count(1)
+        self._local = local()
+
+    @property
+    def enabled(self):
+        return self.output is not None
+
+    def configure(self, path, sample_rate=1.0):
+        self.close()
+        self.path = path
+        self.sample_rate = sample_rate
+        new = not os.path.isfile(path) or not os.path.getsize(path)
+        self.output = open(path, 'a')
+        if new:
+            self.output.write('[\n')
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+    @property
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def trace(self, name, **args):
+        """Start trace of auction event, if it is sampled"""
+        if not self.enabled or self.current is not None or random() >= self.sample_rate:
+            yield
+            return
+        trace = self._local.trace = Trace(next(self._numbers), name, args)
+        outcome = 'ok'
+        try:
+            yield trace
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self._local.trace = None
+            trace.args['outcome'] = outcome
+            self.add_span(name, 'auction', trace.started, time() - trace.started, trace.args, trace)
+            self.write(trace)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        if self.current is None:
+            yield
+            return
+        started = time()
+        try:
+            yield
+        except Exception as e:
+            args['outcome'] = getattr(e, 'status_code', None) or type(e).__name__
+            raise
+        finally:
+            self.add_span(name, category, started, time() - started, args)
+
+    def add_span(self, name, category, started, duration, args=None, trace=None):
+        trace = trace or self.current
+        if trace is None:
+            return
+        trace.events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': trace.number,
+            'ts': int(started * 1000000), 'dur': int(duration * 1000000), 'args': args or {}
+        })
+
+    def event(self, name, category, **args):
+        """Instant event in current trace"""
+        trace = self.current
+        if trace is None:
+            return
+        trace.events.append({
+            'name': name, 'cat': category, 'ph': 'i', 's': 't', 'pid': self.pid,
+            'tid': trace.number, 'ts': int(time() * 1000000), 'args': args
+        })
+
+    def write(self, trace):
+        if self.output is None:
+            return
+        thread_name = {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': trace.number,
+                       'args': {'name': '{} {}'.format(trace.name, trace.args.get('auction_id', ''))}}
+        lines = [json.dumps(event) for event in [thread_name] + trace.events]
+        self.output.write(',\n'.join(lines) + ',\n')
+        self.output.flush()
+        self.written += 1
+
+
+TRACER = Tracer()
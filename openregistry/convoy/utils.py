@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
+import json
+import re
+from calendar import timegm
+from contextlib import contextmanager
+from datetime import datetime
 from couchdb import Server, Session
+from gevent import getcurrent, spawn_later
+from gevent.lock import Semaphore
+from gevent.monkey import get_original
+from gevent.threadpool import ThreadPool
 from lazydb import Db as LazyDB
 from logging import getLogger, addLevelName, Logger
 from munch import Munch
 from pkg_resources import get_distribution
 from redis import StrictRedis
 from socket import error
-from time import sleep
+from time import sleep, time
 
 from openprocurement_client.exceptions import (
     Conflict,
@@ -25,6 +34,7 @@ from openregistry.convoy.loki.constants import (
     CONTRACT_NOT_REQUIRED_FIELDS,
     CONTRACT_REQUIRED_FIELDS,
 )
+from openregistry.convoy.tracing import TRACER
 
 
 addLevelName(25, 'CHECK')
@@ -70,18 +80,141 @@ function(doc, req) {
 }
 """
 
+FEED_FILTER_DOC = 'auction_filters/convoy_feed'
+FEED_SELECTOR_FILTER = '_selector'
+BASIC_FEED_TERMINAL_STATUSES = ['complete', 'cancelled', 'unsuccessful']
+LOKI_FEED_STATUSES = [
+    'complete', 'cancelled', 'unsuccessful',
+    'pending.complete', 'pending.cancelled', 'pending.unsuccessful'
+]
+
+CHANGES_STREAM_CHUNK_SIZE = 16 * 1024
+CHANGES_STREAM_HEAD = '{"results":['
+
+VIEWS_DOC_ID = '_design/convoy_views'
+PENDING_WORK_VIEW = 'convoy_views/pending_work'
+PENDING_WORK_VIEW_MAP = """
+function(doc) {
+    if (doc.doc_type != 'Auction') {
+        return;
+    }
+    var basic_terminal = %s;
+    var loki_statuses = %s;
+
+    // basic lots auctions
+    if (%s.indexOf(doc.procurementMethodType) >= 0) {
+
+        if (doc.status == 'pending.verification' ||
+                (basic_terminal.indexOf(doc.status) >= 0 && doc.merchandisingObject)) {
+            emit([doc.procurementMethodType, doc.status], null);
+        };
+
+    // loki lots auctions
+    } else if (%s.indexOf(doc.procurementMethodType) >= 0) {
+
+        if (loki_statuses.indexOf(doc.status) >= 0 && doc.merchandisingObject) {
+            emit([doc.procurementMethodType, doc.status], null);
+        };
+
+    };
+}
+"""
+
+PROJECTION_VIEW = 'convoy_views/projection'
+PROJECTION_VIEW_MAP = """
+function(doc) {
+    if (doc.doc_type != 'Auction') {
+        return;
+    }
+    var fields = %s;
+    var projected = {};
+    for (var i = 0; i < fields.length; i++) {
+        if (fields[i] in doc) {
+            projected[fields[i]] = doc[fields[i]];
+        }
+    }
+    emit(doc._id, projected);
+}
+"""
+MISSING = object()
+
+ISO_DATE_RE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d{1,6}))?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?$'
+)
+
+BACKFILL_CHECKPOINT_KEY = 'backfill:{since}:{until}:{start}'
+BACKFILL_CHUNK_DONE = 'done'
+
 CONTINUOUS_CHANGES_FEED_FLAG = True  # Need for testing
 
+RETRIES = {}  # number of retried requests by response status code
+
+LOT_LOCK_KEY = '{prefix}:{lot_id}'
+LOT_LOCK_FENCE_KEY = '{prefix}:{lot_id}:fence'
+# Take the next token only when the lock is free, so tokens are not burnt
+# by retries, and keep the counter while the lot is being locked
+LOT_LOCK_ACQUIRE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+local token = redis.call('incr', KEYS[2])
+redis.call('set', KEYS[1], token, 'px', ARGV[1])
+redis.call('pexpire', KEYS[2], ARGV[2])
+return token
+"""
+# Delete/extend the lock only while it still holds our token
+LOT_LOCK_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+LOT_LOCK_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
 
 class ConfigError(Exception):
     pass
 
 
+class LotLockTimeout(Exception):
+    pass
+
+
+class LotLockLost(Exception):
+    pass
+
+
+# Auction was not processed because of other node, it should be processed again later
+LOT_LOCK_ERRORS = (LotLockTimeout, LotLockLost)
+
+
 class AuctionsMapping(object):
-    """Mapping for processed auctions"""
+    """
+    Mapping for processed auctions.
+
+    Calls of lazydb, which does disk I/O gevent can not yield on, are run in
+    thread pool of `threadpool` size, `0` runs them in calling greenlet.
+    Shelve is not thread safe, so calls are serialized and the pool only
+    keeps the hub free while disk is busy. Redis client already cooperates
+    with gevent and is called directly.
+
+    With `batch_size` writes are buffered and stored together, in one call
+    of thread pool or one redis pipeline, when `batch_size` of them is
+    collected or `batch_interval` seconds passed. Buffered keys are visible
+    to reads, but are lost on crash, which leads to reprocessing of those
+    auctions only. Batches are stored one at a time, and deletion waits for
+    the batch in flight, so it can not store deleted key again.
+    """
 
     def __init__(self, config):
         self.config = config
+        self.pool = None
         if 'host' in self.config:
             config = {
                 'host': self.config.get('host'),
@@ -94,25 +227,102 @@ class AuctionsMapping(object):
                         'as auctions mapping'.format(**config))
             self._set_value = self.db.set
             self._has_value = self.db.exists
+            self._write_batch = self._write_redis_batch
         else:
             db = self.config.get('name', 'auctions_mapping')
             self.db = LazyDB(db)
             LOGGER.info('Set lazydb "{}" as auctions mapping'.format(db))
             self._set_value = self.db.put
             self._has_value = self.db.has
+            self._write_batch = self._write_lazydb_batch
+            pool_size = int(self.config.get('threadpool', 1))
+            if pool_size:
+                self.pool = ThreadPool(pool_size)
+                self._lock = get_original('thread', 'allocate_lock')()
+        self.batch_size = int(self.config.get('batch_size', 0))
+        self.batch_interval = self.config.get('batch_interval', 1)
+        self._pending = {}
+        self._flushing = {}
+        self._flush_timer = None
+        self._flush_lock = Semaphore()
+
+    def _call(self, operation, func, *args, **kwargs):
+        if TRACER.current is not None:
+            with TRACER.span(operation, 'auctions_mapping'):
+                return self._run(func, args, kwargs)
+        return self._run(func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        if self.pool is None:
+            return func(*args, **kwargs)
+        return self.pool.apply(self._locked, (func, args, kwargs))
+
+    def _locked(self, func, args, kwargs):
+        with self._lock:
+            return func(*args, **kwargs)
+
+    def _buffered(self, key):
+        for buffer in (self._pending, self._flushing):
+            if key in buffer:
+                return buffer[key]
 
     def get(self, key):
-        return self.db.get(key)
+        buffered = self._buffered(key)
+        if buffered is not None:
+            return buffered[0]
+        return self._call('get', self.db.get, key)
 
     def put(self, key, value, **kwargs):
         LOGGER.info('Save ID {} in cache'.format(key))
-        self._set_value(key, value, **kwargs)
+        if not self.batch_size:
+            self._call('put', self._set_value, key, value, **kwargs)
+            return
+        self._pending[key] = (value, kwargs)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = spawn_later(self.batch_interval, self.flush)
 
     def has(self, key):
-        return self._has_value(key)
+        if self._buffered(key) is not None:
+            return True
+        return self._call('has', self._has_value, key)
 
     def delete(self, key):
-        return self.db.delete(key)
+        with self._flush_lock:
+            self._pending.pop(key, None)
+            return self._call('delete', self.db.delete, key)
+
+    def flush(self):
+        """Store buffered writes"""
+        if self._flush_timer is not None and self._flush_timer is not getcurrent():
+            self._flush_timer.kill(block=False)
+        self._flush_timer = None
+        with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing.update(batch)
+            try:
+                self._call('write_batch', self._write_batch, batch)
+            except Exception:
+                for key, item in batch.items():
+                    self._pending.setdefault(key, item)
+                raise
+            finally:
+                for key, item in batch.items():
+                    if self._flushing.get(key) is item:
+                        del self._flushing[key]
+
+    def _write_lazydb_batch(self, items):
+        for key, (value, _) in items.items():
+            self.db.put(key, value)
+
+    def _write_redis_batch(self, items):
+        pipeline = self.db.pipeline(transaction=False)
+        for key, (value, kwargs) in items.items():
+            pipeline.set(key, value, **kwargs)
+        pipeline.execute()
 
 
 def prepare_auctions_mapping(config, check=False):
@@ -138,6 +348,142 @@ def prepare_auctions_mapping(config, check=False):
     return db
 
 
+class LotLease(object):
+    """Granted lock of lot, identified by monotonic token"""
+
+    def __init__(self, lot_id, token=None):
+        self.lot_id = lot_id
+        self.token = token
+
+
+class LotsLocker(object):
+    """
+    Distributed per-lot lock shared between convoy nodes.
+
+    Lock is a redis key set with `PX` expiration, its value is token taken
+    from per-lot counter. Counter is incremented only when lock is granted
+    and expires `fence_ttl` milliseconds after lot was locked last time, so
+    it should be well above `lease`. Token is checked in redis by `ensure` before writes, but
+    it is not sent to the API with the write, so it is not a fencing token:
+    node, whose lease expires between `ensure` and the write, can still
+    race with the new owner. `ensure` only narrows this window, `lease`
+    should be well above the time one write takes.
+
+    Without redis configuration locking is disabled and all leases are
+    granted immediately.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.prefix = self.config.get('prefix', 'convoy:lot_lock')
+        self.lease = int(self.config.get('lease', 60000))  # milliseconds
+        self.fence_ttl = int(self.config.get('fence_ttl', 86400000))  # milliseconds
+        self.wait = float(self.config.get('wait', 10))  # seconds
+        self.retry_interval = float(self.config.get('retry_interval', 0.1))  # seconds
+        self.leases = {}
+        if 'host' in self.config:
+            config = {
+                'host': self.config.get('host'),
+                'port': self.config.get('port') or 6379,
+                'db': self.config.get('name') or 0,
+                'password': self.config.get('password') or None
+            }
+            self.db = StrictRedis(**config)
+            self._acquire = self.db.register_script(LOT_LOCK_ACQUIRE_SCRIPT)
+            self._release = self.db.register_script(LOT_LOCK_RELEASE_SCRIPT)
+            self._extend = self.db.register_script(LOT_LOCK_EXTEND_SCRIPT)
+            LOGGER.info('Set redis store "{db}" at {host}:{port} '
+                        'as lots locker'.format(**config))
+        else:
+            self.db = None
+            LOGGER.info('Lots locking disabled')
+
+    def _keys(self, lot_id):
+        return (LOT_LOCK_KEY.format(prefix=self.prefix, lot_id=lot_id),
+                LOT_LOCK_FENCE_KEY.format(prefix=self.prefix, lot_id=lot_id))
+
+    def acquire(self, lot_id):
+        """
+        Wait for lock of lot.
+
+        :param lot_id: id of lot to lock
+        :type lot_id: str
+        :return: granted lease
+        :rtype: LotLease
+        :raises LotLockTimeout: if lock was not acquired in `wait` seconds
+        """
+        if self.db is None or lot_id is None:
+            return LotLease(lot_id)
+        lock_key, fence_key = self._keys(lot_id)
+        started = time()
+        attempts = 0
+        while True:
+            attempts += 1
+            token = self._acquire(keys=[lock_key, fence_key], args=[self.lease, self.fence_ttl])
+            if token:
+                break
+            if attempts == 1:
+                LOGGER.info('Lot {} is locked by other node'.format(lot_id),
+                            extra={'MESSAGE_ID': 'lot_lock_contention'})
+            if time() - started >= self.wait:
+                LOGGER.warning(
+                    'Failed to lock lot {} in {} seconds'.format(lot_id, self.wait),
+                    extra={'MESSAGE_ID': 'lot_lock_timeout',
+                           'LOCK_WAIT': int((time() - started) * 1000)}
+                )
+                raise LotLockTimeout(lot_id)
+            sleep(self.retry_interval)
+        LOGGER.info(
+            'Lock lot {} with token {}'.format(lot_id, token),
+            extra={'MESSAGE_ID': 'lot_lock_acquired',
+                   'LOCK_WAIT': int((time() - started) * 1000),
+                   'LOCK_ATTEMPTS': attempts}
+        )
+        lease = LotLease(lot_id, token)
+        self.leases[lot_id] = lease
+        return lease
+
+    def ensure(self, lot_id):
+        """
+        Check that lease of lot held by this node still belongs to it and
+        renew it. Must be called before every write to the lot, so a node
+        whose lease expired in the middle of workflow stops instead of
+        racing with the new owner. Does nothing if lot is not locked here.
+
+        :param lot_id: id of locked lot
+        :type lot_id: str
+        :raises LotLockLost: if lock was expired and taken by other node
+        """
+        lease = self.leases.get(lot_id)
+        if lease is None:
+            return
+        lock_key, _ = self._keys(lot_id)
+        if not self._extend(keys=[lock_key], args=[lease.token, self.lease]):
+            LOGGER.warning(
+                'Lock of lot {} with token {} lost'.format(lot_id, lease.token),
+                extra={'MESSAGE_ID': 'lot_lock_lost'}
+            )
+            raise LotLockLost(lot_id)
+
+    def release(self, lease):
+        if lease.token is None:
+            return
+        self.leases.pop(lease.lot_id, None)
+        lock_key, _ = self._keys(lease.lot_id)
+        if not self._release(keys=[lock_key], args=[lease.token]):
+            LOGGER.warning('Lock of lot {} with token {} expired before '
+                           'release'.format(lease.lot_id, lease.token),
+                           extra={'MESSAGE_ID': 'lot_lock_expired'})
+
+    @contextmanager
+    def lock(self, lot_id):
+        lease = self.acquire(lot_id)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+
 def prepare_couchdb(couch_url, db_name):
     server = Server(couch_url, session=Session(retry_delays=range(10)))
     try:
@@ -168,26 +514,512 @@ def push_filter_doc(db, auctions_types):
     LOGGER.info('Added filters doc to db.')
 
 
-def continuous_changes_feed(db, killer, timeout=10, limit=100,
-                            filter_doc='auction_filters/convoy_feed'):
-    last_seq_id = 0
-    while CONTINUOUS_CHANGES_FEED_FLAG:
-        data = db.changes(include_docs=True, since=last_seq_id, limit=limit,
-                          filter=filter_doc)
-        last_seq_id = data['last_seq']
-        if len(data['results']) != 0:
-            for row in data['results']:
-                item = Munch(row['doc'])
-                yield item
-            if killer.kill_now:
+def push_views_doc(db, auctions_types, fields=None):
+    """
+    Save `pending_work` view and, if `fields` are passed, `projection` view
+    with these fields of auctions.
+    """
+    views = {
+        'pending_work': PENDING_WORK_VIEW_MAP % (
+            BASIC_FEED_TERMINAL_STATUSES, LOKI_FEED_STATUSES,
+            auctions_types.get('basic', []), auctions_types.get('loki', [])
+        )
+    }
+    if fields is not None:
+        views['projection'] = PROJECTION_VIEW_MAP % json.dumps(fields)
+    views_doc = db.get(VIEWS_DOC_ID, {'_id': VIEWS_DOC_ID, 'views': {}})
+    changed = [name for name, map_fun in sorted(views.items())
+               if views_doc['views'].get(name, {}).get('map') != map_fun]
+    for name in changed:
+        views_doc['views'][name] = {'map': views[name]}
+    if changed:
+        db.save(views_doc)
+    for name in sorted(views):
+        LOGGER.info('View \'{}\' {}.'.format(name, 'saved' if name in changed else 'exist'))
+
+
+def pending_work_keys(auctions_types):
+    """Keys of `pending_work` view for all statuses convoy acts on"""
+    keys = []
+    for auction_type in auctions_types.get('basic', []):
+        for status in ['pending.verification'] + BASIC_FEED_TERMINAL_STATUSES:
+            keys.append([auction_type, status])
+    for auction_type in auctions_types.get('loki', []):
+        for status in LOKI_FEED_STATUSES:
+            keys.append([auction_type, status])
+    return keys
+
+
+def pending_work(db, auctions_types, batch=100, fields=None):
+    """
+    Generator of auction documents, waiting for convoy, from
+    `pending_work` view.
+
+    :param db: auctions database
+    :type db: couchdb.Database
+    :param auctions_types: procurementMethodTypes by lot type
+    :type auctions_types: dict
+    :param batch: number of rows fetched per request
+    :type batch: int
+    :param fields: fetch only these fields of documents
+    :type fields: list
+    """
+    selector = convoy_feed_selector(auctions_types) if fields is not None else None
+    for key in pending_work_keys(auctions_types):
+        rows = db.iterview(PENDING_WORK_VIEW, batch, startkey=key, endkey=key,
+                           include_docs=fields is None)
+        if fields is None:
+            for row in rows:
+                if row.doc is not None:
+                    doc = dict(row.doc)
+                    doc.setdefault('id', row.id)
+                    yield doc
+            continue
+        ids = []
+        for row in rows:
+            ids.append({'id': row.id})
+            if len(ids) == batch:
+                for projected in fetch_projected_docs(db, ids, fields, selector):
+                    yield projected['doc']
+                ids = []
+        for projected in fetch_projected_docs(db, ids, fields, selector):
+            yield projected['doc']
+
+
+def convoy_feed_selector(auctions_types):
+    """
+    Build Mango selector with the same semantics as FILTER_CONVOY_FEED_DOC,
+    which CouchDB evaluates natively instead of passing every change to
+    couchjs process.
+
+    :param auctions_types: procurementMethodTypes by lot type
+    :type auctions_types: dict
+    :return: selector for `_selector` changes filter
+    :rtype: dict
+    """
+    basic = auctions_types.get('basic', [])
+    loki = auctions_types.get('loki', [])
+    # filter doc checks truthiness of merchandisingObject, which for
+    # string ids means non-empty string
+    lot_required = {'$gt': ''}
+    return {
+        'doc_type': 'Auction',
+        '$or': [
+            {
+                'procurementMethodType': {'$in': basic},
+                'status': 'pending.verification'
+            },
+            {
+                'procurementMethodType': {'$in': basic},
+                'status': {'$in': BASIC_FEED_TERMINAL_STATUSES},
+                'merchandisingObject': lot_required
+            },
+            {
+                'procurementMethodType': {'$in': loki},
+                'status': {'$in': LOKI_FEED_STATUSES},
+                'merchandisingObject': lot_required
+            },
+        ]
+    }
+
+
+def match_selector(doc, selector):
+    """Evaluate subset of Mango selector, which convoy uses, against doc"""
+    for field, condition in selector.items():
+        if field == '$and':
+            if not all(match_selector(doc, branch) for branch in condition):
+                return False
+            continue
+        if field == '$or':
+            if not any(match_selector(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(field, MISSING)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for operator, argument in condition.items():
+            if operator == '$eq':
+                matched = value == argument
+            elif operator == '$in':
+                matched = value in argument
+            elif operator == '$gt':
+                matched = value is not MISSING and value > argument
+            elif operator == '$exists':
+                matched = (value is not MISSING) == argument
+            else:
+                raise ValueError('Unsupported selector operator {}'.format(operator))
+            if not matched:
+                return False
+    return True
+
+
+def fetch_projected_docs(db, rows, fields, selector=None):
+    """
+    Attach to changes rows documents, which contain only passed fields.
+
+    Documents are read by ids from `projection` view, which emits projected
+    auctions, as Mango `$in` query of ids can not use primary index and
+    scans all of them.
+
+    Documents are read after changes, so they can be newer revisions than
+    ones changes filter passed. With `selector` such documents, which do not
+    match it anymore, are dropped the same way the filter would drop them.
+
+    :param db: auctions database
+    :type db: couchdb.Database
+    :param rows: changes rows without documents
+    :type rows: list
+    :param fields: fields of document to fetch, `projection` view should
+                   emit them
+    :type fields: list
+    :param selector: Mango selector of feed auctions, evaluated by convoy
+    :type selector: dict
+    :return: rows with `doc`, rows of deleted and not matching documents
+             are dropped
+    :rtype: list
+    """
+    ids = [row['id'] for row in rows if not row.get('deleted')]
+    if not ids:
+        return []
+    docs = {}
+    for row in db.view(PROJECTION_VIEW, keys=ids):
+        if selector is None or match_selector(row.value, selector):
+            docs[row.id] = dict((field, value) for field, value in row.value.items() if field in fields)
+    results = []
+    for row in rows:
+        doc = docs.get(row['id'])
+        if doc is None:
+            continue
+        doc.setdefault('id', row['id'])
+        row['doc'] = doc
+        results.append(row)
+    return results
+
+
+def fetch_docs_by_ids(db, ids):
+    """
+    Fetch documents in one `_all_docs` request.
+
+    :param db: auctions database
+    :type db: couchdb.Database
+    :param ids: ids of documents
+    :type ids: list
+    :return: documents by id, missing and deleted documents are absent
+    :rtype: dict
+    """
+    docs = {}
+    if not ids:
+        return docs
+    for row in db.view('_all_docs', keys=list(ids), include_docs=True):
+        doc = row.doc
+        if doc is None:
+            continue
+        doc = dict(doc)
+        doc['id'] = doc['_id']
+        docs[doc['_id']] = doc
+    return docs
+
+
+def get_changes_page(db, since, limit=100, filter_doc=FEED_FILTER_DOC,
+                     selector=None, fields=None, doc_selector=None):
+    """
+    Get one page of filtered changes feed.
+
+    :param db: auctions database
+    :type db: couchdb.Database
+    :param since: sequence to start from
+    :param limit: max number of rows in page
+    :type limit: int
+    :param filter_doc: design doc filter, used if selector is not set
+    :type filter_doc: str
+    :param selector: Mango selector for `_selector` filter
+    :type selector: dict
+    :param fields: fetch only these fields of documents instead of
+                   including full documents into changes
+    :type fields: list
+    :param doc_selector: Mango selector fetched documents should match,
+                         `selector` by default
+    :type doc_selector: dict
+    :return: changes response with `results`, `last_seq` and `received`
+             number of rows before documents were fetched
+    :rtype: dict
+    """
+    params = {'since': since, 'limit': limit, 'include_docs': fields is None}
+    if selector is not None:
+        params['filter'] = FEED_SELECTOR_FILTER
+        params['_selector'] = {'selector': selector}
+    else:
+        params['filter'] = filter_doc
+    data = db.changes(**params)
+    data['received'] = len(data['results'])
+    if fields is not None:
+        data['results'] = fetch_projected_docs(db, data['results'], fields,
+                                               doc_selector or selector)
+    return data
+
+
+class ChangesStream(object):
+    """
+    Changes response, parsed while it is being received. Iteration yields
+    rows as soon as they are decoded, `last_seq` is set after all rows
+    were read.
+
+    CouchDB writes every row of changes on a separate line, so rows are
+    decoded line by line and only one of them is kept in memory. Response
+    of unexpected layout is decoded as a whole, as well as short response,
+    which couchdb-python reads at once and returns as a string.
+    """
+
+    def __init__(self, body, loads=json.loads):
+        self.body = body
+        self.loads = loads
+        self.last_seq = None
+
+    def _lines(self):
+        buffered = ''
+        while True:
+            chunk = self.body.read(CHANGES_STREAM_CHUNK_SIZE)
+            if not chunk:
                 break
+            lines = (buffered + chunk).split('\n')
+            buffered = lines.pop()
+            for line in lines:
+                yield line
+        if buffered:
+            yield buffered
 
-        else:
-            if killer.kill_now:
+    def _decoded(self, text):
+        data = self.loads(text)
+        self.last_seq = data['last_seq']
+        return data['results']
+
+    def __iter__(self):
+        if isinstance(self.body, basestring):
+            for row in self._decoded(self.body):
+                yield row
+            return
+        lines = self._lines()
+        head = ''
+        for line in lines:
+            head = line.strip()
+            if head:
                 break
+        if head != CHANGES_STREAM_HEAD:
+            for row in self._decoded(head + ''.join(lines)):
+                yield row
+            return
+        row = ''
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if not row and line.startswith(']'):
+                tail = (line[1:] + ''.join(lines)).strip().lstrip(',')
+                self.last_seq = self.loads('{' + tail)['last_seq']
+                return
+            row += line
+            try:
+                decoded = self.loads(row.rstrip(','))
+            except ValueError:
+                # row is not complete yet
+                continue
+            row = ''
+            yield decoded
+
+
+def stream_changes_page(db, since, limit=100, filter_doc=FEED_FILTER_DOC,
+                        selector=None, loads=json.loads):
+    """
+    Request one page of filtered changes feed without reading the response.
+
+    :return: rows iterator with `last_seq` attribute
+    :rtype: ChangesStream
+    """
+    params = {'since': since, 'limit': limit, 'include_docs': True}
+    if selector is not None:
+        _, _, body = db.resource.post(
+            '_changes', body={'selector': selector},
+            filter=FEED_SELECTOR_FILTER, **params
+        )
+    else:
+        _, _, body = db.resource.get('_changes', filter=filter_doc, **params)
+    return ChangesStream(body, loads)
+
+
+def coalesce_changes(rows):
+    """
+    Keep only the newest row of every document.
+
+    :param rows: changes rows in order of sequence
+    :type rows: list
+    :return: rows in order of their sequence, without outdated revisions
+    :rtype: list
+    """
+    newest = {}
+    for index, row in enumerate(rows):
+        newest[row.get('id', row['doc'].get('id'))] = index
+    return [row for index, row in enumerate(rows)
+            if newest[row.get('id', row['doc'].get('id'))] == index]
+
+
+def continuous_changes_feed(db, killer, timeout=10, limit=100,
+                            filter_doc=FEED_FILTER_DOC, selector=None,
+                            fields=None, coalesce_window=0, feed_state=None,
+                            stream=False, loads=json.loads, item_factory=Munch,
+                            since=0, doc_selector=None):
+    """
+    Generator of auctions from filtered changes feed.
+
+    :param coalesce_window: if set, read up to this number of rows while
+                            feed is not drained and yield only the newest
+                            revision of every auction from them
+    :type coalesce_window: int
+    :param feed_state: dict, where `last_seq` is saved after all auctions
+                       of page or window were processed
+    :type feed_state: dict
+    :param stream: yield auctions while changes page is being received,
+                   can't be used with `fields` and `coalesce_window`
+    :type stream: bool
+    :param loads: JSON decoder of streamed changes
+    :param item_factory: callable, which makes yielded item from document
+    :param since: sequence to start from
+    :param doc_selector: Mango selector documents fetched with `fields`
+                         should match
+    """
+    last_seq_id = since
+    while CONTINUOUS_CHANGES_FEED_FLAG:
+        if stream:
+            page = stream_changes_page(db, last_seq_id, limit, filter_doc,
+                                       selector, loads)
+            rows = page
+        else:
+            data = get_changes_page(db, last_seq_id, limit, filter_doc,
+                                    selector, fields, doc_selector)
+            rows = list(data['results'])
+            received = data['received']
+            while coalesce_window and data['received'] == limit and len(rows) < coalesce_window:
+                data = get_changes_page(db, data['last_seq'], limit, filter_doc,
+                                        selector, fields, doc_selector)
+                rows += data['results']
+                received += data['received']
+            if coalesce_window:
+                window = len(rows)
+                rows = coalesce_changes(rows)
+                if len(rows) < window:
+                    LOGGER.info(
+                        'Coalesced {} outdated auction revisions'.format(window - len(rows)),
+                        extra={'MESSAGE_ID': 'coalesce_changes',
+                               'COALESCED_EVENTS': window - len(rows)}
+                    )
+        processed = 0
+        for row in rows:
+            processed += 1
+            item = item_factory(row['doc'])
+            yield item
+        if stream:  # streamed rows are not dropped after they are received
+            received = processed
+        last_seq_id = page.last_seq if stream else data['last_seq']
+        if feed_state is not None:
+            feed_state['last_seq'] = last_seq_id
+            feed_state['heartbeat'] = time()
+        if killer.kill_now:
+            break
+        # page, which rows were all dropped by projection, is not the end of feed
+        if not received:
             sleep(timeout)
 
 
+def seq_number(seq):
+    """
+    Numeric part of update sequence, CouchDB 2.x sequences look like
+    `<number>-<opaque string>`.
+    """
+    return int(str(seq).split('-', 1)[0])
+
+
+def parse_date(value):
+    """
+    Convert ISO 8601 date, as API writes it, to unix timestamp. Date without
+    offset is considered UTC.
+
+    :rtype: float
+    :raises ValueError: if date has other format
+    """
+    match = ISO_DATE_RE.match(value)
+    if match is None:
+        raise ValueError('Invalid date {}'.format(value))
+    date, fraction, _, sign, hours, minutes = match.groups()
+    timestamp = timegm(datetime.strptime(date, '%Y-%m-%dT%H:%M:%S').timetuple())
+    if fraction:
+        timestamp += float('0.' + fraction)
+    if sign:
+        offset = int(hours) * 3600 + int(minutes) * 60
+        timestamp -= offset if sign == '+' else -offset
+    return timestamp
+
+
+def parse_seq(value):
+    """
+    Sequence as passed in command line: number of CouchDB 1.x, or opaque
+    string of CouchDB 2.x, which is used as given.
+    """
+    return int(value) if value.isdigit() else value
+
+
+def opaque_seq(seq):
+    """Check if sequence is opaque string of CouchDB 2.x, not a number"""
+    return not isinstance(seq, (int, long))
+
+
+def split_seq_range(since, until, chunks):
+    """
+    Split range of sequences (since, until] into nearly equal chunks.
+
+    Only numeric sequences of CouchDB 1.x can be split. Sequences of
+    CouchDB 2.x are opaque, so their range is one chunk.
+
+    :return: list of (start, end) sequences
+    :rtype: list
+    """
+    if opaque_seq(since) or opaque_seq(until):
+        return [(since, until)]
+    size = max(1, -(-(until - since) // chunks))
+    return [(start, min(start + size, until))
+            for start in range(since, until, size)]
+
+
+def changes_range(db, since, until, limit=100, filter_doc=FEED_FILTER_DOC,
+                  selector=None, fields=None, doc_selector=None):
+    """
+    Generator of filtered changes pages with sequences in (since, until].
+
+    Opaque sequences of CouchDB 2.x can not be compared, so with such
+    `until`, which should be taken from changes feed of the same database,
+    range ends at change or page with exactly this sequence, or at the end
+    of feed.
+
+    :return: pairs of rows and sequence after which page was read
+    """
+    last_seq = since
+    while True:
+        data = get_changes_page(db, last_seq, limit, filter_doc, selector,
+                                fields, doc_selector)
+        if opaque_seq(until):
+            seqs = [row['seq'] for row in data['results']]
+            rows = data['results'][:seqs.index(until) + 1] if until in seqs else data['results']
+            reached = until in seqs or data['last_seq'] == until
+        else:
+            rows = [row for row in data['results']
+                    if seq_number(row['seq']) <= until]
+            reached = seq_number(data['last_seq']) >= until
+        finished = (len(rows) < len(data['results']) or
+                    not data['received'] or reached)
+        last_seq = rows[-1]['seq'] if rows and finished else data['last_seq']
+        yield rows, last_seq
+        if finished:
+            break
+
+
 def init_clients(config):
     sections = ['auctions', 'lots', 'assets', 'contracts']
     sections = [section for section in sections if config.get(section)]
@@ -256,17 +1088,39 @@ def init_clients(config):
         result = ('failed', e)
     LOGGER.check('auctions_mapping - {}'.format(result[0]), result[1])
 
+    # Lots locker check
+    try:
+        clients_from_config['lots_locker'] = LotsLocker(
+            config.get('lots_locker', {})
+        )
+        if clients_from_config['lots_locker'].db is not None:
+            clients_from_config['lots_locker'].db.ping()
+        result = ('ok', None)
+    except Exception as e:
+        exceptions.append(e)
+        result = ('failed', e)
+    LOGGER.check('lots_locker - {}'.format(result[0]), result[1])
+
     if exceptions:
         raise exceptions[0]
 
     return clients_from_config
 
 
+def retryable(exception):
+    """Check if request failed with error, which should be retried later"""
+    return isinstance(exception, EXCEPTIONS) and (
+        exception.status_code >= 500 or
+        exception.status_code in [409, 412, 429]
+    )
+
+
 def retry_on_error(exception):
-    if isinstance(exception, EXCEPTIONS) and (
-            exception.status_code >= 500 or
-            exception.status_code in [409, 412, 429]
-    ):
+    if retryable(exception):
+        RETRIES[exception.status_code] = RETRIES.get(exception.status_code, 0) + 1
+        TRACER.event('retry', 'client', status=exception.status_code)
+        LOGGER.info('Retry request after %s error', exception.status_code,
+                    extra={'MESSAGE_ID': 'client_retry', 'STATUS': exception.status_code})
         return True
     return False
 
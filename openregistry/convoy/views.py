@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from openregistry.convoy.constants import (
+    ASSET_VIEW_FIELDS,
+    FEED_DOC_FIELDS,
+    LOT_VIEW_FIELDS,
+)
+
+
+class ResourceView(object):
+    """
+    Compact read-only view of resource, which keeps only fields read by
+    convoy. Fields are available both as attributes and as items, like in
+    Munch. Full document is loaded with `loader` on first access to `raw`
+    or to any other field.
+    """
+    __slots__ = ('_loader', '_raw')
+    fields = ()
+
+    def __init__(self, data, loader=None):
+        for field in self.fields:
+            if field in data:
+                object.__setattr__(self, field, data[field])
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_raw', None)
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            if self._loader is None:
+                raise AttributeError('Full document of {} is not available'.format(
+                    type(self).__name__))
+            object.__setattr__(self, '_raw', self._loader())
+        return self._raw
+
+    def __getattr__(self, key):
+        # called for unset slots and for fields not kept by view
+        if key in self.fields or key.startswith('_') or key == 'raw':
+            raise AttributeError(key)
+        try:
+            return self.raw[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def __delattr__(self, key):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def __contains__(self, key):
+        if key in self.fields:
+            return hasattr(self, key)
+        try:
+            return key in self.raw
+        except AttributeError:
+            return False
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, AttributeError):
+            return default
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, {
+            field: getattr(self, field) for field in self.fields if hasattr(self, field)
+        })
+
+
+class AuctionView(ResourceView):
+    __slots__ = tuple(FEED_DOC_FIELDS)
+    fields = frozenset(FEED_DOC_FIELDS)
+
+    def __init__(self, data, loader=None):
+        super(AuctionView, self).__init__(data, loader)
+        # CouchDB documents are identified by `_id` only
+        if 'id' not in data and '_id' in data:
+            object.__setattr__(self, 'id', data['_id'])
+
+
+class LotView(ResourceView):
+    __slots__ = tuple(LOT_VIEW_FIELDS)
+    fields = frozenset(LOT_VIEW_FIELDS)
+
+
+class AssetView(ResourceView):
+    __slots__ = tuple(ASSET_VIEW_FIELDS)
+    fields = frozenset(ASSET_VIEW_FIELDS)
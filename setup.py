@@ -27,7 +27,9 @@ extras_requires = {
 
 entry_points = {
     'console_scripts': [
-        'openregistry_convoy = openregistry.convoy.convoy:main'
+        'openregistry_convoy = openregistry.convoy.convoy:main',
+        'openregistry_convoy_record = openregistry.convoy.replay:main',
+        'openregistry_convoy_benchmarks = openregistry.convoy.benchmarks.suite:main'
     ],
     'openregistry.tests': [
         'convoy = openregistry.convoy.tests.main:suite'